@@ -1,4 +1,5 @@
 import os
 
 _PKG_DIR = os.path.dirname(os.path.abspath(__file__))
-MAIN_SCRIPT_PATH = os.path.join(_PKG_DIR, "agentgdb.py") 
\ No newline at end of file
+MAIN_SCRIPT_PATH = os.path.join(_PKG_DIR, "agentgdb.py")
+DAEMON_SCRIPT_PATH = os.path.join(_PKG_DIR, "daemon.py")
\ No newline at end of file
@@ -5,6 +5,20 @@ import types
 import importlib
 import re
 import configparser
+import json
+import hashlib
+import io
+import tempfile
+import math
+import time
+import threading
+import concurrent.futures
+import queue
+import socket
+import shutil
+import codecs
+import atexit
+from collections import OrderedDict, Counter, deque
 
 # --- Constants ---
 
@@ -20,15 +34,179 @@ DEFAULT_OPENAI_BASE_URL = "http://localhost:1234/v1"
 DEFAULT_LLM_MODEL_IDENTIFIER = "model-identifier"
 
 NO_VALID_COMMAND_MARKER = "# No valid command"
+LIST_OF_COMMANDS_MARKER = "List of commands:"
+
+# Appended to the stage 1 and 3 system prompts when the answer is constrained by a JSON schema
+STRUCTURED_OUTPUT_INSTRUCTION = "\n\nRespond only with a JSON object of the form {{\"{key}\": \"<answer>\"}}, with no summary or other text.\n"
+STRUCTURED_OUTPUT_MAX_TOKENS = 64 # Enough for the JSON object, unless [StageN] max_tokens says otherwise
+# Appended to the user query when a stage 1 or 3 answer failed validation
+CHOICE_RETRY_TEMPLATE = "\n\nYour previous answer was '{answer}', which is not valid. Answer with exactly one of: {choices}."
+
+# The GDB command classes that stage 1 may choose from
+SUPPORTED_COMMAND_CLASSES = [
+  "breakpoints", "data", "files", "internals", "obscure", "running",
+  "stack", "status", "support", "text-user-interface", "tracepoints", "user-defined"
+]
 
 PROMPT_FILES_DIR = os.path.join(_BASE_DIR, "system_prompts")
 STAGE1_PROMPT_FILE = os.path.join(PROMPT_FILES_DIR, "stage1.md")
 STAGE3_PROMPT_FILE = os.path.join(PROMPT_FILES_DIR, "stage3.md")
 STAGE5_PROMPT_FILE = os.path.join(PROMPT_FILES_DIR, "stage5.md")
+FAST_PROMPT_FILE = os.path.join(PROMPT_FILES_DIR, "fast.md")
+ITERATE_PROMPT_FILE = os.path.join(PROMPT_FILES_DIR, "iterate.md")
 
 CONFIG_FILE_PATH = os.path.expanduser("~/.agentgdb_config.ini")
 CREDENTIALS_SECTION = "Credentials"
 DEBUG_SECTION = "Debug"
+CACHE_SECTION = "Cache"
+RETRIEVAL_SECTION = "Retrieval"
+PIPELINE_SECTION = "Pipeline"
+STARTUP_SECTION = "Startup"
+CONNECTION_SECTION = "Connection"
+STATS_SECTION = "Stats"
+BATCH_SECTION = "Batch"
+DAEMON_SECTION = "Daemon"
+TEMPLATES_SECTION = "Templates"
+VALIDATION_SECTION = "Validation"
+DISPLAY_SECTION = "Display"
+EXECUTION_SECTION = "Execution"
+CONTEXT_SECTION = "Context"
+
+# On-disk caches live here unless overridden in the config file
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/agentgdb")
+QUERY_CACHE_FILE_NAME = "query_cache.json"
+QUERY_CACHE_FORMAT_VERSION = 1
+QUERY_CACHE_JOURNAL_FILE_NAME = "query_cache.log" # New entries, one JSON line each, since the file was last written
+DEFAULT_QUERY_CACHE_MAX_ENTRIES = 512
+HELP_INDEX_FILE_NAME = "help_index.json"
+HELP_INDEX_FORMAT_VERSION = 1
+TEMPLATE_STORE_FILE_NAME = "templates.json"
+TEMPLATE_STORE_FORMAT_VERSION = 1
+DEFAULT_TEMPLATE_MAX_ENTRIES = 256
+SOURCE_FILE_EXTENSIONS = "c|h|cc|cpp|cxx|hh|hpp|hxx|s|S|rs|go|f|f90|d|m|mm|zig|py" # Regex alternation
+# Slot kinds of a command template, in the order a value is tried against them
+TEMPLATE_SLOT_KINDS = [
+  ("NUM", re.compile(r"(?:0x[0-9a-fA-F]+|-?\d+)")),
+  ("FILE", re.compile(r"[\w.+-]*/[\w.+/-]*|[\w+-][\w.+-]*\.(?:" + SOURCE_FILE_EXTENSIONS + ")")),
+  ("NAME", re.compile(r"[A-Za-z_]\w*(?:(?:\.|->|::)\w+)*")),
+]
+# Keywords of breakpoint locations and conditions; like subcommands, they stay literal in templates
+TEMPLATE_LITERAL_WORDS = {"if", "thread", "task", "-force-condition", "-qualified", "-source", "-function",
+                          "-line", "-label", "-force", "inferior"}
+TEMPLATE_SLOT_PATTERN = re.compile(r"\{(NUM|FILE|NAME)\d+\}")
+TEMPLATE_TOKEN_PUNCTUATION = ".,;?!'\"()"
+SYS_PATH_CACHE_FILE_NAME = "sys_path.json"
+
+# When the OpenAI client is set up: "background" starts it in a thread while GDB starts,
+# "lazy" waits for the first query, "eager" blocks startup until it is ready.
+CLIENT_SETUP_BACKGROUND = "background"
+CLIENT_SETUP_LAZY = "lazy"
+CLIENT_SETUP_EAGER = "eager"
+CLIENT_SETUP_MODES = [CLIENT_SETUP_BACKGROUND, CLIENT_SETUP_LAZY, CLIENT_SETUP_EAGER]
+
+# HTTP connection pool of the OpenAI client
+DEFAULT_MAX_CONNECTIONS = 10
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 5
+DEFAULT_KEEPALIVE_EXPIRY = 300.0 # Seconds an idle pooled connection is kept open
+DEFAULT_KEEPALIVE_PING_INTERVAL = 0.0 # Seconds of idleness between pings; 0 disables pinging
+DEFAULT_HEDGE_DELAY = 1.0 # Seconds without a token before a request is duplicated to the next endpoint; 0 disables
+DEFAULT_CIRCUIT_FAILURES = 3 # Consecutive failures that take an endpoint out of rotation
+DEFAULT_CIRCUIT_COOLDOWN = 30.0 # Seconds before an endpoint that failed is tried again
+ENDPOINT_TTFT_SMOOTHING = 0.3 # Weight of the newest sample in an endpoint's average time to first token
+WARMUP_USER_MESSAGE = "warmup"
+WARMUP_PROMPT_STAGES = {"iterate": "stage5"} # Prompts sent with another stage's client and model
+
+# Instrumentation
+STATS_MAX_SAMPLES = 1000 # Most recent samples kept per metric for percentiles
+STATS_PERCENTILES = [50, 90, 99]
+CHARS_PER_TOKEN_ESTIMATE = 4 # Used when the server does not report token usage
+
+DEFAULT_BATCH_MAX_WORKERS = 4 # Concurrent LLM pipelines in agent-batch
+DEFAULT_DAEMON_SOCKET = os.path.join(DEFAULT_CACHE_DIR, "daemon.sock") # Same default as daemon.py
+DAEMON_CONNECT_TIMEOUT = 1.0 # Seconds to connect to the daemon and send a request
+DAEMON_RETRY_INTERVAL = 30.0 # Seconds to call the LLM server directly after the daemon could not be reached
+
+# Per-stage generation settings, configured in sections named after the stage ([Stage1], ...)
+STAGE_SECTIONS = {
+  "stage1": "Stage1",
+  "stage3": "Stage3",
+  "stage5": "Stage5",
+  "fast": "Fast",
+}
+# Bounds on the GDB help pasted into a stage's prompt (0 disables), see prune_class_help()
+DEFAULT_STAGE_HELP_MAX_TOKENS = {
+  "stage1": 0,
+  "stage3": 1000,
+  "stage5": 1500,
+  "fast": 0, # Fast mode bounds each candidate with [Pipeline] fast_help_chars instead
+}
+DEFAULT_STAGE3_HELP_MAX_COMMANDS = 25
+DEFAULT_TEMPERATURE = 0.0
+DEFAULT_QUERY_DEADLINE = 120.0 # Seconds a whole query may take; 0 disables the deadline
+DEFAULT_LLM_RETRIES = 1 # Extra attempts for an LLM request that failed or timed out
+DEFAULT_RETRY_BACKOFF = 0.5 # Seconds before the first retry, doubled for each further one
+# How the time left is shared between the LLM stages still to run
+STAGE_BUDGET_WEIGHTS = {"stage1": 1.0, "stage3": 1.0, "stage5": 2.0, "fast": 1.0}
+PIPELINE_STAGE_ORDER = {"accurate": ["stage1", "stage3", "stage5"], "fast": ["fast"]}
+RETRYABLE_OUTCOMES = ("error", "timeout")
+DEFAULT_RENDER_INTERVAL = 0.05 # Seconds between terminal writes of streamed tokens
+DEFAULT_RENDER_BYTES = 256 # Buffered characters that force a write sooner
+
+# Commands whose argument is a location (function, FILE:LINE, ...) or an expression; the
+# names in them are checked against the program's symbols before the command runs
+LOCATION_COMMANDS = {"break", "b", "br", "tbreak", "tb", "until", "u", "advance", "list", "l", "dprintf",
+                     "jump", "disassemble", "info line", "info scope", "info symbol"}
+EXPRESSION_COMMANDS = {"print", "p", "inspect", "output", "call", "display", "watch", "rwatch", "awatch",
+                       "ptype", "whatis", "x", "set var", "set variable"}
+EXPRESSION_KEYWORDS = {"sizeof", "alignof", "typeof", "struct", "union", "enum", "class", "unsigned", "signed",
+                       "int", "char", "short", "long", "float", "double", "void", "bool", "const", "volatile",
+                       "true", "false", "nullptr", "NULL", "this"}
+SOURCE_FILE_LOCATION = re.compile(r"[\w./+-]+\.(?:" + SOURCE_FILE_EXTENSIONS + r")$")
+MAX_REPAIR_CANDIDATES = 20 # Names in scope listed in a repair query
+REPAIR_NOTE_TEMPLATE = "\n\nThe command `{command}` refers to {names}, which the program being debugged does not have.{candidates} Generate the command again using names that exist."
+# Commands that read the lines after them up to a matching 'end'; a bare script command
+# ('python' without arguments) does too, but nothing in its body nests
+CLI_BLOCK_COMMANDS = {"commands", "if", "while", "define", "document"}
+SCRIPT_BLOCK_COMMANDS = {"python", "py", "guile", "gu"}
+DEFAULT_MAX_OUTPUT_BYTES = 16384 # Output of one command kept for the model; the middle of longer output is dropped
+DEFAULT_ITERATION_STEPS = 3 # Command blocks an iterative query may run, the first one included
+DEFAULT_SUMMARY_TOKENS = 500 # Size of the output summary sent with each follow-up query
+ITERATION_DONE_MARKER = "# Done"
+DEFAULT_STATE_MAX_TOKENS = 150 # Size of the program-state digest added to generation prompts
+MAX_STATE_VALUE_CHARS = 48 # A longer argument or local value is cut
+DEFAULT_STAGE_MAX_TOKENS = {
+  "stage1": None, # None leaves the limit to the server
+  "stage3": None,
+  "stage5": None,
+  "fast": None,
+}
+
+# Local retrieval (stages 1 and 3 without the LLM)
+DEFAULT_RETRIEVAL_CONFIDENCE_THRESHOLD = 0.35
+RETRIEVAL_BM25_K1 = 1.2
+RETRIEVAL_BM25_B = 0.75
+RETRIEVAL_NAME_WEIGHT = 3 # Command names count this many times more than summary words
+RETRIEVAL_STOPWORDS = {
+  "a", "an", "the", "of", "to", "in", "on", "at", "for", "and", "or", "is", "are", "be",
+  "me", "my", "i", "it", "its", "this", "that", "all", "with", "from", "by", "as", "what",
+  "please", "can", "you", "current", "currently", "do", "does", "how", "which", "when",
+}
+# Everyday words mapped to the GDB vocabulary used in command names and help summaries
+RETRIEVAL_SYNONYMS = {
+  "show": ["info"], "list": ["info"], "status": ["info"],
+  "stop": ["break"], "pause": ["break"],
+  "callstack": ["backtrace"], "stacktrace": ["backtrace"], "bt": ["backtrace"],
+  "resume": ["continue"], "restart": ["run"], "start": ["run"],
+  "variable": ["print"], "value": ["print"], "evaluate": ["print"],
+  "remove": ["delete"],
+}
+# Pipeline modes: "accurate" runs the five-stage chain, "fast" makes a single LLM call
+PIPELINE_MODE_ACCURATE = "accurate"
+PIPELINE_MODE_FAST = "fast"
+PIPELINE_MODES = [PIPELINE_MODE_ACCURATE, PIPELINE_MODE_FAST]
+DEFAULT_FAST_CANDIDATES = 5
+DEFAULT_FAST_HELP_CHARS = 1200 # Per-candidate bound on the help excerpt sent in fast mode
+DEFAULT_SPECULATIVE_TOP_K = 2 # Classes whose stage 3 runs alongside stage 1 in speculative mode
 
 # --- Global Variables ---
 g_openai_client = None
@@ -40,7 +218,124 @@ g_system_prompts = {
     "stage1": None,
     "stage3": None,
     "stage5": None,
+    "fast": None,
+    "iterate": None,
+}
+
+g_cache_dir = DEFAULT_CACHE_DIR
+g_query_cache_enabled = True
+g_query_cache_max_entries = DEFAULT_QUERY_CACHE_MAX_ENTRIES
+g_query_cache = None # OrderedDict of key -> entry, least recently used first; loaded lazily
+g_query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+g_query_cache_lock = threading.RLock() # Async queries use the cache from worker threads
+g_query_cache_journal_entries = 0 # Lines in the journal; the cache file is rewritten once they reach the size bound
+
+g_templates_enabled = True
+g_template_max_entries = DEFAULT_TEMPLATE_MAX_ENTRIES
+g_template_store = None # pattern key -> template entry, see learn_template(); loaded lazily
+g_template_index = None # (number of tokens, first token or None) -> pattern keys
+g_template_lock = threading.RLock() # Held while the store is read or changed; async queries match templates off the GDB thread
+
+# Parsed GDB help, see load_help_index() for the layout
+g_help_index = None
+g_help_index_stale = True # Set when new objfiles (and their auto-loaded extensions) appear
+
+g_validation_enabled = True # Check generated commands against the program's symbols, see validate_command()
+g_validation_repair = True # Ask the model once to fix a command naming unknown symbols
+# Index of the program's names, read from each objfile's symtabs on first use and extended as
+# objfiles are added (see index_new_objfiles()); emptied only when all objfiles are cleared
+g_symbol_index = set() # Functions, global and static variables and types
+g_source_file_index = set() # Source file names as GDB lists them
+g_source_file_basenames = set()
+g_indexed_objfiles = set() # File names of the objfiles already in the index
+g_symbol_misses = set() # Names neither the index nor GDB's minimal symbols have; retried after new objfiles
+
+g_state_enabled = True # Add a digest of where the program stopped to generation prompts, see program_state_digest()
+g_state_max_tokens = DEFAULT_STATE_MAX_TOKENS
+# Kept up to date by GDB's stop, cont, new_thread and exited events
+g_program_state = {"reason": None, "thread_count": None}
+g_frame_state_cache = {} # (thread, frame level, pc) -> describe_frame() result. Emptied when the inferior resumes.
+
+g_retrieval_enabled = False
+g_retrieval_confidence_threshold = DEFAULT_RETRIEVAL_CONFIDENCE_THRESHOLD
+g_retrieval_index = None # BM25 statistics over the help index, see build_retrieval_index()
+
+g_pipeline_mode = PIPELINE_MODE_ACCURATE
+g_fast_candidates = DEFAULT_FAST_CANDIDATES
+g_fast_help_chars = DEFAULT_FAST_HELP_CHARS
+
+g_client_setup_mode = CLIENT_SETUP_BACKGROUND
+g_client_setup_lock = threading.Lock() # Serializes client setup between the background thread and queries
+g_sys_path_extended = False
+g_startup_timings = {} # Step name -> seconds, reported by 'agent-startup'
+
+g_max_connections = DEFAULT_MAX_CONNECTIONS
+g_max_keepalive_connections = DEFAULT_MAX_KEEPALIVE_CONNECTIONS
+g_keepalive_expiry = DEFAULT_KEEPALIVE_EXPIRY
+g_keepalive_ping_interval = DEFAULT_KEEPALIVE_PING_INTERVAL
+g_warmup_on_startup = False
+g_last_llm_activity = 0.0 # time.monotonic() of the last request sent to the LLM server
+g_keepalive_thread = None
+
+# Stage -> {"max_tokens", "stop", "early_stop", "help_max_tokens", "help_max_commands",
+#           "model", "base_url", "base_urls", "api_key", "temperature", "timeout"}, see load_stage_configuration().
+# model, base_url(s) and api_key default (None) to the [Credentials] ones.
+g_stage_settings = {
+  stage: {"max_tokens": DEFAULT_STAGE_MAX_TOKENS[stage], "stop": None, "early_stop": True,
+          "help_max_tokens": DEFAULT_STAGE_HELP_MAX_TOKENS[stage], "help_max_commands": DEFAULT_STAGE3_HELP_MAX_COMMANDS,
+          "model": None, "base_url": None, "base_urls": None, "api_key": None, "temperature": DEFAULT_TEMPERATURE, "timeout": None}
+  for stage in STAGE_SECTIONS
 }
+g_stage_clients = {} # (base_url, api_key) -> OpenAI client for every endpoint but the default one
+g_stage_clients_lock = threading.Lock()
+
+g_openai_base_urls = [] # All [Credentials] base_url endpoints; g_openai_base_url is the first
+g_hedge_delay = DEFAULT_HEDGE_DELAY
+g_circuit_failures = DEFAULT_CIRCUIT_FAILURES
+g_circuit_cooldown = DEFAULT_CIRCUIT_COOLDOWN
+g_endpoint_health_lock = threading.Lock()
+g_endpoint_health = {} # base_url -> {"requests", "errors", "failures", "open_until", "ttft", "hedges_won"}
+
+g_stats_trace_file = None # JSONL file that receives one record per query, if configured
+g_stats_request_usage = False # Ask the server for exact token counts (stream_options.include_usage)
+g_trace_local = threading.local() # .trace holds the record of the query running on this thread
+g_stats_lock = threading.Lock()
+g_stats = None # Aggregates, see reset_stats()
+
+g_batch_max_workers = DEFAULT_BATCH_MAX_WORKERS
+g_render_interval = DEFAULT_RENDER_INTERVAL
+g_render_bytes = DEFAULT_RENDER_BYTES
+g_render_quiet = False # Stream no tokens; only the final command is shown
+g_active_renderer = None # TokenRenderer of the request streaming now; flushed before other output
+
+g_max_output_bytes = DEFAULT_MAX_OUTPUT_BYTES
+g_stop_on_error = False # Skip the rest of a command block once one of its commands failed
+g_iterative_enabled = False # Feed command output back to the model for follow-up commands
+g_iteration_steps = DEFAULT_ITERATION_STEPS
+g_summary_tokens = DEFAULT_SUMMARY_TOKENS
+
+g_worker_local = threading.local() # .echo = False silences token streaming; .job is the AsyncJob run by this thread
+
+g_daemon_enabled = False # Send LLM requests through the shared daemon (agentgdb/daemon.py)
+g_daemon_socket = DEFAULT_DAEMON_SOCKET
+g_daemon_down_until = 0.0 # time.monotonic() until which the daemon is not tried again
+g_daemon_stats = Counter() # Requests relayed by the daemon, and fallbacks to in-process calls
+
+g_async_enabled = False # Run agent/ask queries on a worker thread, see start_async_query()
+g_async_job = None # The AsyncJob in progress; only the GDB thread changes this
+g_async_suggestion = None # (query, command, cache key, learnable) from an async 'ask', waiting for agent-accept
+
+g_speculative_enabled = False
+g_speculative_top_k = DEFAULT_SPECULATIVE_TOP_K
+g_speculative_executor = None # ThreadPoolExecutor, created on first speculative query
+g_speculation_stats = {"hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+g_query_deadline = DEFAULT_QUERY_DEADLINE
+g_llm_retries = DEFAULT_LLM_RETRIES
+g_retry_backoff = DEFAULT_RETRY_BACKOFF
+
+g_structured_output = False # Constrain stage 1 and 3 answers with a response_format JSON schema
+g_structured_output_supported = True # Cleared when the server rejects response_format
 
 def format_llm_text(text):
     """Format text as 'light' for LLM output display."""
@@ -51,6 +346,84 @@ def print_llm(text):
     sys.stdout.write(format_llm_text(text))
     sys.stdout.flush()
 
+class TokenRenderer(object):
+    """
+    Shows streamed LLM tokens with print_llm, batched: buffered text is written once
+    g_render_bytes characters have piled up or g_render_interval seconds after the oldest of
+    it arrived, so fast models and piped output cost one write per batch, not per token. A
+    flusher thread writes the buffer on time when the model pauses and no token comes to do it.
+    """
+    def __init__(self):
+        global g_active_renderer
+        self.parts = []
+        self.size = 0
+        self.oldest = None # When the oldest buffered part arrived
+        self.shown = False
+        self.finished = False
+        self.flusher = None
+        self.idle = False # The flusher waits for text without a deadline and must be woken
+        self.cond = threading.Condition(threading.Lock())
+        g_active_renderer = self
+
+    def write(self, text):
+        with self.cond:
+            now = time.perf_counter()
+            if not self.parts:
+                self.oldest = now
+                if self.idle:
+                    self.cond.notify()
+            self.parts.append(text)
+            self.size += len(text)
+            if self.size >= g_render_bytes or now - self.oldest >= g_render_interval:
+                self.write_buffer()
+            elif self.flusher is None:
+                self.flusher = threading.Thread(target=self.run_flusher, name="agentgdb-render", daemon=True)
+                self.flusher.start()
+
+    def run_flusher(self):
+        with self.cond:
+            while not self.finished:
+                if not self.parts:
+                    self.idle = True
+                    self.cond.wait()
+                    self.idle = False
+                    continue
+                remaining = self.oldest + g_render_interval - time.perf_counter()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                else:
+                    self.write_buffer()
+
+    def flush(self):
+        with self.cond:
+            self.write_buffer()
+
+    def write_buffer(self):
+        """Writes the buffered text; the caller holds self.cond."""
+        if self.parts:
+            print_llm("".join(self.parts))
+            self.parts = []
+            self.size = 0
+            self.shown = True
+
+    def finish(self):
+        """Writes what is left and ends the line, if anything was shown."""
+        global g_active_renderer
+        with self.cond:
+            self.finished = True
+            self.cond.notify()
+            self.write_buffer()
+        if g_active_renderer is self:
+            g_active_renderer = None
+        if self.shown:
+            print("")
+
+def flush_active_renderer():
+    """Writes buffered LLM tokens before other output, so messages never land inside them."""
+    renderer = g_active_renderer
+    if renderer is not None:
+        renderer.flush()
+
 def format_error_text(text):
     """Format text as 'error' for terminal display."""
     if text.startswith("[AgentGDB] "):
@@ -59,6 +432,7 @@ def format_error_text(text):
 
 def print_error(text):
     """Print text in error formatting, immediately flushing output."""
+    flush_active_renderer()
     sys.stderr.write(format_error_text(text))
     sys.stderr.write("\n")
     sys.stderr.flush()
@@ -66,6 +440,7 @@ def print_error(text):
 def print_verbose(text):
     """Print verbose debug information, only if VERBOSE is True."""
     if VERBOSE:
+        flush_active_renderer()
         sys.stdout.write(text)
         sys.stdout.write("\n")
         sys.stdout.flush()
@@ -82,6 +457,8 @@ def load_system_prompts():
     "stage1": STAGE1_PROMPT_FILE,
     "stage3": STAGE3_PROMPT_FILE,
     "stage5": STAGE5_PROMPT_FILE,
+    "fast": FAST_PROMPT_FILE,
+    "iterate": ITERATE_PROMPT_FILE,
   }
   for stage, filepath in prompt_map.items():
     try:
@@ -96,13 +473,18 @@ def load_system_prompts():
       return False
   return True
 
+def split_endpoints(value):
+  """Splits a comma-separated base_url setting into its endpoints."""
+  return [url.strip() for url in value.split(",") if url.strip()]
+
 def load_plugin_configuration():
   """Loads API key, base URL, model ID, and verbose setting from the config file, using defaults if not found."""
-  global g_openai_api_key, g_openai_base_url, g_llm_model_identifier, VERBOSE
+  global g_openai_api_key, g_openai_base_url, g_openai_base_urls, g_llm_model_identifier, VERBOSE
 
   # Initialize with default values
   g_openai_api_key = DEFAULT_OPENAI_API_KEY
   g_openai_base_url = DEFAULT_OPENAI_BASE_URL
+  g_openai_base_urls = [DEFAULT_OPENAI_BASE_URL]
   g_llm_model_identifier = DEFAULT_LLM_MODEL_IDENTIFIER
   # VERBOSE is already initialized at the module level
 
@@ -126,7 +508,9 @@ def load_plugin_configuration():
 
         temp_base_url = config.get(CREDENTIALS_SECTION, 'base_url', fallback=None)
         if temp_base_url is not None:
-            g_openai_base_url = temp_base_url
+            # A comma-separated list names equivalent servers; the first is preferred
+            g_openai_base_urls = split_endpoints(temp_base_url)
+            g_openai_base_url = g_openai_base_urls[0] if g_openai_base_urls else ""
             loaded_from_config["base_url"] = True
 
         temp_model_id = config.get(CREDENTIALS_SECTION, 'model_identifier', fallback=None)
@@ -155,6 +539,21 @@ def load_plugin_configuration():
     else:
         print(f"[AgentGDB] Info: '[{DEBUG_SECTION}]' section not found in {CONFIG_FILE_PATH}. Verbose mode disabled.")
 
+    load_cache_configuration(config)
+    load_retrieval_configuration(config)
+    load_pipeline_configuration(config)
+    load_startup_configuration(config)
+    load_connection_configuration(config)
+    load_stage_configuration(config)
+    load_stats_configuration(config)
+    load_batch_configuration(config)
+    load_daemon_configuration(config)
+    load_templates_configuration(config)
+    load_validation_configuration(config)
+    load_display_configuration(config)
+    load_execution_configuration(config)
+    load_context_configuration(config)
+
     # Final check to ensure that values (either default or loaded) are not empty if they are critical
     # For now, we assume defaults are valid and non-empty. If defaults could be empty, add checks here.
     if not g_openai_api_key or not g_openai_base_url or not g_llm_model_identifier:
@@ -174,282 +573,3602 @@ def load_plugin_configuration():
     print_error(f"An unexpected error occurred while loading configuration: {e}. Using default settings.")
     return True # Proceed with defaults
 
-def ensure_openai_client_ready():
-  """
-  Initializes the OpenAI client and loads system prompts if not already done.
-  Returns True if successful, False otherwise.
-  """
-  global g_openai_client, g_openai_api_key, g_openai_base_url, g_llm_model_identifier
+def load_cache_configuration(config):
+  """Applies the optional [Cache] section of an already-read config."""
+  global g_cache_dir, g_query_cache_enabled, g_query_cache_max_entries
+  if CACHE_SECTION not in config:
+    return
+  g_cache_dir = os.path.expanduser(config.get(CACHE_SECTION, 'directory', fallback=DEFAULT_CACHE_DIR))
+  g_query_cache_enabled = config.getboolean(CACHE_SECTION, 'query_cache', fallback=True)
+  g_query_cache_max_entries = config.getint(CACHE_SECTION, 'query_cache_max_entries', fallback=DEFAULT_QUERY_CACHE_MAX_ENTRIES)
+  print_verbose(f"[AgentGDB] Query cache {'enabled' if g_query_cache_enabled else 'disabled'} (max {g_query_cache_max_entries} entries, directory {g_cache_dir}).")
 
-  # Check if we need to load configuration
-  if not (g_openai_api_key and g_openai_base_url and g_llm_model_identifier):
-      print_verbose("Loading plugin configuration...")
-      if not load_plugin_configuration():
-          print_error("Failed to load plugin configuration. Aborting OpenAI client setup.")
-          return False
-      print_verbose("Plugin configuration processed (defaults or loaded).")
+def load_retrieval_configuration(config):
+  """Applies the optional [Retrieval] section of an already-read config."""
+  global g_retrieval_enabled, g_retrieval_confidence_threshold
+  if RETRIEVAL_SECTION not in config:
+    return
+  g_retrieval_enabled = config.getboolean(RETRIEVAL_SECTION, 'enabled', fallback=False)
+  g_retrieval_confidence_threshold = config.getfloat(RETRIEVAL_SECTION, 'confidence_threshold', fallback=DEFAULT_RETRIEVAL_CONFIDENCE_THRESHOLD)
+  print_verbose(f"[AgentGDB] Local retrieval {'enabled' if g_retrieval_enabled else 'disabled'} (confidence threshold {g_retrieval_confidence_threshold}).")
 
-  if g_openai_client is None:
-    print_verbose("Setting up OpenAI client...")
-    # Extend Python search path for site-packages only when needed
-    if not hasattr(ensure_openai_client_ready, 'path_extended'):
-      try:
-        import subprocess
-        # Use sys.executable to ensure we're using the same python interpreter
-        paths_str = subprocess.check_output(["python", '-c', "import os,sys;print(os.linesep.join(sys.path).strip())"]).decode("utf-8")
-        paths = paths_str.split(os.linesep)
-        for p in paths:
-            if p not in sys.path: # Avoid duplicates
-                sys.path.append(p)
-        ensure_openai_client_ready.path_extended = True
-      except subprocess.CalledProcessError as e:
-        print_error(f"Error extending Python path: {e}")
-        return False
-      except Exception as e:
-        print_error(f"An unexpected error occurred while extending Python path: {e}")
-        return False
-    try:
-      from openai import OpenAI as OpenAIClient
-    except ImportError:
-      print_error("Error: OpenAI package not found. Please install it using: pip install openai")
-      raise
+def load_pipeline_configuration(config):
+  """Applies the optional [Pipeline] section of an already-read config."""
+  global g_pipeline_mode, g_fast_candidates, g_fast_help_chars
+  global g_speculative_enabled, g_speculative_top_k, g_async_enabled, g_structured_output
+  global g_query_deadline, g_llm_retries, g_retry_backoff
+  if PIPELINE_SECTION not in config:
+    return
+  mode = config.get(PIPELINE_SECTION, 'mode', fallback=PIPELINE_MODE_ACCURATE).strip().lower()
+  if mode not in PIPELINE_MODES:
+    print_error(f"Unknown pipeline mode '{mode}' in {CONFIG_FILE_PATH}, expected one of: {', '.join(PIPELINE_MODES)}. Using '{PIPELINE_MODE_ACCURATE}'.")
+    mode = PIPELINE_MODE_ACCURATE
+  g_pipeline_mode = mode
+  g_fast_candidates = config.getint(PIPELINE_SECTION, 'fast_candidates', fallback=DEFAULT_FAST_CANDIDATES)
+  g_fast_help_chars = config.getint(PIPELINE_SECTION, 'fast_help_chars', fallback=DEFAULT_FAST_HELP_CHARS)
+  g_speculative_enabled = config.getboolean(PIPELINE_SECTION, 'speculative', fallback=False)
+  g_speculative_top_k = config.getint(PIPELINE_SECTION, 'speculative_top_k', fallback=DEFAULT_SPECULATIVE_TOP_K)
+  g_async_enabled = config.getboolean(PIPELINE_SECTION, 'async', fallback=False)
+  g_structured_output = config.getboolean(PIPELINE_SECTION, 'structured_output', fallback=False)
+  g_query_deadline = config.getfloat(PIPELINE_SECTION, 'deadline', fallback=DEFAULT_QUERY_DEADLINE)
+  g_llm_retries = max(0, config.getint(PIPELINE_SECTION, 'llm_retries', fallback=DEFAULT_LLM_RETRIES))
+  g_retry_backoff = config.getfloat(PIPELINE_SECTION, 'retry_backoff', fallback=DEFAULT_RETRY_BACKOFF)
+  print_verbose(f"[AgentGDB] Pipeline mode: {g_pipeline_mode}{', speculative' if g_speculative_enabled else ''}{', async' if g_async_enabled else ''}.")
 
-    try:
-      # OpenAIClient is already imported at the top
-      g_openai_client = OpenAIClient(base_url=g_openai_base_url, api_key=g_openai_api_key)
-      print_verbose("Success.")
-      print_verbose("\n")
-    except Exception as e: # Catching a broader exception for client initialization
-      print_error(f"Error: Failed to initialize OpenAI client: {e}")
-      print_error("Please ensure your OpenAI server is running and accessible, and your configuration is correct.")
-      print_error(f"Attempted to connect to: {g_openai_base_url} with the provided API key.")
-      return False
+def load_startup_configuration(config):
+  """Applies the optional [Startup] section of an already-read config."""
+  global g_client_setup_mode
+  if STARTUP_SECTION not in config:
+    return
+  mode = config.get(STARTUP_SECTION, 'client_setup', fallback=CLIENT_SETUP_BACKGROUND).strip().lower()
+  if mode not in CLIENT_SETUP_MODES:
+    print_error(f"Unknown client_setup '{mode}' in {CONFIG_FILE_PATH}, expected one of: {', '.join(CLIENT_SETUP_MODES)}. Using '{CLIENT_SETUP_BACKGROUND}'.")
+    mode = CLIENT_SETUP_BACKGROUND
+  g_client_setup_mode = mode
 
-  # Load prompts if not already loaded
-  if any(p is None for p in g_system_prompts.values()):
-    print_verbose("Loading system prompts...")
-    if not load_system_prompts():
-      print_error("Failed to load system prompts. Aborting.")
-      return False
-    print_verbose("Success.")
-    print_verbose("\n")
-  return True
+def load_connection_configuration(config):
+  """Applies the optional [Connection] section of an already-read config."""
+  global g_max_connections, g_max_keepalive_connections, g_keepalive_expiry
+  global g_keepalive_ping_interval, g_warmup_on_startup
+  global g_hedge_delay, g_circuit_failures, g_circuit_cooldown
+  if CONNECTION_SECTION not in config:
+    return
+  g_max_connections = config.getint(CONNECTION_SECTION, 'max_connections', fallback=DEFAULT_MAX_CONNECTIONS)
+  g_max_keepalive_connections = config.getint(CONNECTION_SECTION, 'max_keepalive_connections', fallback=DEFAULT_MAX_KEEPALIVE_CONNECTIONS)
+  g_keepalive_expiry = config.getfloat(CONNECTION_SECTION, 'keepalive_expiry', fallback=DEFAULT_KEEPALIVE_EXPIRY)
+  g_keepalive_ping_interval = config.getfloat(CONNECTION_SECTION, 'keepalive_ping_interval', fallback=DEFAULT_KEEPALIVE_PING_INTERVAL)
+  g_warmup_on_startup = config.getboolean(CONNECTION_SECTION, 'warmup_on_startup', fallback=False)
+  g_hedge_delay = config.getfloat(CONNECTION_SECTION, 'hedge_delay', fallback=DEFAULT_HEDGE_DELAY)
+  g_circuit_failures = max(1, config.getint(CONNECTION_SECTION, 'circuit_failures', fallback=DEFAULT_CIRCUIT_FAILURES))
+  g_circuit_cooldown = config.getfloat(CONNECTION_SECTION, 'circuit_cooldown', fallback=DEFAULT_CIRCUIT_COOLDOWN)
 
-def query_llm(x_system_message, x_prompt):
-  """Queries the LLM and returns the collected response."""
-  global g_openai_client, g_llm_model_identifier
-  if not g_openai_client:
-    print_error("OpenAI client not available.")
-    return "" # Or raise an exception
+def parse_stop_sequences(value):
+  """Parses a comma-separated list of stop sequences; backslash escapes such as \\n are decoded."""
+  sequences = [codecs.decode(item.strip(), "unicode_escape") for item in value.split(",")]
+  return [sequence for sequence in sequences if sequence] or None
 
-  messages = [
-    {"role": "system", "content": x_system_message},
-    {"role": "user", "content": x_prompt}
-  ]
+def load_stage_configuration(config):
+  """Applies the optional per-stage sections ([Stage1], [Stage3], [Stage5], [Fast])."""
+  for stage, section in STAGE_SECTIONS.items():
+    if section not in config:
+      continue
+    settings = g_stage_settings[stage]
+    max_tokens = config.getint(section, 'max_tokens', fallback=None)
+    if max_tokens is not None:
+      settings["max_tokens"] = max_tokens if max_tokens > 0 else None
+    stop = config.get(section, 'stop', fallback=None)
+    if stop is not None:
+      settings["stop"] = parse_stop_sequences(stop)
+    settings["early_stop"] = config.getboolean(section, 'early_stop', fallback=True)
+    settings["help_max_tokens"] = config.getint(section, 'help_max_tokens', fallback=settings["help_max_tokens"])
+    settings["help_max_commands"] = config.getint(section, 'help_max_commands', fallback=settings["help_max_commands"])
+    for key in ("model", "base_url", "api_key"):
+      value = config.get(section, key, fallback="").strip()
+      settings[key] = value or None
+    settings["base_urls"] = split_endpoints(settings["base_url"]) if settings["base_url"] else None
+    if settings["base_urls"]:
+      settings["base_url"] = settings["base_urls"][0]
+    settings["temperature"] = config.getfloat(section, 'temperature', fallback=DEFAULT_TEMPERATURE)
+    timeout = config.getfloat(section, 'timeout', fallback=0.0)
+    settings["timeout"] = timeout if timeout > 0 else None
+    print_verbose(f"[AgentGDB] {section} settings: {settings}")
 
-  try:
-    stream = g_openai_client.chat.completions.create(
-      model=g_llm_model_identifier,
-      messages=messages,
-      temperature=0.0,
-      stream=True
-    )
-    collected_response = ""
-    for chunk in stream:
-      if hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
-        content = chunk.choices[0].delta.content
-        if content:
-          print_llm(content)
-          collected_response += content
-    print("") # Add newline after all tokens
-    return collected_response.strip()
-  except Exception as e: # Catching a broader exception for API calls
-    print_error(f"Error querying LLM: {e}")
-    return ""
+def load_stats_configuration(config):
+  """Applies the optional [Stats] section of an already-read config."""
+  global g_stats_trace_file, g_stats_request_usage
+  if STATS_SECTION not in config:
+    return
+  trace_file = config.get(STATS_SECTION, 'trace_file', fallback="").strip()
+  g_stats_trace_file = os.path.expanduser(trace_file) if trace_file else None
+  g_stats_request_usage = config.getboolean(STATS_SECTION, 'request_usage', fallback=False)
 
-def execute_gdb_command(gdb_cmd_str, to_string=True):
-  """Executes a GDB command and handles potential errors."""
-  try:
-    print("(gdb) " + gdb_cmd_str)
-    output = gdb.execute(gdb_cmd_str, to_string=to_string)
-    return output
-  except gdb.error as e:
-    print_error(f"Error executing GDB command '{gdb_cmd_str}': {e}")
-    return None # Indicate failure
-  except Exception as e: # Catch other potential errors
-    print_error(f"An unexpected error occurred while executing GDB command '{gdb_cmd_str}': {e}")
-    return None
+def load_batch_configuration(config):
+  """Applies the optional [Batch] section of an already-read config."""
+  global g_batch_max_workers
+  if BATCH_SECTION not in config:
+    return
+  g_batch_max_workers = max(1, config.getint(BATCH_SECTION, 'max_workers', fallback=DEFAULT_BATCH_MAX_WORKERS))
 
-def gdb_llm_prompt(x_prompt, x_ask=False):
-  global g_system_prompts
+def load_daemon_configuration(config):
+  """Applies the optional [Daemon] section of an already-read config."""
+  global g_daemon_enabled, g_daemon_socket
+  if DAEMON_SECTION not in config:
+    return
+  g_daemon_enabled = config.getboolean(DAEMON_SECTION, 'enabled', fallback=False)
+  g_daemon_socket = os.path.expanduser(config.get(DAEMON_SECTION, 'socket', fallback=DEFAULT_DAEMON_SOCKET))
+  if g_daemon_enabled and not hasattr(socket, "AF_UNIX"):
+    print_error("The AgentGDB daemon needs Unix domain sockets, which this platform lacks; calling the LLM server directly.")
+    g_daemon_enabled = False
+  print_verbose(f"[AgentGDB] Daemon {'enabled at ' + g_daemon_socket if g_daemon_enabled else 'disabled'}.")
 
-  if not ensure_openai_client_ready():
-    return # Client or prompts failed to initialize
+def load_templates_configuration(config):
+  """Applies the optional [Templates] section of an already-read config."""
+  global g_templates_enabled, g_template_max_entries
+  if TEMPLATES_SECTION not in config:
+    return
+  g_templates_enabled = config.getboolean(TEMPLATES_SECTION, 'enabled', fallback=True)
+  g_template_max_entries = max(0, config.getint(TEMPLATES_SECTION, 'max_entries', fallback=DEFAULT_TEMPLATE_MAX_ENTRIES))
+  print_verbose(f"[AgentGDB] Command templates {'enabled' if g_templates_enabled else 'disabled'} (max {g_template_max_entries}).")
 
-  # STAGE 1: Classify the user's intent
-  system_message_stage1 = g_system_prompts.get("stage1")
-  if not system_message_stage1:
-    print_error("Error: Stage 1 system prompt not loaded. Aborting.\n")
+def load_validation_configuration(config):
+  """Applies the optional [Validation] section of an already-read config."""
+  global g_validation_enabled, g_validation_repair
+  if VALIDATION_SECTION not in config:
     return
+  g_validation_enabled = config.getboolean(VALIDATION_SECTION, 'enabled', fallback=True)
+  g_validation_repair = config.getboolean(VALIDATION_SECTION, 'repair', fallback=True)
+  print_verbose(f"[AgentGDB] Symbol validation {'enabled' if g_validation_enabled else 'disabled'}{' with repair' if g_validation_enabled and g_validation_repair else ''}.")
 
-  print_verbose("[AgentGDB] Stage 1: Classifying command...\n")
-  collected_response_stage1 = query_llm(system_message_stage1, x_prompt)
-  if not collected_response_stage1:
-    print_error("Stage 1: Failed to get command class from LLM. Please try again.\n")
+def load_display_configuration(config):
+  """Applies the optional [Display] section of an already-read config."""
+  global g_render_interval, g_render_bytes, g_render_quiet
+  if DISPLAY_SECTION not in config:
     return
+  g_render_interval = max(0.0, config.getfloat(DISPLAY_SECTION, 'render_interval', fallback=DEFAULT_RENDER_INTERVAL))
+  g_render_bytes = max(1, config.getint(DISPLAY_SECTION, 'render_bytes', fallback=DEFAULT_RENDER_BYTES))
+  g_render_quiet = config.getboolean(DISPLAY_SECTION, 'quiet', fallback=False)
 
-  response_lines = [line for line in collected_response_stage1.split("\n") if line.strip()] # Remove empty lines
-  if len(response_lines) < 2:
-    print_error(f"Stage 1: Unexpected LLM response format for command class: '{collected_response_stage1}'. Expected summary and command class on separate lines.\n")
+def load_execution_configuration(config):
+  """Applies the optional [Execution] section of an already-read config."""
+  global g_max_output_bytes, g_stop_on_error, g_iterative_enabled, g_iteration_steps, g_summary_tokens
+  if EXECUTION_SECTION not in config:
     return
-  
-  # The summary is the second to last line, and the command class is the last line.
-  # This handles potential <think> blocks or other multi-line preamble from the LLM.
-  summary_line = response_lines[-2].strip() # Optional: use if needed
-  cmd_class = response_lines[-1].strip()
+  g_max_output_bytes = max(256, config.getint(EXECUTION_SECTION, 'max_output_bytes', fallback=DEFAULT_MAX_OUTPUT_BYTES))
+  g_stop_on_error = config.getboolean(EXECUTION_SECTION, 'stop_on_error', fallback=False)
+  g_iterative_enabled = config.getboolean(EXECUTION_SECTION, 'iterative', fallback=False)
+  g_iteration_steps = max(1, config.getint(EXECUTION_SECTION, 'max_steps', fallback=DEFAULT_ITERATION_STEPS))
+  g_summary_tokens = max(50, config.getint(EXECUTION_SECTION, 'summary_tokens', fallback=DEFAULT_SUMMARY_TOKENS))
 
-  if not cmd_class:
-    print_error("Stage 1: LLM did not provide a command class. Please try again.\n")
+def load_context_configuration(config):
+  """Applies the optional [Context] section of an already-read config."""
+  global g_state_enabled, g_state_max_tokens
+  if CONTEXT_SECTION not in config:
     return
-  
-  # Sanity check: Validate the command class is one of the 12 supported classes
-  supported_command_classes = [
-    "breakpoints", "data", "files", "internals", "obscure", "running", 
-    "stack", "status", "support", "text-user-interface", "tracepoints", "user-defined"
+  g_state_enabled = config.getboolean(CONTEXT_SECTION, 'enabled', fallback=True)
+  g_state_max_tokens = max(20, config.getint(CONTEXT_SECTION, 'max_tokens', fallback=DEFAULT_STATE_MAX_TOKENS))
+
+def write_json_atomically(path, data):
+  """Writes data as JSON to path via a temporary file so readers never see a partial file."""
+  directory = os.path.dirname(path)
+  os.makedirs(directory, exist_ok=True)
+  fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+  try:
+    with os.fdopen(fd, "w") as f:
+      json.dump(data, f)
+    os.replace(tmp_path, path)
+  except Exception:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+    raise
+
+def read_json_file(path):
+  """Reads a JSON cache file, returning None if it is missing or unreadable."""
+  try:
+    with open(path, "r") as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return None
+  except (IOError, ValueError) as e:
+    print_verbose(f"[AgentGDB] Ignoring unreadable cache file {path}: {e}")
+    return None
+
+def normalize_query(x_prompt):
+  """Normalizes a natural language query so trivially different spellings share a cache entry."""
+  query = " ".join(x_prompt.lower().split())
+  return query.rstrip(".?! ")
+
+def system_prompts_fingerprint():
+  """Returns a short hash over all loaded system prompts."""
+  digest = hashlib.sha256()
+  for stage in sorted(g_system_prompts):
+    digest.update(stage.encode("utf-8"))
+    digest.update((g_system_prompts[stage] or "").encode("utf-8"))
+  return digest.hexdigest()[:16]
+
+def query_cache_path():
+  return os.path.join(g_cache_dir, QUERY_CACHE_FILE_NAME)
+
+def query_cache_journal_path():
+  return os.path.join(g_cache_dir, QUERY_CACHE_JOURNAL_FILE_NAME)
+
+def query_cache_key(x_prompt):
+  """Builds the cache key for a query from everything that can change the generated command."""
+  parts = [
+    g_llm_model_identifier or "",
+    g_openai_base_url or "",
+    stage_routing_fingerprint(),
+    system_prompts_fingerprint(),
+    getattr(gdb, "VERSION", ""),
+    normalize_query(x_prompt),
   ]
-  
-  if cmd_class not in supported_command_classes:
-    print_error(f"Stage 1: LLM provided an invalid command class: '{cmd_class}'. Expected one of: {', '.join(supported_command_classes)}.\n")
-    return
-  
-  gdb_cmd_stage2 = "help " + cmd_class
+  return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
 
-  # STAGE 2: Get the help for the command class
-  print_verbose(f"Stage 2: Getting help for command class '{cmd_class}'...\n")
-  gdb_cmd_class_help = execute_gdb_command(gdb_cmd_stage2, to_string=True)
-  if gdb_cmd_class_help is None: # Error handled in execute_gdb_command
-    return
+def template_store_path():
+  return os.path.join(g_cache_dir, TEMPLATE_STORE_FILE_NAME)
 
-  ## STAGE 2.1: FILTER
-  # Robustly find "List of commands:"
-  list_of_commands_marker = "List of commands:"
-  marker_pos = gdb_cmd_class_help.find(list_of_commands_marker)
-  if marker_pos == -1:
-      print_error(f"Stage 2.1: Could not find '{list_of_commands_marker}' in help output for '{cmd_class}'. The help format might have changed or the class is incorrect.\n")
-      # print_verbose(f"Full help output received:\\n{gdb_cmd_class_help}") # Optional: for debugging
-      return
-  
-  gdb_cmd_class_help_filtered = gdb_cmd_class_help[marker_pos + len(list_of_commands_marker):]
-  gdb_cmd_class_help_filtered = "\n".join([line for line in gdb_cmd_class_help_filtered.split("\n") if not line.strip().startswith("set ")])
-  gdb_cmd_class_help_filtered = gdb_cmd_class_help_filtered.strip()
+def load_template_store():
+  """Loads the learned command templates from disk on first use and indexes them."""
+  global g_template_store, g_template_index
+  with g_template_lock:
+    if g_template_store is not None:
+      return g_template_store
+    g_template_store = {}
+    data = read_json_file(template_store_path())
+    if data and data.get("version") == TEMPLATE_STORE_FORMAT_VERSION:
+      for entry in data.get("templates", []):
+        if not template_too_broad(entry["pattern"], entry["command"].split()[0]): # Learned before the check
+          g_template_store[" ".join(entry["pattern"])] = entry
+    reindex_templates()
+  print_verbose(f"[AgentGDB] Loaded {len(g_template_store)} command templates from {template_store_path()}.")
+  return g_template_store
 
-  if not gdb_cmd_class_help_filtered:
-      print_error(f"Stage 2.1: No commands found for class '{cmd_class}' after filtering. Or all commands started with 'set '.\n")
-      return
+def reindex_templates():
+  """Rebuilds g_template_index. Slots take one token each, so a query can only match templates of
+  its own length, and those starting with a word only if it starts with that word."""
+  global g_template_index
+  g_template_index = {}
+  for key, entry in g_template_store.items():
+    first = entry["pattern"][0]
+    g_template_index.setdefault((len(entry["pattern"]), None if TEMPLATE_SLOT_PATTERN.fullmatch(first) else first), []).append(key)
 
-  # STAGE 3: Select the most relevant command
-  system_message_stage3 = g_system_prompts.get("stage3")
-  if not system_message_stage3:
-    print_error("Error: Stage 3 system prompt not loaded. Aborting.\n")
-    return
-  
-  prompt_stage3 = system_message_stage3 + "\n" + gdb_cmd_class_help_filtered
-  prompt_stage3 = prompt_stage3 + "\nUser Query: "
-  print_verbose("Stage 3: Selecting specific command...\n")
-  selected_command_raw = query_llm(prompt_stage3, x_prompt)
+def save_template_store():
+  with g_template_lock:
+    try:
+      write_json_atomically(template_store_path(), {
+        "version": TEMPLATE_STORE_FORMAT_VERSION,
+        "templates": list(g_template_store.values()),
+      })
+    except (IOError, OSError) as e:
+      print_error(f"Error writing template store {template_store_path()}: {e}")
 
-  if not selected_command_raw:
-    print_error("Stage 3: LLM failed to select a command. Please try again.\n")
-    return
+def template_tokens(x_prompt):
+  """Splits a query into words, without sentence punctuation around them."""
+  tokens = (token.strip(TEMPLATE_TOKEN_PUNCTUATION) for token in x_prompt.split())
+  return [token for token in tokens if token]
 
-  # Handle potential <think> blocks or other multi-line preamble from the LLM.
-  # The actual selected command is expected to be the last non-empty line.
-  selected_command_lines = [line for line in selected_command_raw.split("\n") if line.strip()]
-  if not selected_command_lines:
-      print_error("Stage 3: LLM returned an empty response after filtering. Please try again.\n")
-      return
-  selected_command = selected_command_lines[-1].strip()
+def template_slot_kind(value):
+  """The kind of slot a query word can fill (NUM, FILE or NAME), or None."""
+  for kind, pattern in TEMPLATE_SLOT_KINDS:
+    if pattern.fullmatch(value):
+      return kind
+  return None
 
-  if selected_command == NO_VALID_COMMAND_MARKER: # Assuming LLM might return this for clarity
-      print_error("Stage 3: LLM indicated no specific command found for your query.\n")
-      return
-  if not selected_command: # Added check in case the last line was empty after strip or if NO_VALID_COMMAND_MARKER was the only content
-    print_error("Stage 3: LLM failed to select a command after processing the response. Please try again.\n")
-    return
+def is_command_word(command, word):
+  """
+  Whether a word belongs to GDB's command language rather than the user's program: a word of
+  one of command's subcommands ('threads' in 'info threads'), or, after a prefix command, a
+  command or alias itself ('bt' in 'thread apply all bt'). Such words are kept literal in templates.
+  """
+  index = load_help_index()
+  names = set(index["commands"])
+  for entry in index["classes"].values():
+    for listed in entry["commands"]:
+      names.add(listed["name"])
+      names.update(listed.get("aliases", []))
+  subcommands = [name.split()[1:] for name in names if name.startswith(command + " ")]
+  return any(word in words for words in subcommands) or (bool(subcommands) and word in names)
 
-  # STAGE 4: Get the detailed help for the selected command
-  gdb_cmd_stage4 = "help " + selected_command # .strip() is already done
-  print_verbose(f"Stage 4: Getting detailed help for command '{selected_command}'...\n")
-  gdb_detailed_help = execute_gdb_command(gdb_cmd_stage4, to_string=True)
-  if gdb_detailed_help is None:
-    return
+def template_too_broad(pattern, command):
+  """
+  Whether a template has no literal word but its first and the command's name, like "print
+  {NAME1}" from "print x": it would answer any two-word query starting with that word.
+  """
+  return not any(part != command.lower() and not TEMPLATE_SLOT_PATTERN.fullmatch(part) for part in pattern[1:])
 
-  # STAGE 5: Generate the final command
-  system_message_stage5 = g_system_prompts.get("stage5")
-  if not system_message_stage5:
-    print_error("Error: Stage 5 system prompt not loaded. Aborting.\n")
-    return
+def learn_template(x_prompt, final_gdb_cmd):
+  """
+  Turns a confirmed query and command into a template, e.g. "break at line 42 in main.c" and
+  "break main.c:42" into "break at line {NUM1} in {FILE1}" -> "break {FILE1}:{NUM1}". Query
+  words that reappear in the command's arguments become slots. Returns the entry, or None if
+  the pair has nothing to generalize over.
+  """
+  if not g_templates_enabled or g_template_max_entries <= 0:
+    return None
+  command, _, args = final_gdb_cmd.strip().partition(" ")
+  if "\n" in final_gdb_cmd.strip() or not args.strip():
+    return None # Several commands, or nothing that could vary
+  tokens = template_tokens(x_prompt)
+  arg_words = set(re.findall(r"0x[0-9a-fA-F]+|[\w./+-]+(?:->\w+)*", args))
+  counts = Counter(token.lower() for token in tokens)
+  slots = {}
+  pattern = []
+  for token in tokens:
+    kind = template_slot_kind(token) if token in arg_words else None
+    if kind == "NAME" and (token.lower() in TEMPLATE_LITERAL_WORDS or is_command_word(command, token)):
+      kind = None
+    if kind is not None and counts[token.lower()] > 1:
+      kind = None # It also stands for itself elsewhere in the query, so it stays literal everywhere
+    if kind is None:
+      pattern.append(token.lower())
+      continue
+    placeholder = "{%s%d}" % (kind, 1 + sum(1 for p in slots.values() if p.startswith("{" + kind)))
+    slots[token] = placeholder
+    pattern.append(placeholder)
+  if not slots or template_too_broad(pattern, command):
+    return None
+  template = args
+  for value, placeholder in sorted(slots.items(), key=lambda item: -len(item[0])): # "main.c" before "main"
+    # Not after '/': 'x' in 'print/x x' is a format letter there
+    template, found = re.subn(rf"(?<![\w./]){re.escape(value)}(?![\w])", placeholder, template)
+    if not found:
+      return None
+  with g_template_lock:
+    store = load_template_store()
+    key = " ".join(pattern)
+    entry = store.get(key)
+    if entry is not None and entry["command"] == f"{command} {template}":
+      entry["uses"] += 1
+    else:
+      entry = {"pattern": pattern, "command": f"{command} {template}", "uses": 1}
+      store[key] = entry
+    entry["last_used"] = time.time()
+    while len(store) > g_template_max_entries:
+      # Least frequently used first, then least recently used
+      victim = min(store, key=lambda k: (store[k]["uses"], store[k]["last_used"]))
+      del store[victim]
+    reindex_templates()
+    save_template_store()
+  print_verbose(f"[AgentGDB] Learned template: '{key}' -> {entry['command']}")
+  return entry
 
-  prompt_stage5 = system_message_stage5 + "\n" + gdb_detailed_help
-  prompt_stage5 = prompt_stage5 + "\nUser Query: "
-  print_verbose("Stage 5: Generating final GDB command...\n")
-  final_gdb_cmd_raw = query_llm(prompt_stage5, x_prompt)
+def match_template(x_prompt):
+  """Fills in the most used template that fits the query. Returns the command, or None."""
+  if not g_templates_enabled:
+    return None
+  with g_template_lock:
+    store = load_template_store()
+    if not store:
+      return None
+    tokens = template_tokens(x_prompt)
+    if not tokens:
+      return None
+    keys = g_template_index.get((len(tokens), tokens[0].lower()), []) + g_template_index.get((len(tokens), None), [])
+    best, best_values = None, None
+    for key in keys:
+      entry = store[key]
+      values = {}
+      for part, token in zip(entry["pattern"], tokens):
+        slot = TEMPLATE_SLOT_PATTERN.fullmatch(part)
+        if slot is None:
+          if part != token.lower():
+            break
+        elif not dict(TEMPLATE_SLOT_KINDS)[slot.group(1)].fullmatch(token) or values.setdefault(part, token) != token:
+          break
+      else:
+        if best is None or entry["uses"] > best["uses"]:
+          best, best_values = entry, values
+    if best is None:
+      return None
+    best["uses"] += 1
+    best["last_used"] = time.time()
+    save_template_store()
+    return TEMPLATE_SLOT_PATTERN.sub(lambda m: best_values.get(m.group(0), m.group(0)), best["command"])
 
-  if not final_gdb_cmd_raw.strip():
-    print_error("Stage 5: LLM returned an empty or whitespace-only response. Please try again.\n")
-    return
+def sorted_templates():
+  """Templates by use count, most used first; agent-templates numbers them in this order."""
+  with g_template_lock:
+    store = load_template_store()
+    return sorted(store.items(), key=lambda item: (-item[1]["uses"], item[0]))
 
-  # Assume the actual command block is the last "paragraph" (separated by blank lines).
-  # This handles potential <think> blocks if they are followed by a blank line before the command(s).
-  paragraphs = re.split(r'\n\s*\n', final_gdb_cmd_raw.strip())
-  final_gdb_cmd = paragraphs[-1].strip() # Get the last paragraph and strip it.
+def delete_template(key):
+  with g_template_lock:
+    del g_template_store[key]
+    reindex_templates()
+    save_template_store()
 
-  if not final_gdb_cmd:
-    print_error("Stage 5: LLM failed to generate the final command (extracted block is empty). Please try again.\n")
-    return
-  
-  if final_gdb_cmd == NO_VALID_COMMAND_MARKER:
-    print_error("Stage 5: LLM indicated no valid command could be generated based on the help provided. Please try again or rephrase your query.\n")
+def template_store_clear():
+  global g_template_store
+  with g_template_lock:
+    g_template_store = {}
+    reindex_templates()
+    try:
+      os.unlink(template_store_path())
+    except FileNotFoundError:
+      pass
+
+def load_query_cache():
+  """Loads the persistent query cache from disk on first use: the cache file, then the journal."""
+  global g_query_cache, g_query_cache_journal_entries
+  with g_query_cache_lock:
+    if g_query_cache is not None:
+      return g_query_cache
+    cache = OrderedDict()
+    data = read_json_file(query_cache_path())
+    if data and data.get("version") == QUERY_CACHE_FORMAT_VERSION:
+      for key, entry in data.get("entries", []):
+        cache[key] = entry
+    g_query_cache_journal_entries = 0
+    try:
+      with open(query_cache_journal_path(), "r") as f:
+        for line in f:
+          try:
+            key, entry = json.loads(line)
+          except ValueError:
+            continue # A line cut short by a crash
+          cache[key] = entry
+          cache.move_to_end(key)
+          g_query_cache_journal_entries += 1
+    except FileNotFoundError:
+      pass
+    except IOError as e:
+      print_verbose(f"[AgentGDB] Ignoring unreadable query cache journal: {e}")
+    while len(cache) > max(g_query_cache_max_entries, 0):
+      cache.popitem(last=False)
+    g_query_cache = cache
+  print_verbose(f"[AgentGDB] Loaded {len(cache)} query cache entries from {query_cache_path()}.")
+  return cache
+
+def save_query_cache():
+  """Writes the whole cache, in LRU order, to the cache file and empties the journal."""
+  global g_query_cache_journal_entries
+  with g_query_cache_lock:
+    try:
+      write_json_atomically(query_cache_path(), {
+        "version": QUERY_CACHE_FORMAT_VERSION,
+        "entries": list(g_query_cache.items()),
+      })
+      if os.path.exists(query_cache_journal_path()):
+        os.unlink(query_cache_journal_path())
+      g_query_cache_journal_entries = 0
+    except (IOError, OSError) as e:
+      print_error(f"Error writing query cache {query_cache_path()}: {e}")
+
+def append_query_cache_journal(key, entry):
+  """Records a new entry with one appended line instead of rewriting the cache file."""
+  global g_query_cache_journal_entries
+  try:
+    os.makedirs(g_cache_dir, exist_ok=True)
+    with open(query_cache_journal_path(), "a") as f:
+      f.write(json.dumps([key, entry]) + "\n")
+    g_query_cache_journal_entries += 1
+  except (IOError, OSError) as e:
+    print_error(f"Error writing query cache journal {query_cache_journal_path()}: {e}")
+
+def flush_query_cache():
+  """Folds the journal into the cache file at exit, so the next session loads one file in LRU order."""
+  with g_query_cache_lock:
+    if g_query_cache is not None and g_query_cache_journal_entries:
+      save_query_cache()
+
+def query_cache_get(key):
+  """Returns the cached final command for key, or None. Refreshes the entry's LRU position."""
+  if not g_query_cache_enabled:
+    return None
+  with g_query_cache_lock:
+    cache = load_query_cache()
+    entry = cache.get(key)
+    if entry is None:
+      g_query_cache_stats["misses"] += 1
+      return None
+    g_query_cache_stats["hits"] += 1
+    cache.move_to_end(key)
+    return entry["command"]
+
+def query_cache_put(key, x_prompt, final_gdb_cmd):
+  """Stores a final command, evicting least recently used entries beyond the size bound."""
+  if not g_query_cache_enabled or g_query_cache_max_entries <= 0 or key is None:
     return
+  with g_query_cache_lock:
+    cache = load_query_cache()
+    entry = {"query": normalize_query(x_prompt), "command": final_gdb_cmd}
+    cache[key] = entry
+    cache.move_to_end(key)
+    while len(cache) > g_query_cache_max_entries:
+      cache.popitem(last=False)
+      g_query_cache_stats["evictions"] += 1
+    # Rewriting the file once per size bound's worth of entries keeps a put O(1) on average
+    if g_query_cache_journal_entries + 1 >= g_query_cache_max_entries:
+      save_query_cache()
+    else:
+      append_query_cache_journal(key, entry)
 
-  if x_ask:
-    print("[AgentGDB] Suggested command: " + final_gdb_cmd)
-    # Optionally, ask for confirmation here before executing
-    confirmation = input("[AgentGDB] Execute this command? (y/N): ")
-    if confirmation.lower() == 'y':
-      execute_gdb_command(final_gdb_cmd, to_string=False)
-  else:
-    execute_gdb_command(final_gdb_cmd, to_string=True)
+def query_cache_clear():
+  """Drops every cached command, in memory and on disk."""
+  global g_query_cache, g_query_cache_journal_entries
+  with g_query_cache_lock:
+    g_query_cache = OrderedDict()
+    g_query_cache_journal_entries = 0
+    for path in (query_cache_path(), query_cache_journal_path()):
+      try:
+        os.unlink(path)
+      except FileNotFoundError:
+        pass
+      except OSError as e:
+        print_error(f"Error removing query cache {path}: {e}")
 
-class AgentGdbCommand(gdb.Command):
-  def __init__(self):
-    super(AgentGdbCommand, self).__init__("agent", gdb.COMMAND_USER)
-  def invoke(self, x_arg, from_tty):
-    if not x_arg:
-        print("[AgentGDB] Usage: agent <natural language query>")
-        return
-    gdb_llm_prompt(x_arg)
+def reset_stats():
+  """Clears all aggregated measurements."""
+  global g_stats
+  with g_stats_lock:
+    g_stats = {
+      "seconds": {},           # metric -> deque of wall times
+      "ttft": {},              # LLM stage -> deque of time-to-first-token
+      "tokens_per_second": {}, # LLM stage -> deque of decode rates
+      "prompt_tokens": Counter(),
+      "completion_tokens": Counter(),
+      "queries": 0,
+      "cache_hits": 0,
+      "template_hits": 0,
+      "failures": Counter(),   # stage -> failed queries
+      "help_tokens": Counter(),        # stage -> estimated tokens of GDB help before pruning
+      "pruned_help_tokens": Counter(), # stage -> estimated tokens of GDB help actually sent
+    }
+    g_daemon_stats.clear()
 
-class AskGdbCommand(gdb.Command):
-  def __init__(self):
-    super(AskGdbCommand, self).__init__("ask", gdb.COMMAND_USER)
-  def invoke(self, x_arg, from_tty):
-    if not x_arg:
-        print("[AgentGDB] Usage: ask <natural language query>")
-        return
-    gdb_llm_prompt(x_arg, True)
+reset_stats()
 
-if __name__ == "__main__": 
-  # Load configuration first to ensure VERBOSE flag is set correctly
-  if not load_plugin_configuration():
-    print_error("Failed to load configuration during startup. Some features might not work.")
-    print_error("Please check your configuration file at ~/.agentgdb_config.ini")
-  
-  # Now initialize the OpenAI client
-  if not ensure_openai_client_ready():
-    print_error("Failed to initialize AI GDB agent during startup. Some features might not work.")
-    print_error("Please check your OpenAI client configuration (e.g., API key, base URL, model ID in ~/.agentgdb_config.ini) and system prompt files.")
+def add_sample(table, key, value):
+  samples = table.get(key)
+  if samples is None:
+    samples = table[key] = deque(maxlen=STATS_MAX_SAMPLES)
+  samples.append(value)
+
+def current_trace():
+  return getattr(g_trace_local, "trace", None)
+
+def record_stage(stage, seconds, **fields):
+  """Records one timed step in the aggregates and in the trace of the current query."""
+  with g_stats_lock:
+    add_sample(g_stats["seconds"], stage, seconds)
+    if fields.get("ttft") is not None:
+      add_sample(g_stats["ttft"], stage, fields["ttft"])
+    if fields.get("tokens_per_second") is not None:
+      add_sample(g_stats["tokens_per_second"], stage, fields["tokens_per_second"])
+    g_stats["prompt_tokens"][stage] += fields.get("prompt_tokens") or 0
+    g_stats["completion_tokens"][stage] += fields.get("completion_tokens") or 0
+    if fields.get("help_tokens") is not None:
+      g_stats["help_tokens"][stage] += fields["help_tokens"]
+      g_stats["pruned_help_tokens"][stage] += fields["pruned_help_tokens"]
+  trace = current_trace()
+  if trace is not None:
+    record = {"stage": stage, "seconds": round(seconds, 6)}
+    record.update(fields)
+    trace["stages"].append(record)
+
+def trace_begin(x_prompt, mode):
+  """Starts the trace of a query on the current thread."""
+  trace = {"query": x_prompt, "mode": mode, "timestamp": time.time(), "start": time.perf_counter(),
+           "stages": [], "cache_hit": False, "template_hit": False, "status": "ok", "failed_stage": None}
+  g_trace_local.trace = trace
+  return trace
+
+def begin_query_budget(trace, x_ask):
+  """Starts the deadline of the query traced by trace; x_ask allows degraded suggestions."""
+  trace["deadline"] = trace["start"] + g_query_deadline if g_query_deadline > 0 else None
+  trace["ask"] = x_ask
+  trace["degraded"] = []
+
+def remaining_budget():
+  """Seconds left before the current query's deadline, or None without one."""
+  trace = current_trace()
+  if trace is None or trace.get("deadline") is None:
+    return None
+  return trace["deadline"] - time.perf_counter()
+
+def stage_time_limit(x_stage):
+  """
+  Seconds an LLM request of x_stage may take: its share of the time left, weighted against the
+  stages still to run (STAGE_BUDGET_WEIGHTS), and at most the stage's own timeout. None is unlimited.
+  """
+  limit = g_stage_settings.get(x_stage, {}).get("timeout")
+  remaining = remaining_budget()
+  if remaining is not None:
+    order = PIPELINE_STAGE_ORDER.get(current_trace().get("mode"), [])
+    pending = order[order.index(x_stage):] if x_stage in order else [x_stage]
+    weight = STAGE_BUDGET_WEIGHTS.get(x_stage, 1.0)
+    share = max(0.0, remaining) * weight / sum(STAGE_BUDGET_WEIGHTS.get(stage, 1.0) for stage in pending)
+    limit = share if limit is None else min(limit, share)
+  return limit
+
+def expected_seconds(stages):
+  """Typical (median) time the given stages have taken so far, or None before they have run."""
+  with g_stats_lock:
+    samples = [sorted(g_stats["seconds"].get(stage, [])) for stage in stages]
+  if not all(samples):
+    return None
+  return sum(percentile(values, 50) for values in samples)
+
+def stage_timed_out(x_stage):
+  """Whether an LLM request of x_stage ran out of time in the current query."""
+  trace = current_trace()
+  return trace is not None and any(record["stage"] == x_stage and record.get("outcome") == "timeout" for record in trace["stages"])
+
+def note_degraded(what):
+  print(f"[AgentGDB] {what}")
+  trace = current_trace()
+  if trace is not None and "degraded" in trace:
+    trace["degraded"].append(what)
+
+def trace_failure(stage):
+  """Marks the current query as failed at stage (the first failure wins)."""
+  trace = current_trace()
+  if trace is not None and trace["failed_stage"] is None:
+    trace["status"] = "failed"
+    trace["failed_stage"] = stage
+
+def trace_end():
+  """Finishes the current query's trace, aggregates it and appends it to the trace file."""
+  trace = current_trace()
+  if trace is None:
+    return
+  g_trace_local.trace = None
+  trace.pop("deadline", None)
+  trace.pop("state_names", None) # The digest itself is summarized by state_tokens
+  trace.pop("state_digest", None)
+  trace["seconds"] = round(time.perf_counter() - trace.pop("start"), 6)
+  with g_stats_lock:
+    g_stats["queries"] += 1
+    add_sample(g_stats["seconds"], "query", trace["seconds"])
+    if trace["cache_hit"]:
+      g_stats["cache_hits"] += 1
+    if trace["template_hit"]:
+      g_stats["template_hits"] += 1
+    if trace["failed_stage"]:
+      g_stats["failures"][trace["failed_stage"]] += 1
+  if g_stats_trace_file:
+    try:
+      with open(g_stats_trace_file, "a") as f:
+        f.write(json.dumps(trace) + "\n")
+    except IOError as e:
+      print_error(f"Error writing trace file {g_stats_trace_file}: {e}")
+
+def percentile(sorted_values, pct):
+  """Nearest-rank percentile of an already sorted list."""
+  if not sorted_values:
+    return 0.0
+  rank = max(0, int(math.ceil(pct / 100.0 * len(sorted_values))) - 1)
+  return sorted_values[rank]
+
+def estimate_tokens(text):
+  return (len(text) + CHARS_PER_TOKEN_ESTIMATE - 1) // CHARS_PER_TOKEN_ESTIMATE
+
+def help_index_path():
+  return os.path.join(g_cache_dir, HELP_INDEX_FILE_NAME)
+
+def on_gdb_thread():
+  """GDB's Python API may only be used from the thread GDB runs Python on."""
+  return threading.current_thread() is threading.main_thread()
+
+def current_async_job():
+  return getattr(g_worker_local, "job", None)
+
+def call_on_gdb_thread(fn, *args):
+  """
+  Runs fn(*args) on the GDB thread on behalf of an async query and waits for the result.
+  Returns None if the query is cancelled before GDB gets to it.
+  """
+  job = current_async_job()
+  done = threading.Event()
+  result = []
+  def run():
+    try:
+      if not job.cancel_event.is_set():
+        result.append(fn(*args))
+    finally:
+      done.set()
+  gdb.post_event(run)
+  while not done.wait(0.05):
+    if job.cancel_event.is_set():
+      return None
+  return result[0] if result else None
+
+def gdb_help_output(topic):
+  """Runs 'help <topic>' silently and returns its output, or None if GDB rejects it."""
+  if not on_gdb_thread():
+    if current_async_job() is not None:
+      return call_on_gdb_thread(gdb_help_output, topic)
+    print_verbose(f"[AgentGDB] 'help {topic}' is not in the help index and GDB cannot be called from a worker thread.\n")
+    return None
+  start = time.perf_counter()
+  try:
+    return gdb.execute("help " + topic, to_string=True)
+  except gdb.error as e:
+    print_error(f"Error executing GDB command 'help {topic}': {e}")
+    return None
+  finally:
+    record_stage("gdb_help", time.perf_counter() - start)
+
+def parse_class_help(cmd_class, help_text):
+  """
+  Parses 'help <class>' output into the text stage 3 sees and a structured command list.
+  Returns (filtered_text, commands), or None if the output has no command list.
+  """
+  marker_pos = help_text.find(LIST_OF_COMMANDS_MARKER)
+  if marker_pos == -1:
+    print_error(f"Stage 2.1: Could not find '{LIST_OF_COMMANDS_MARKER}' in help output for '{cmd_class}'. The help format might have changed or the class is incorrect.\n")
+    return None
+
+  lines = help_text[marker_pos + len(LIST_OF_COMMANDS_MARKER):].split("\n")
+  lines = [line for line in lines if not line.strip().startswith("set ")]
+  commands = []
+  for line in lines:
+    names, sep, summary = line.partition(" -- ")
+    if not sep:
+      continue
+    aliases = [name.strip() for name in names.split(",") if name.strip()]
+    if aliases:
+      commands.append({"name": aliases[0], "aliases": aliases[1:], "summary": summary.strip()})
+  return "\n".join(lines).strip(), commands
+
+def help_index_key():
+  """Identifies the help text GDB would print: its version plus the extensions loaded into it."""
+  # Extensions (Python or CLI) register their commands as user-defined, so that listing
+  # changes whenever a new extension is loaded.
+  extensions_help = gdb_help_output("user-defined") or ""
+  extensions_hash = hashlib.sha256(extensions_help.encode("utf-8")).hexdigest()[:16]
+  return f"{getattr(gdb, 'VERSION', '')}:{extensions_hash}"
+
+def harvest_help_index(key):
+  """Runs 'help <class>' for every supported class and parses the results."""
+  index = {"version": HELP_INDEX_FORMAT_VERSION, "key": key, "classes": {}, "commands": {}}
+  for cmd_class in SUPPORTED_COMMAND_CLASSES:
+    help_text = gdb_help_output(cmd_class)
+    parsed = parse_class_help(cmd_class, help_text) if help_text is not None else None
+    if parsed is None:
+      continue # Not cached, so the class is retried on the next rebuild
+    text, commands = parsed
+    index["classes"][cmd_class] = {"text": text, "commands": commands}
+  return index
+
+def save_help_index():
+  try:
+    write_json_atomically(help_index_path(), g_help_index)
+  except (IOError, OSError) as e:
+    print_error(f"Error writing help index {help_index_path()}: {e}")
+
+def load_help_index():
+  """
+  Returns the help index, harvesting it on first use. Layout:
+    {"key": ..., "classes": {class: {"text": str, "commands": [{"name", "aliases", "summary"}]}},
+     "commands": {command: detailed help text}}
+  The in-memory copy is reused until new objfiles appear; the on-disk copy is reused across
+  sessions as long as the GDB version and loaded extensions match.
+  """
+  global g_help_index, g_help_index_stale
+  if g_help_index is not None and not g_help_index_stale:
+    return g_help_index
+
+  key = help_index_key()
+  g_help_index_stale = False
+  if g_help_index is not None and g_help_index.get("key") == key:
+    return g_help_index
+
+  data = read_json_file(help_index_path())
+  if data and data.get("version") == HELP_INDEX_FORMAT_VERSION and data.get("key") == key:
+    print_verbose(f"[AgentGDB] Loaded help index from {help_index_path()}.")
+    g_help_index = data
+    return g_help_index
+
+  print_verbose("[AgentGDB] Building help index...")
+  g_help_index = harvest_help_index(key)
+  save_help_index()
+  return g_help_index
+
+def get_class_help(cmd_class):
+  """Returns the filtered 'help <class>' listing for stage 3, or None on failure."""
+  entry = load_help_index()["classes"].get(cmd_class)
+  if entry is None:
+    # Harvesting failed for this class earlier; try once more so transient errors heal.
+    help_text = gdb_help_output(cmd_class)
+    parsed = parse_class_help(cmd_class, help_text) if help_text is not None else None
+    if parsed is None:
+      return None
+    entry = {"text": parsed[0], "commands": parsed[1]}
+    g_help_index["classes"][cmd_class] = entry
+    save_help_index()
+  return entry["text"]
+
+def get_class_commands(cmd_class):
+  """Returns the structured command list of a class (empty if unknown)."""
+  entry = load_help_index()["classes"].get(cmd_class)
+  return entry["commands"] if entry else []
+
+def get_command_help(command):
+  """Returns the detailed 'help <command>' text, fetching it from GDB on first use."""
+  index = load_help_index()
+  help_text = index["commands"].get(command)
+  if help_text is None:
+    help_text = gdb_help_output(command)
+    if help_text is None:
+      return None
+    index["commands"][command] = help_text
+    save_help_index()
+  return help_text
+
+def help_index_clear():
+  """Drops the help index, in memory and on disk."""
+  global g_help_index, g_help_index_stale
+  g_help_index = None
+  g_help_index_stale = True
+  try:
+    os.unlink(help_index_path())
+  except FileNotFoundError:
+    pass
+  except OSError as e:
+    print_error(f"Error removing help index {help_index_path()}: {e}")
+
+def on_new_objfile(event):
+  """New objfiles may auto-load extensions that add commands, so re-validate the help index."""
+  global g_help_index_stale
+  g_help_index_stale = True
+  # The objfile's symtabs are indexed on the next check; names it adds may have been misses
+  g_symbol_misses.clear()
+
+def on_clear_objfiles(event):
+  clear_symbol_index()
+
+def clear_symbol_index():
+  g_symbol_index.clear()
+  g_source_file_index.clear()
+  g_source_file_basenames.clear()
+  g_indexed_objfiles.clear()
+  g_symbol_misses.clear()
+
+def selected_frame():
+  try:
+    return gdb.selected_frame()
+  except (gdb.error, RuntimeError, AttributeError):
+    return None
+
+def objfile_source_files(objfile_names):
+  """
+  The source files 'info sources' lists for the given objfiles. GDB 11 and later group the list
+  by objfile; older versions print one list for the whole program, which is returned entire.
+  """
+  try:
+    text = gdb.execute("info sources", to_string=True)
+  except gdb.error:
+    return []
+  loaded = {objfile.filename for objfile in gdb.objfiles()}
+  files = []
+  current = None
+  grouped = False
+  for line in text.splitlines():
+    line = line.strip()
+    if not line or line.startswith("("):
+      continue
+    if line.endswith(":") and "," not in line:
+      current = line[:-1]
+      grouped = grouped or current in loaded
+      continue
+    if not grouped or current in objfile_names:
+      files.extend(name.strip() for name in line.split(",") if name.strip())
+  return files
+
+def index_source_file(path, seen_blocks):
+  """Adds a source file and the global and static names of its compilation unit to the index."""
+  g_source_file_index.add(path)
+  g_source_file_basenames.add(os.path.basename(path))
+  try:
+    sals = gdb.decode_line(f"{path}:1")[1] or []
+  except (gdb.error, RuntimeError):
+    return # A header without code of its own; its names come with the files including it
+  for sal in sals:
+    if sal.symtab is None:
+      continue
+    for block in (sal.symtab.global_block(), sal.symtab.static_block()):
+      key = (block.is_global, block.start, block.end)
+      if key not in seen_blocks:
+        seen_blocks.add(key)
+        g_symbol_index.update(symbol.name for symbol in block)
+
+def index_new_objfiles():
+  """
+  Reads the symtabs of objfiles that are not in the symbol index yet. Each objfile is read once,
+  on the first check after it loads, so startup and unrelated queries never pay for it.
+  """
+  new = {objfile.filename for objfile in gdb.objfiles() if objfile.filename} - g_indexed_objfiles
+  if not new:
+    return
+  start = time.perf_counter()
+  seen_blocks = set()
+  for path in objfile_source_files(new):
+    if path not in g_source_file_index:
+      index_source_file(path, seen_blocks)
+  g_indexed_objfiles.update(new)
+  print_verbose(f"[AgentGDB] Indexed {len(new)} objfiles in {time.perf_counter() - start:.2f}s: "
+                f"{len(g_symbol_index)} names, {len(g_source_file_index)} source files.")
+
+def scope_names(limit=None):
+  """Local variable and argument names of the selected frame, innermost block first."""
+  frame = selected_frame()
+  names = []
+  try:
+    block = frame.block() if frame is not None else None
+    while block is not None and (limit is None or len(names) < limit):
+      names.extend(symbol.name for symbol in block if symbol.name not in names)
+      if block.function is not None:
+        break
+      block = block.superblock
+  except (gdb.error, RuntimeError):
+    pass
+  return names if limit is None else names[:limit]
+
+def symbol_exists(name):
+  """
+  Whether name is a function, variable or type the debugger can see: a set lookup in the symbol
+  index, or one of the selected frame's locals. A name the index lacks is asked about once, for
+  functions without debug info, which only have minimal symbols; the answer is remembered.
+  """
+  index_new_objfiles()
+  if name in g_symbol_index:
+    return True
+  if name in g_symbol_misses:
+    return name in scope_names()
+  if name in scope_names():
+    return True
+  try:
+    gdb.execute("info address " + name, to_string=True)
+    g_symbol_index.add(name)
+    return True
+  except gdb.error:
+    pass
+  try:
+    gdb.lookup_type(name)
+    g_symbol_index.add(name)
+    return True
+  except (gdb.error, RuntimeError):
+    g_symbol_misses.add(name)
+    return False
+
+def source_file_exists(path):
+  """Whether GDB knows a source file of that name (or ending in that partial path), from the index."""
+  index_new_objfiles()
+  if not g_source_file_index:
+    return True # Nothing to check against, e.g. a program without debug info
+  if path in g_source_file_index or path in g_source_file_basenames:
+    return True
+  suffix = "/" + path.lstrip("./")
+  return "/" in path and any(name.endswith(suffix) for name in g_source_file_index)
+
+def location_names(location):
+  """Returns the (kind, name) pairs of a location spec that must exist: ("file", ...) or ("symbol", ...)."""
+  words = location.split()
+  names = []
+  while words and words[0].startswith("-"):
+    option = words.pop(0)
+    if option in ("-source", "-function") and words:
+      names.append(("file" if option == "-source" else "symbol", words.pop(0)))
+    elif option in ("-line", "-label") and words:
+      words.pop(0)
+  if words:
+    spec = words[0]
+    if not spec.startswith(("*", "+", "-", "$")) and not spec.isdigit():
+      file_part, sep, rest = spec.rpartition(":")
+      if "::" in spec or not sep:
+        function = spec
+      elif SOURCE_FILE_LOCATION.match(file_part):
+        names.append(("file", file_part))
+        function = rest # A line number or a function in that file
+      else:
+        function = ""
+      function = function.split("(")[0]
+      if re.fullmatch(r"[A-Za-z_][\w:~]*", function):
+        names.append(("symbol", function))
+  return names
+
+def expression_names(expression):
+  """The identifiers an expression reads, leaving out members, registers, keywords and qualified names."""
+  expression = re.sub(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', " ", expression)
+  names = []
+  for match in re.finditer(r"(?<![\w.$>:])[A-Za-z_]\w*(?!\w)(?!\s*::)", expression):
+    name = match.group(0)
+    before = expression[:match.start()].rstrip()
+    if name in EXPRESSION_KEYWORDS or before.endswith(("struct", "union", "enum", "class")):
+      continue
+    names.append(("symbol", name))
+  return names
+
+def command_names(command_line):
+  """The (kind, name) pairs one command line refers to, for the commands validate_command() understands."""
+  words = command_line.split()
+  if not words:
+    return []
+  head = words[0].split("/")[0] # print/x, x/16xw
+  two = " ".join(words[:2])
+  if two in LOCATION_COMMANDS or two in EXPRESSION_COMMANDS:
+    head, argument = two, " ".join(words[2:])
+  else:
+    argument = command_line.strip()[len(words[0]):].strip()
+  argument = re.sub(r"^(?:/\w+(?:\s+|$))+", "", argument) # disassemble /r main, print /x var
+  if head in LOCATION_COMMANDS:
+    if head == "dprintf":
+      argument = argument.split(",")[0]
+    argument = re.split(r"\s(?:if|thread|task)\s", " " + argument + " ")[0]
+    if head in ("list", "l"):
+      return [name for part in argument.split(",") for name in location_names(part)]
+    return location_names(argument)
+  if head in EXPRESSION_COMMANDS:
+    if " -- " in f" {argument} ":
+      argument = argument.split("--", 1)[1]
+    else:
+      argument = re.sub(r"^(?:-\w[\w-]*\s+)+", "", argument)
+    return expression_names(argument)
+  return []
+
+def unresolved_names(final_gdb_cmd):
+  """Names in a command block that the program does not have. Must run on the GDB thread."""
+  if not gdb.objfiles():
+    return [] # Nothing loaded to check against
+  missing = []
+  nesting = [] # "checked", "skipped" or "script" for each open body
+  for line in final_gdb_cmd.splitlines():
+    stripped = line.strip()
+    words = stripped.split()
+    if nesting and stripped == "end":
+      nesting.pop()
+      continue
+    if nesting and nesting[-1] == "script":
+      continue
+    checked = "skipped" not in nesting
+    if words and words[0] in CLI_BLOCK_COMMANDS:
+      # 'commands' bodies run later in the breakpoint's frame, and 'define' bodies when called
+      nesting.append("checked" if words[0] in ("if", "while") else "skipped")
+    elif len(words) == 1 and words[0] in SCRIPT_BLOCK_COMMANDS:
+      nesting.append("script")
+    if not checked:
+      continue
+    for kind, name in command_names(line):
+      exists = source_file_exists(name) if kind == "file" else symbol_exists(name)
+      if not exists and name not in missing:
+        missing.append(name)
+  return missing
+
+def names_in_scope():
+  """Up to MAX_REPAIR_CANDIDATES local variable and argument names of the selected frame."""
+  return scope_names(MAX_REPAIR_CANDIDATES)
+
+def check_command_symbols(final_gdb_cmd):
+  """Returns (unknown names, names in scope) for a command, from any thread. Unchecked commands have none."""
+  if not on_gdb_thread():
+    if current_async_job() is not None:
+      return call_on_gdb_thread(check_command_symbols, final_gdb_cmd)
+    return [], [] # A batch worker: GDB cannot be asked from here
+  missing = unresolved_names(final_gdb_cmd)
+  return missing, names_in_scope() if missing else []
+
+def validate_command(x_prompt, final_gdb_cmd):
+  """
+  Checks the functions, variables and source files a generated command names before it runs.
+  If one does not exist, the model gets one chance to fix the command (stage 5 again, told which
+  names are wrong and which are in scope). Returns the command to run.
+  """
+  if not g_validation_enabled:
+    return final_gdb_cmd
+  start = time.perf_counter()
+  missing, in_scope = check_command_symbols(final_gdb_cmd)
+  record_stage("validate", time.perf_counter() - start)
+  if not missing:
+    return final_gdb_cmd
+  names = ", ".join(f"'{name}'" for name in missing)
+  print(f"[AgentGDB] {final_gdb_cmd} refers to {names}, which the program does not have.")
+  trace = current_trace()
+  if trace is not None:
+    trace["unknown_names"] = missing
+  if not g_validation_repair:
+    return final_gdb_cmd
+  repaired = repair_command(x_prompt, final_gdb_cmd, missing, in_scope)
+  if repaired is None or repaired == final_gdb_cmd or check_command_symbols(repaired)[0]:
+    print("[AgentGDB] Could not repair the command; running it as generated.")
+    return final_gdb_cmd
+  print(f"[AgentGDB] Repaired command: {repaired}")
+  if trace is not None:
+    trace["repaired"] = True
+  return repaired
+
+def repair_command(x_prompt, final_gdb_cmd, missing, in_scope):
+  """One stage 5 query for a command without the unknown names. Returns the new block, or None."""
+  system_message_stage5 = g_system_prompts.get("stage5")
+  if not system_message_stage5:
+    return None
+  command = final_gdb_cmd.split()[0].split("/")[0]
+  help_text = get_command_help(command) or ""
+  candidates = f" Names in scope: {', '.join(in_scope)}." if in_scope else ""
+  note = REPAIR_NOTE_TEMPLATE.format(command=final_gdb_cmd, names=", ".join(missing), candidates=candidates)
+  raw = query_llm(system_message_stage5 + "\n" + prune_command_help(help_text, x_prompt) + "\nUser Query: ", x_prompt + note, x_stage="stage5")
+  return extract_command_block(raw, "Repair")
+
+def on_stop(event):
+  """Remembers why the inferior stopped; frames are only read when a query needs them."""
+  breakpoints = getattr(event, "breakpoints", None)
+  if breakpoints:
+    g_program_state["reason"] = "at breakpoint " + ", ".join(str(bp.number) for bp in breakpoints)
+  elif getattr(event, "stop_signal", None):
+    g_program_state["reason"] = f"by signal {event.stop_signal}"
+  else:
+    g_program_state["reason"] = None
+  g_frame_state_cache.clear()
+
+def on_cont(event):
+  """The inferior resumed, so the values read at the last stop are out of date."""
+  g_program_state["reason"] = None
+  g_frame_state_cache.clear()
+
+def on_new_thread(event):
+  g_program_state["thread_count"] = None # Counted again on the next query
+
+def on_exited(event):
+  g_program_state.update(reason=None, thread_count=None)
+  g_frame_state_cache.clear()
+
+def on_state_changed(event):
+  """Memory or a register was written (e.g. 'set var'), so cached values may be wrong."""
+  g_frame_state_cache.clear()
+
+def state_value_text(value):
+  """A short rendering of an argument or local. Aggregates show only their type, as printing them may be large."""
+  try:
+    if value.is_optimized_out:
+      return "<optimized out>"
+    if value.type.strip_typedefs().code in (gdb.TYPE_CODE_STRUCT, gdb.TYPE_CODE_UNION, gdb.TYPE_CODE_ARRAY):
+      return f"<{value.type}>"
+    if hasattr(value, "format_string"):
+      text = value.format_string(max_elements=MAX_STATE_VALUE_CHARS, repeat_threshold=10)
+    else:
+      text = str(value)
+  except (gdb.error, RuntimeError):
+    return "<unavailable>"
+  text = " ".join(text.split())
+  return text if len(text) <= MAX_STATE_VALUE_CHARS else text[:MAX_STATE_VALUE_CHARS] + "..."
+
+def frame_location(frame):
+  """A frame's function name and 'file:line' (None without line info)."""
+  function = frame.function()
+  name = function.print_name if function is not None else (frame.name() or f"{frame.pc():#x}")
+  sal = frame.find_sal()
+  if sal.symtab is not None and sal.line:
+    return name, f"{sal.symtab.filename}:{sal.line}"
+  return name, None
+
+def describe_frame(frame, max_chars):
+  """
+  Reads a frame's location, arguments, locals (until about max_chars of them) and caller.
+  Returns {"function", "where", "args", "locals", "caller"}, with arguments and locals as
+  (name, text) and the caller as (function, where) or None.
+  """
+  function_name, where = frame_location(frame)
+  entry = {"function": function_name, "where": where, "args": [], "locals": [], "caller": None}
+  seen = set()
+  used = 0
+  try:
+    block = frame.block()
+  except RuntimeError:
+    block = None # No debug info for this frame
+  while block is not None and used < max_chars:
+    for symbol in block:
+      if not (symbol.is_argument or symbol.is_variable) or symbol.name in seen:
+        continue
+      try:
+        text = state_value_text(frame.read_var(symbol))
+      except (gdb.error, RuntimeError, ValueError):
+        continue
+      entry["args" if symbol.is_argument else "locals"].append((symbol.name, text))
+      seen.add(symbol.name)
+      used += len(symbol.name) + len(text) + 5
+      if used >= max_chars:
+        break
+    if block.function is not None:
+      break
+    block = block.superblock
+  caller = frame.older()
+  if caller is not None:
+    entry["caller"] = frame_location(caller)
+  return entry
+
+def program_state_digest():
+  """
+  Summarizes where the program stopped within [Context] max_tokens: why it stopped and in which
+  thread, then the selected frame's function with its arguments, its locals and its caller, as
+  far as the budget goes. Frames are read once per stop and cached until the inferior resumes
+  (see on_cont()), so repeated queries cost no GDB commands. Runs on the GDB thread.
+  Returns (digest, names of the functions, arguments and locals in it), or (None, set()).
+  """
+  if not g_state_enabled:
+    return None, set()
+  try:
+    thread = gdb.selected_thread()
+    if thread is None or not thread.is_stopped():
+      return None, set()
+    frame = gdb.selected_frame()
+    level = frame.level() if hasattr(frame, "level") else None
+    max_chars = g_state_max_tokens * CHARS_PER_TOKEN_ESTIMATE
+    key = (thread.global_num, level, frame.pc())
+    entry = g_frame_state_cache.get(key)
+    if entry is None:
+      entry = g_frame_state_cache[key] = describe_frame(frame, max_chars)
+    if g_program_state["thread_count"] is None:
+      g_program_state["thread_count"] = len(thread.inferior.threads())
+  except (gdb.error, RuntimeError, AttributeError):
+    return None, set()
+
+  reason = f" {g_program_state['reason']}" if g_program_state["reason"] else ""
+  count = g_program_state["thread_count"]
+  arguments = ", ".join(f"{name}={text}" for name, text in entry["args"])
+  lines = [
+    f"Stopped{reason} in thread {thread.num}" + (f" of {count}" if count > 1 else "") + ".",
+    f"Frame #{level or 0}: {entry['function']} ({arguments})" + (f" at {entry['where']}" if entry["where"] else ""),
+  ]
+  names = {entry["function"]} | {name for name, _ in entry["args"]}
+  if entry["caller"] is not None:
+    caller_name, caller_where = entry["caller"]
+    caller = f"Called from: {caller_name}" + (f" at {caller_where}" if caller_where else "")
+    lines.append(caller)
+    names.add(caller_name)
+  used = sum(len(line) + 1 for line in lines)
+  if used > max_chars and entry["caller"] is not None:
+    used -= len(lines.pop()) + 1
+    names.discard(entry["caller"][0])
+  if used > max_chars:
+    return "\n".join(lines)[:max_chars], names
+  kept = []
+  for name, text in entry["locals"]:
+    item = f"{name} = {text}"
+    if used + len("Locals: ") + len(item) + 2 > max_chars:
+      break
+    kept.append(item)
+    names.add(name)
+    used += len(item) + 2
+  if kept:
+    lines.insert(2, "Locals: " + ", ".join(kept))
+  return "\n".join(lines), names
+
+def begin_program_state(trace):
+  """Takes the program-state digest for the query traced by trace. Call on the GDB thread."""
+  digest, names = program_state_digest()
+  trace["state_digest"] = digest
+  trace["state_names"] = names
+  if digest:
+    trace["state_tokens"] = estimate_tokens(digest)
+
+def with_program_state(x_prompt):
+  """The user query for a generation prompt, followed by the current query's program-state digest if it has one."""
+  trace = current_trace()
+  digest = trace.get("state_digest") if trace is not None else None
+  return f"{x_prompt}\n\nProgram state:\n{digest}" if digest else x_prompt
+
+def uses_program_state(x_prompt, final_gdb_cmd):
+  """
+  Whether a command names something it can only have from the program-state digest: a function,
+  argument or local the query does not mention. Such a command is not cached or learned, since
+  the same words may mean something else at the next stop.
+  """
+  trace = current_trace()
+  names = trace.get("state_names") if trace is not None else None
+  if not names:
+    return False
+  query_words = set(re.findall(r"[A-Za-z_]\w*", x_prompt))
+  return any(word in names and word not in query_words for word in re.findall(r"[A-Za-z_]\w*", final_gdb_cmd))
+
+def stem_token(token):
+  """Strips the most common English suffixes so 'breakpoints' matches 'breakpoint'."""
+  for suffix in ("ing", "es", "ed", "s"):
+    if len(token) > len(suffix) + 3 and token.endswith(suffix):
+      return token[:-len(suffix)]
+  return token
+
+def retrieval_tokens(text, expand_synonyms=False):
+  """Splits text into lower-case, stemmed search terms."""
+  tokens = []
+  for word in re.findall(r"[a-z0-9]+", text.lower()):
+    if word in RETRIEVAL_STOPWORDS:
+      continue
+    tokens.append(stem_token(word))
+    if expand_synonyms:
+      tokens.extend(RETRIEVAL_SYNONYMS.get(word, []))
+  return tokens
+
+def build_retrieval_index(help_index):
+  """Builds BM25 term statistics over every command of the help index."""
+  docs = []
+  document_frequency = Counter()
+  for cmd_class, entry in help_index["classes"].items():
+    for command in entry["commands"]:
+      name_tokens = retrieval_tokens(" ".join([command["name"]] + command["aliases"]))
+      terms = Counter(name_tokens * RETRIEVAL_NAME_WEIGHT + retrieval_tokens(command["summary"]))
+      docs.append((cmd_class, command["name"], terms, sum(terms.values())))
+      document_frequency.update(terms.keys())
+  average_length = sum(doc[3] for doc in docs) / len(docs) if docs else 0.0
+  return {"source": help_index, "docs": docs, "df": document_frequency, "avgdl": average_length}
+
+def rank_commands(x_prompt, top_k=5, cmd_class=None):
+  """Returns up to top_k (score, class, command) tuples for a query, best first, optionally within one class."""
+  global g_retrieval_index
+  help_index = load_help_index()
+  if g_retrieval_index is None or g_retrieval_index["source"] is not help_index:
+    g_retrieval_index = build_retrieval_index(help_index)
+
+  docs = g_retrieval_index["docs"]
+  num_docs = len(docs)
+  query_terms = set(retrieval_tokens(x_prompt, expand_synonyms=True))
+  best = {}
+  for doc_class, name, terms, length in docs:
+    if cmd_class is not None and doc_class != cmd_class:
+      continue
+    score = 0.0
+    for term in query_terms:
+      frequency = terms.get(term)
+      if not frequency:
+        continue
+      df = g_retrieval_index["df"][term]
+      idf = math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+      norm = RETRIEVAL_BM25_K1 * (1.0 - RETRIEVAL_BM25_B + RETRIEVAL_BM25_B * length / g_retrieval_index["avgdl"])
+      score += idf * frequency * (RETRIEVAL_BM25_K1 + 1.0) / (frequency + norm)
+    # A command can be listed under several classes; keep its best-scoring listing
+    if score > 0.0 and score > best.get(name, (0.0,))[0]:
+      best[name] = (score, doc_class, name)
+  return sorted(best.values(), reverse=True)[:top_k]
+
+def prune_class_help(cmd_class, class_help, x_prompt):
+  """
+  Cuts a class listing for stage 3 down to the commands most relevant to the query: at most
+  [Stage3] help_max_commands lines within help_max_tokens, kept in GDB's order. Commands BM25
+  cannot score are kept after the scored ones while they fit.
+  """
+  settings = g_stage_settings["stage3"]
+  max_commands, max_tokens = settings["help_max_commands"], settings["help_max_tokens"]
+  lines = [line for line in class_help.split("\n") if " -- " in line]
+  if (max_commands <= 0 or len(lines) <= max_commands) and (max_tokens <= 0 or estimate_tokens(class_help) <= max_tokens):
+    return class_help
+
+  scores = {name: score for score, _, name in rank_commands(x_prompt, top_k=len(lines), cmd_class=cmd_class)}
+  def line_score(line):
+    names = [name.strip() for name in line.partition(" -- ")[0].split(",")]
+    return max(scores.get(name, 0.0) for name in names)
+  by_relevance = sorted(range(len(lines)), key=lambda i: -line_score(lines[i])) # Stable: ties keep GDB's order
+  kept = set()
+  tokens = 0
+  for i in by_relevance:
+    line_tokens = estimate_tokens(lines[i]) + 1
+    if (max_commands > 0 and len(kept) >= max_commands) or (max_tokens > 0 and kept and tokens + line_tokens > max_tokens):
+      break
+    kept.add(i)
+    tokens += line_tokens
+  return "\n".join(line for i, line in enumerate(lines) if i in kept)
+
+def prune_command_help(help_text, x_prompt):
+  """
+  Bounds 'help <command>' text for stage 5 to [Stage5] help_max_tokens. The first paragraph
+  (the usage line) is always kept; later paragraphs are kept by how many query terms they
+  mention, and printed in their original order.
+  """
+  max_tokens = g_stage_settings["stage5"]["help_max_tokens"]
+  if max_tokens <= 0 or estimate_tokens(help_text) <= max_tokens:
+    return help_text
+
+  paragraphs = re.split(r'\n\s*\n', help_text.strip())
+  query_terms = set(retrieval_tokens(x_prompt, expand_synonyms=True))
+  def overlap(i):
+    return len(query_terms.intersection(retrieval_tokens(paragraphs[i])))
+  kept = {0}
+  tokens = estimate_tokens(paragraphs[0])
+  for i in sorted(range(1, len(paragraphs)), key=lambda i: -overlap(i)):
+    paragraph_tokens = estimate_tokens(paragraphs[i]) + 1
+    if tokens + paragraph_tokens > max_tokens:
+      continue # A shorter, less relevant paragraph may still fit
+    kept.add(i)
+    tokens += paragraph_tokens
+  pruned = "\n\n".join(paragraph for i, paragraph in enumerate(paragraphs) if i in kept)
+  if estimate_tokens(pruned) > max_tokens: # A single huge usage paragraph
+    pruned = help_excerpt(pruned, max_tokens * CHARS_PER_TOKEN_ESTIMATE)
+  return pruned
+
+def retrieval_confidence(ranked):
+  """Relative margin between the two best candidates: 1.0 is unambiguous, 0.0 is a tie."""
+  if not ranked:
+    return 0.0
+  if len(ranked) == 1:
+    return 1.0
+  return (ranked[0][0] - ranked[1][0]) / ranked[0][0]
+
+def retrieval_select_command(x_prompt):
+  """
+  Picks the command locally instead of running stages 1-3.
+  Returns the command, or None if the match is below the confidence threshold.
+  """
+  ranked = rank_commands(x_prompt)
+  confidence = retrieval_confidence(ranked)
+  if not ranked or confidence < g_retrieval_confidence_threshold:
+    print_verbose(f"[AgentGDB] Retrieval: confidence {confidence:.2f} below threshold {g_retrieval_confidence_threshold}, falling back to LLM stages.\n")
+    return None
+  score, cmd_class, command = ranked[0]
+  print_verbose(f"[AgentGDB] Retrieval: selected '{command}' ({cmd_class}), score {score:.2f}, confidence {confidence:.2f}; skipping stages 1-3.\n")
+  return command
+
+def record_startup_timing(step, start):
+  """Records how long a startup step took, given its perf_counter() start time."""
+  g_startup_timings[step] = time.perf_counter() - start
+
+def sys_path_cache_path():
+  return os.path.join(g_cache_dir, SYS_PATH_CACHE_FILE_NAME)
+
+def discover_interpreter_paths():
+  """
+  Returns the sys.path of the 'python' on PATH, where the openai package is installed.
+  Running that interpreter is slow, so the result is cached per interpreter path and mtime
+  (and PYTHONPATH, which the interpreter inherits).
+  """
+  import subprocess
+  interpreter = shutil.which("python")
+  cache_key = None
+  if interpreter:
+    real_interpreter = os.path.realpath(interpreter)
+    cache_key = f"{real_interpreter}:{os.stat(real_interpreter).st_mtime_ns}:{os.environ.get('PYTHONPATH', '')}"
+    data = read_json_file(sys_path_cache_path())
+    if data and data.get("key") == cache_key:
+      print_verbose(f"[AgentGDB] Using cached Python path for {real_interpreter}.")
+      return data["paths"]
+
+  paths_str = subprocess.check_output(["python", '-c', "import os,sys;print(os.linesep.join(sys.path).strip())"]).decode("utf-8")
+  paths = paths_str.split(os.linesep)
+  if cache_key:
+    try:
+      write_json_atomically(sys_path_cache_path(), {"key": cache_key, "paths": paths})
+    except (IOError, OSError) as e:
+      print_verbose(f"[AgentGDB] Could not cache Python path in {sys_path_cache_path()}: {e}")
+  return paths
+
+def extend_sys_path():
+  """Extends the Python search path with the interpreter's site-packages, once. Returns True on success."""
+  global g_sys_path_extended
+  if g_sys_path_extended:
+    return True
+  import subprocess
+  start = time.perf_counter()
+  try:
+    for p in discover_interpreter_paths():
+        if p not in sys.path: # Avoid duplicates
+            sys.path.append(p)
+  except subprocess.CalledProcessError as e:
+    print_error(f"Error extending Python path: {e}")
+    return False
+  except Exception as e:
+    print_error(f"An unexpected error occurred while extending Python path: {e}")
+    return False
+  g_sys_path_extended = True
+  record_startup_timing("sys_path", start)
+  return True
+
+def ensure_openai_client_ready():
+  """
+  Initializes the OpenAI client and loads system prompts if not already done.
+  Returns True if successful, False otherwise.
+  """
+  with g_client_setup_lock:
+    return _ensure_openai_client_ready_locked()
+
+def _ensure_openai_client_ready_locked():
+  global g_openai_client, g_openai_api_key, g_openai_base_url, g_llm_model_identifier
+
+  # Check if we need to load configuration
+  if not (g_openai_api_key and g_openai_base_url and g_llm_model_identifier):
+      print_verbose("Loading plugin configuration...")
+      if not load_plugin_configuration():
+          print_error("Failed to load plugin configuration. Aborting OpenAI client setup.")
+          return False
+      print_verbose("Plugin configuration processed (defaults or loaded).")
+
+  if g_openai_client is None:
+    print_verbose("Setting up OpenAI client...")
+    # Extend Python search path for site-packages only when needed
+    if not extend_sys_path():
+      return False
+    start = time.perf_counter()
+    try:
+      import openai
+    except ImportError:
+      print_error("Error: OpenAI package not found. Please install it using: pip install openai")
+      raise
+    record_startup_timing("openai_import", start)
+
+    start = time.perf_counter()
+    try:
+      g_openai_client = create_openai_client(g_openai_base_url, g_openai_api_key)
+      print_verbose("Success.")
+      print_verbose("\n")
+    except Exception as e: # Catching a broader exception for client initialization
+      print_error(f"Error: Failed to initialize OpenAI client: {e}")
+      print_error("Please ensure your OpenAI server is running and accessible, and your configuration is correct.")
+      print_error(f"Attempted to connect to: {g_openai_base_url} with the provided API key.")
+      return False
+    record_startup_timing("client_init", start)
+    start_keepalive_pings()
+
+  # Load prompts if not already loaded
+  if any(p is None for p in g_system_prompts.values()):
+    print_verbose("Loading system prompts...")
+    start = time.perf_counter()
+    if not load_system_prompts():
+      print_error("Failed to load system prompts. Aborting.")
+      return False
+    record_startup_timing("system_prompts", start)
+    print_verbose("Success.")
+    print_verbose("\n")
+  return True
+
+def create_openai_client(base_url, api_key):
+  from openai import OpenAI as OpenAIClient
+  # query_llm retries itself, within the query's deadline and across endpoints
+  return OpenAIClient(base_url=base_url, api_key=api_key, http_client=make_http_client(), max_retries=0)
+
+def stage_client(x_stage):
+  """
+  Returns (client, model) for a stage: the default client unless the stage's section names its
+  own base_url or api_key, in which case a client for that endpoint is created on first use.
+  """
+  base_urls, api_key, model = stage_endpoints(x_stage)
+  return endpoint_client(base_urls[0], api_key), model
+
+def stage_endpoints(x_stage):
+  """Returns (base URLs, API key, model) for a stage."""
+  settings = g_stage_settings.get(x_stage, {})
+  model = settings.get("model") or g_llm_model_identifier
+  base_urls = settings.get("base_urls") or g_openai_base_urls or [g_openai_base_url]
+  api_key = settings.get("api_key") or g_openai_api_key
+  return base_urls, api_key, model
+
+def endpoint_client(base_url, api_key):
+  """The client for an endpoint: the default one, or one created for it on first use."""
+  if base_url == g_openai_base_url and api_key == g_openai_api_key:
+    return g_openai_client
+  with g_stage_clients_lock:
+    client = g_stage_clients.get((base_url, api_key))
+    if client is None:
+      print_verbose(f"[AgentGDB] Creating a client for {base_url}.")
+      client = create_openai_client(base_url, api_key)
+      g_stage_clients[(base_url, api_key)] = client
+  return client
+
+def endpoint_health(base_url):
+  """The health record of an endpoint; callers hold g_endpoint_health_lock."""
+  health = g_endpoint_health.get(base_url)
+  if health is None:
+    health = {"requests": 0, "errors": 0, "failures": 0, "open_until": 0.0, "ttft": None, "hedges_won": 0}
+    g_endpoint_health[base_url] = health
+  return health
+
+def is_endpoint_failure(error):
+  """Connection errors, timeouts, overload and server errors count against an endpoint; request errors do not."""
+  status = getattr(error, "status_code", None)
+  return status is None or status >= 500 or status in (408, 429)
+
+def record_endpoint_result(base_url, error=None, ttft=None):
+  """Updates an endpoint's health after a request; enough failures in a row open its circuit."""
+  with g_endpoint_health_lock:
+    health = endpoint_health(base_url)
+    if error is None:
+      health["failures"] = 0
+      health["open_until"] = 0.0
+      if ttft is not None:
+        health["ttft"] = ttft if health["ttft"] is None else (1.0 - ENDPOINT_TTFT_SMOOTHING) * health["ttft"] + ENDPOINT_TTFT_SMOOTHING * ttft
+      return
+    health["errors"] += 1
+    if is_endpoint_failure(error):
+      health["failures"] += 1
+      if health["failures"] >= g_circuit_failures:
+        if health["open_until"] <= time.monotonic():
+          print_verbose(f"[AgentGDB] {base_url} failed {health['failures']} times in a row; skipping it for {g_circuit_cooldown:.0f}s.")
+        health["open_until"] = time.monotonic() + g_circuit_cooldown
+
+def record_endpoint_slowness(base_url, seconds):
+  """Folds a lower bound on time to first token (from a lost hedge race) into an endpoint's average."""
+  with g_endpoint_health_lock:
+    health = endpoint_health(base_url)
+    health["ttft"] = seconds if health["ttft"] is None else (1.0 - ENDPOINT_TTFT_SMOOTHING) * health["ttft"] + ENDPOINT_TTFT_SMOOTHING * seconds
+
+def ordered_endpoints(base_urls):
+  """
+  Splits endpoints for a request into (available, cooling). Available ones have a closed
+  circuit, or one whose cooldown is over (a half-open probe); they are ordered by average time
+  to first token, untried ones first and ties in configured order. Those still cooling down
+  follow, soonest first; they are only a last resort.
+  """
+  now = time.monotonic()
+  with g_endpoint_health_lock:
+    health = {url: endpoint_health(url) for url in base_urls}
+  available = [url for url in base_urls if health[url]["open_until"] <= now]
+  available.sort(key=lambda url: health[url]["ttft"] or 0.0)
+  cooling = sorted((url for url in base_urls if health[url]["open_until"] > now), key=lambda url: health[url]["open_until"])
+  return available, cooling
+
+class HedgedStream(object):
+  """
+  A streamed completion raced across several endpoints. The request goes to the first
+  endpoint; if it has produced no token after g_hedge_delay, or fails, it is also sent to the
+  next one. The first endpoint to stream a token wins and the other streams are closed.
+  Endpoints whose circuit is open (fallback_urls) are never hedged to: they are only tried
+  once every other endpoint has failed, or first if there is no other.
+  Iterates the winner's chunks, like the stream the OpenAI client returns.
+  """
+  DONE = object()
+
+  def __init__(self, base_urls, api_key, request, fallback_urls=()):
+    self.endpoints = list(base_urls)
+    self.fallbacks = list(fallback_urls)
+    if not self.endpoints:
+      self.endpoints.append(self.fallbacks.pop(0)) # Every circuit is open: try the one that recovers soonest
+    self.api_key = api_key
+    self.request = request
+    self.events = queue.Queue()
+    self.attempts = []
+    self.lock = threading.Lock()
+    self.closed = False
+    self.start_next_attempt()
+
+  def start_next_attempt(self, failover=False):
+    """Sends the request to the next endpoint; a failover may fall back to an open circuit. Returns False if there is none left."""
+    with self.lock:
+      if self.closed or not (self.endpoints or (failover and self.fallbacks)):
+        return False
+      base_url = self.endpoints.pop(0) if self.endpoints else self.fallbacks.pop(0)
+      attempt = {"base_url": base_url, "stream": None, "start": time.perf_counter(), "done": False}
+      self.attempts.append(attempt)
+    if len(self.attempts) > 1:
+      print_verbose(f"[AgentGDB] Hedging to {attempt['base_url']}.")
+    threading.Thread(target=self.run_attempt, args=(attempt,), name="agentgdb-hedge", daemon=True).start()
+    return True
+
+  def run_attempt(self, attempt):
+    with g_endpoint_health_lock:
+      endpoint_health(attempt["base_url"])["requests"] += 1
+    try:
+      client = endpoint_client(attempt["base_url"], self.api_key)
+      stream = client.chat.completions.create(**self.request)
+      with self.lock:
+        attempt["stream"] = stream
+        closed = self.closed or attempt["done"]
+      if closed:
+        stream.close()
+        return
+      for chunk in stream:
+        self.events.put((attempt, chunk, None))
+      self.events.put((attempt, self.DONE, None))
+    except Exception as e:
+      if not attempt["done"]: # Otherwise the error is just close() cutting off a losing stream
+        record_endpoint_result(attempt["base_url"], e)
+      self.events.put((attempt, None, e))
+
+  def close_attempt(self, attempt):
+    with self.lock:
+      attempt["done"] = True
+      stream = attempt["stream"]
+    if stream is not None:
+      try:
+        close_llm_stream(stream)
+      except Exception:
+        pass
+
+  def close(self):
+    with self.lock:
+      self.closed = True
+      attempts = list(self.attempts)
+    for attempt in attempts:
+      self.close_attempt(attempt)
+    self.events.put((None, self.DONE, None)) # Wake up the reader
+
+  def __iter__(self):
+    winner = None
+    live = 1
+    while True:
+      can_hedge = winner is None and g_hedge_delay > 0 and self.endpoints
+      try:
+        attempt, chunk, error = self.events.get(timeout=g_hedge_delay if can_hedge else None)
+      except queue.Empty:
+        if self.start_next_attempt():
+          live += 1
+        continue
+      if attempt is None: # close()
+        raise RuntimeError("stream closed")
+      if attempt["done"] or (winner is not None and attempt is not winner):
+        continue # A stream that lost the race
+      if error is not None:
+        attempt["done"] = True
+        live -= 1
+        if winner is not None or not is_endpoint_failure(error):
+          raise error # Mid-stream failures and rejected requests are not retried elsewhere
+        print_verbose(f"[AgentGDB] {attempt['base_url']} failed: {error}")
+        if live == 0: # Nothing else in flight: fail over now instead of after the hedge delay
+          if not self.start_next_attempt(failover=True):
+            raise error
+          live += 1
+        continue
+      if chunk is self.DONE:
+        if winner is None:
+          record_endpoint_result(attempt["base_url"], ttft=time.perf_counter() - attempt["start"])
+          self.claim(attempt)
+        return
+      if winner is None:
+        if not (chunk.choices and getattr(chunk.choices[0].delta, "content", None)):
+          continue # Role headers and the like say nothing about which endpoint is faster
+        winner = attempt
+        record_endpoint_result(attempt["base_url"], ttft=time.perf_counter() - attempt["start"])
+        self.claim(attempt)
+      yield chunk
+
+  def claim(self, winner):
+    """Makes winner the only stream left and closes the rest."""
+    for attempt in list(self.attempts):
+      if attempt is not winner and not attempt["done"]:
+        self.close_attempt(attempt)
+        # It had no token yet, so its time to first token is at least this long
+        record_endpoint_slowness(attempt["base_url"], time.perf_counter() - attempt["start"])
+    if winner is not self.attempts[0]:
+      with g_endpoint_health_lock:
+        endpoint_health(winner["base_url"])["hedges_won"] += 1
+
+def open_llm_stream(x_stage, request):
+  """
+  Starts a streamed chat completion for a stage: through the daemon if one is configured and
+  running, otherwise directly, hedged across the stage's endpoints if it has several.
+  """
+  base_urls, api_key, model = stage_endpoints(x_stage)
+  request = dict(request, model=model)
+  if g_daemon_enabled:
+    stream = open_daemon_stream(base_urls, api_key, request)
+    if stream is not None:
+      return stream
+  if len(base_urls) == 1:
+    return endpoint_client(base_urls[0], api_key).chat.completions.create(**request)
+  available, cooling = ordered_endpoints(base_urls)
+  return HedgedStream(available, api_key, request, cooling)
+
+class DaemonRequestError(Exception):
+  """An LLM request the daemon could not complete; status_code is the server's, if it answered."""
+  def __init__(self, message, status_code=None):
+    super(DaemonRequestError, self).__init__(message)
+    self.status_code = status_code
+
+class DaemonStream(object):
+  """A streamed completion relayed by the daemon. Iterates chunks shaped like the OpenAI client's."""
+  def __init__(self, sock):
+    self.sock = sock
+    self.reader = sock.makefile("r", encoding="utf-8")
+
+  def close(self):
+    try:
+      self.sock.shutdown(socket.SHUT_RDWR) # Wakes up a reader blocked on the socket
+    except OSError:
+      pass
+    self.sock.close()
+
+  def __iter__(self):
+    for line in self.reader:
+      message = json.loads(line)
+      if "content" in message:
+        yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=message["content"]))], usage=None)
+      elif "usage" in message:
+        yield types.SimpleNamespace(choices=[], usage=types.SimpleNamespace(**message["usage"]))
+      elif "error" in message:
+        raise DaemonRequestError(message["error"], message.get("status_code"))
+      elif message.get("done"):
+        return
+    raise DaemonRequestError("the daemon closed the connection")
+
+def daemon_connect(message):
+  """
+  Connects to the daemon and sends a request. Returns the socket, or None if the daemon is not
+  reachable, in which case it is not tried again for DAEMON_RETRY_INTERVAL seconds.
+  """
+  global g_daemon_down_until
+  if time.monotonic() < g_daemon_down_until:
+    return None
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+    sock.connect(g_daemon_socket)
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+    sock.settimeout(None)
+    return sock
+  except OSError as e:
+    sock.close()
+    g_daemon_down_until = time.monotonic() + DAEMON_RETRY_INTERVAL
+    print_verbose(f"[AgentGDB] Daemon not reachable at {g_daemon_socket} ({e}); calling the LLM server directly.")
+    return None
+
+def open_daemon_stream(base_urls, api_key, request):
+  """Sends a chat request through the daemon. Returns a DaemonStream, or None to call the server directly."""
+  sock = daemon_connect({"op": "chat", "base_urls": base_urls, "api_key": api_key, "request": request})
+  with g_stats_lock:
+    g_daemon_stats["requests" if sock is not None else "fallbacks"] += 1
+  return DaemonStream(sock) if sock is not None else None
+
+def daemon_report():
+  """The daemon's own counters (requests, merged, cache hits, ...), or None if it is not reachable."""
+  sock = daemon_connect({"op": "stats"})
+  if sock is None:
+    return None
+  try:
+    sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+    with sock.makefile("r", encoding="utf-8") as reader:
+      return json.loads(reader.readline())
+  except (OSError, ValueError):
+    return None
+  finally:
+    sock.close()
+
+def stage_routing_fingerprint():
+  """Describes which model and endpoint each stage uses, for cache keys."""
+  parts = []
+  for stage in sorted(g_stage_settings):
+    settings = g_stage_settings[stage]
+    if settings.get("model") or settings.get("base_url"):
+      parts.append(f"{stage}={settings.get('model') or ''}@{settings.get('base_url') or ''}")
+  return ",".join(parts)
+
+def make_http_client():
+  """Builds the pooled HTTP client for the OpenAI client, or returns None to use its default."""
+  try:
+    import httpx
+    from openai import DefaultHttpxClient
+  except ImportError:
+    print_verbose("[AgentGDB] httpx connection pool settings are not supported by this openai version; using defaults.")
+    return None
+  limits = httpx.Limits(
+    max_connections=g_max_connections,
+    max_keepalive_connections=g_max_keepalive_connections,
+    keepalive_expiry=g_keepalive_expiry,
+  )
+  return DefaultHttpxClient(limits=limits)
+
+def note_llm_activity():
+  global g_last_llm_activity
+  g_last_llm_activity = time.monotonic()
+
+def keepalive_ping_loop():
+  """Thread body that keeps the pooled connection open while GDB sits idle at the prompt."""
+  while True:
+    idle = time.monotonic() - g_last_llm_activity
+    if idle < g_keepalive_ping_interval:
+      time.sleep(g_keepalive_ping_interval - idle)
+      continue
+    with g_stage_clients_lock:
+      clients = [g_openai_client] + list(g_stage_clients.values())
+    for client in clients:
+      try:
+        client.models.list() # Cheap request that reuses (and so refreshes) a pooled connection
+        print_verbose("[AgentGDB] Keep-alive ping sent.")
+      except Exception as e:
+        print_verbose(f"[AgentGDB] Keep-alive ping failed: {e}")
+    note_llm_activity()
+
+def start_keepalive_pings():
+  """Starts the keep-alive thread once, if pings are enabled and the client is ready."""
+  global g_keepalive_thread
+  if g_keepalive_ping_interval <= 0 or g_keepalive_thread is not None or g_openai_client is None:
+    return
+  note_llm_activity()
+  g_keepalive_thread = threading.Thread(target=keepalive_ping_loop, name="agentgdb-keepalive", daemon=True)
+  g_keepalive_thread.start()
+
+def warmup_llm_server():
+  """
+  Sends each static system prompt with a one-token completion, so the connection is open and
+  the server has the model loaded and the prompt prefixes cached. Returns [(stage, seconds or None)].
+  """
+  results = []
+  for stage, system_message in g_system_prompts.items():
+    if not system_message or (stage == "iterate" and not g_iterative_enabled):
+      continue
+    start = time.perf_counter()
+    try:
+      client, model = stage_client(WARMUP_PROMPT_STAGES.get(stage, stage))
+      client.chat.completions.create(
+        model=model,
+        messages=[
+          {"role": "system", "content": system_message},
+          {"role": "user", "content": WARMUP_USER_MESSAGE},
+        ],
+        temperature=0.0,
+        max_tokens=1,
+      )
+      results.append((stage, time.perf_counter() - start))
+    except Exception as e:
+      print_error(f"Warm-up request for {stage} failed: {e}")
+      results.append((stage, None))
+    note_llm_activity()
+  return results
+
+def background_client_setup():
+  """Thread body that gets the client ready while the user is still at the GDB prompt."""
+  start = time.perf_counter()
+  try:
+    if not ensure_openai_client_ready():
+      print_error("Failed to initialize AI GDB agent in the background. It will be retried on first use.")
+      print_error("Please check your OpenAI client configuration (e.g., API key, base URL, model ID in ~/.agentgdb_config.ini) and system prompt files.")
+    elif g_warmup_on_startup:
+      warmup_start = time.perf_counter()
+      warmup_llm_server()
+      record_startup_timing("warmup", warmup_start)
+  except Exception as e:
+    print_error(f"Failed to initialize AI GDB agent in the background: {e}")
+  record_startup_timing("background_setup", start)
+
+def start_background_client_setup():
+  thread = threading.Thread(target=background_client_setup, name="agentgdb-client-setup", daemon=True)
+  thread.start()
+  return thread
+
+def completed_answer_lines(text):
+  """
+  Returns the finished, non-empty lines of a partial response, ignoring any <think> block.
+  The last line is left out while it may still be growing.
+  """
+  if "<think>" in text:
+    if "</think>" not in text:
+      return []
+    text = text.rsplit("</think>", 1)[1]
+  return [line.strip() for line in text.split("\n")[:-1] if line.strip()]
+
+def last_answer_line(text):
+  """Returns the most recent finished answer line of a partial response, or None."""
+  lines = completed_answer_lines(text)
+  return lines[-1] if lines else None
+
+def stage1_stop_fn(text):
+  """Stage 1 is answered as soon as a line names a supported command class."""
+  return last_answer_line(text) in SUPPORTED_COMMAND_CLASSES
+
+def make_stage3_stop_fn(cmd_class):
+  """Stage 3 is answered as soon as a line names a command listed in the class help."""
+  names = set(class_command_names(cmd_class))
+  def stage3_stop_fn(text):
+    return last_answer_line(text) in names
+  return stage3_stop_fn
+
+def query_llm(x_system_message, x_prompt, x_echo=None, x_cancel_event=None, x_stage=None, x_stop_fn=None, x_response_format=None):
+  """
+  Queries the LLM and returns the collected response, or an empty string on failure.
+  Each request may take the stage's share of the query deadline (see stage_time_limit());
+  failed or timed-out requests are retried up to [Pipeline] llm_retries times with exponential
+  backoff, while that share leaves time for it.
+  x_echo streams tokens to the terminal (by default unless the thread runs quietly, see
+  g_worker_local). Setting x_cancel_event closes the stream early and
+  returns an empty string; on an async query's thread its agent-cancel event is used by
+  default, and cancelling raises QueryCancelled instead. x_stage selects per-stage settings (max_tokens, stop sequences), and
+  x_stop_fn(collected_text) closes the stream as soon as it returns True, keeping the text so far.
+  x_response_format is passed on as response_format; if the server rejects it,
+  StructuredOutputUnsupported is raised.
+  """
+  job = current_async_job()
+  cancel_event = x_cancel_event or (job.cancel_event if job is not None else None)
+  response = ""
+  for attempt in range(g_llm_retries + 1):
+    response, outcome = query_llm_attempt(x_system_message, x_prompt, x_echo, x_cancel_event, x_stage, x_stop_fn,
+                                          x_response_format, stage_time_limit(x_stage))
+    if outcome not in RETRYABLE_OUTCOMES or attempt == g_llm_retries:
+      break
+    delay = g_retry_backoff * (2 ** attempt)
+    remaining = remaining_budget()
+    if remaining is not None and remaining <= delay:
+      break # No time left for another request
+    print_verbose(f"[AgentGDB] {x_stage or 'LLM'}: request {outcome}, retrying in {delay:.1f}s.")
+    trace = current_trace()
+    if trace is not None:
+      trace["retries"] = trace.get("retries", 0) + 1
+    if cancel_event is not None and cancel_event.wait(delay):
+      break
+    if cancel_event is None:
+      time.sleep(delay)
+  return response
+
+def close_llm_stream(stream):
+  """
+  Closes a stream from any thread. close() alone does not wake a reader blocked on a server that
+  stalls before its next chunk, so the connection's socket is shut down first.
+  """
+  try:
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is not None:
+      sock.shutdown(socket.SHUT_RDWR)
+  except (AttributeError, OSError):
+    pass # Not an HTTP stream (HedgedStream, DaemonStream), or already closed
+  stream.close()
+
+def close_expired_stream(stream, expired):
+  expired.set()
+  try:
+    close_llm_stream(stream)
+  except Exception:
+    pass
+
+def query_llm_attempt(x_system_message, x_prompt, x_echo, x_cancel_event, x_stage, x_stop_fn, x_response_format, x_time_limit):
+  """One streamed request for query_llm, closed after x_time_limit seconds. Returns (response, outcome)."""
+  global g_openai_client
+  if not g_openai_client:
+    print_error("OpenAI client not available.")
+    return "", "error"
+
+  messages = [
+    {"role": "system", "content": x_system_message},
+    {"role": "user", "content": x_prompt}
+  ]
+
+  if x_echo is None:
+    x_echo = getattr(g_worker_local, "echo", True) and not g_render_quiet
+  job = current_async_job()
+  if x_cancel_event is None and job is not None:
+    x_cancel_event = job.cancel_event
+  settings = g_stage_settings.get(x_stage, {})
+  options = {}
+  if settings.get("max_tokens"):
+    options["max_tokens"] = settings["max_tokens"]
+  if settings.get("stop"):
+    options["stop"] = settings["stop"]
+  if not settings.get("early_stop", True):
+    x_stop_fn = None
+  if x_response_format is not None:
+    options["response_format"] = x_response_format
+    options.setdefault("max_tokens", STRUCTURED_OUTPUT_MAX_TOKENS)
+
+  if x_time_limit is not None:
+    options["timeout"] = max(x_time_limit, 0.001) # Bounds connecting; the watchdog below bounds streaming
+  if g_stats_request_usage:
+    options["stream_options"] = {"include_usage": True}
+
+  note_llm_activity()
+  start = time.perf_counter()
+  first_token_time = None
+  num_chunks = 0
+  usage = None
+  outcome = "ok"
+  response_parts = [] # Joined at line ends and at the end; += would copy the whole response for every token
+  renderer = TokenRenderer() if x_echo else None
+  expired = threading.Event()
+  watchdog = None
+  stream = None
+  if job is not None:
+    job.set_stage(x_stage or "llm")
+  try:
+    if x_cancel_event is not None and x_cancel_event.is_set():
+      outcome = "cancelled"
+      return "", outcome
+    if x_time_limit is not None and x_time_limit <= 0:
+      outcome = "timeout"
+      print_error(f"{x_stage or 'LLM'}: the query ran out of time.")
+      return "", outcome
+    stream = open_llm_stream(x_stage, dict(
+      messages=messages,
+      temperature=settings.get("temperature", DEFAULT_TEMPERATURE),
+      stream=True,
+      **options
+    ))
+    if job is not None:
+      job.attach_stream(stream)
+    if x_time_limit is not None:
+      watchdog = threading.Timer(max(0.0, x_time_limit - (time.perf_counter() - start)), close_expired_stream, args=(stream, expired))
+      watchdog.daemon = True
+      watchdog.start()
+    for chunk in stream:
+      if x_cancel_event is not None and x_cancel_event.is_set():
+        stream.close() # Stop the server from generating tokens nobody will read
+        outcome = "cancelled"
+        return "", outcome
+      if getattr(chunk, "usage", None):
+        usage = chunk.usage
+      if chunk.choices and hasattr(chunk.choices[0], 'delta') and hasattr(chunk.choices[0].delta, 'content'):
+        content = chunk.choices[0].delta.content
+        if content:
+          if first_token_time is None:
+            first_token_time = time.perf_counter()
+          num_chunks += 1
+          if job is not None:
+            job.tokens += 1
+          if renderer is not None:
+            renderer.write(content)
+          response_parts.append(content)
+          # Answers are whole lines, so only a newline can complete one
+          if x_stop_fn is not None and "\n" in content:
+            collected_response = "".join(response_parts)
+            if x_stop_fn(collected_response):
+              stream.close()
+              response_parts = [collected_response[:collected_response.rfind("\n")]] # Drop the next, unfinished line
+              outcome = "stopped_early"
+              if renderer is not None:
+                renderer.flush()
+              print_verbose(f"\n[AgentGDB] {x_stage or 'LLM'}: answer complete, stream closed early.")
+              break
+    if expired.is_set():
+      raise TimeoutError("stream closed at the deadline") # Some streams end quietly when closed
+    if renderer is not None:
+      renderer.finish()
+      renderer = None
+    return "".join(response_parts).strip(), outcome
+  except Exception as e: # Catching a broader exception for API calls
+    if renderer is not None:
+      renderer.finish() # Show what arrived before the error
+      renderer = None
+    if x_cancel_event is not None and x_cancel_event.is_set():
+      outcome = "cancelled" # agent-cancel closed the stream under us
+      return "", outcome
+    if expired.is_set() or "Timeout" in type(e).__name__:
+      outcome = "timeout"
+      print_error(f"{x_stage or 'LLM'}: no complete answer within {x_time_limit:.1f}s." if x_time_limit is not None else f"{x_stage or 'LLM'}: request timed out.")
+      return "", outcome
+    if x_response_format is not None and getattr(e, "status_code", None) in (400, 404, 422, 501):
+      outcome = "rejected"
+      raise StructuredOutputUnsupported(str(e))
+    outcome = "error" if is_endpoint_failure(e) else "bad_request" # Only the former is worth retrying
+    print_error(f"Error querying LLM: {e}")
+    return "", outcome
+  finally:
+    if renderer is not None:
+      renderer.finish()
+    if watchdog is not None:
+      watchdog.cancel()
+    if job is not None and stream is not None:
+      job.detach_stream(stream)
+    end = time.perf_counter()
+    # Servers usually stream about one token per chunk; exact counts need include_usage
+    prompt_tokens = usage.prompt_tokens if usage else estimate_tokens(x_system_message + x_prompt)
+    completion_tokens = usage.completion_tokens if usage else num_chunks
+    ttft = first_token_time - start if first_token_time is not None else None
+    decode_seconds = end - first_token_time if first_token_time is not None else 0.0
+    record_stage(
+      x_stage or "llm", end - start,
+      ttft=ttft,
+      tokens_per_second=completion_tokens / decode_seconds if decode_seconds > 0 else None,
+      prompt_tokens=prompt_tokens,
+      completion_tokens=completion_tokens,
+      outcome=outcome,
+    )
+    if outcome == "cancelled" and job is not None and job.cancel_event.is_set():
+      raise QueryCancelled() # Unwind the rest of the pipeline instead of reporting stage failures
+
+def split_command_block(block):
+  """
+  Splits a generated command block into the commands to run one at a time. A command that
+  reads a body ('commands', 'if', 'while', 'define', a bare 'python', ...) stays together with
+  the lines up to its matching 'end'. Blank lines and comments between commands are dropped.
+  """
+  commands = []
+  lines = []
+  nesting = [] # "cli" or "script" for each open body
+  for line in block.splitlines():
+    stripped = line.strip()
+    if not nesting and (not stripped or stripped.startswith("#")):
+      continue
+    lines.append(line.rstrip() if nesting else stripped)
+    words = stripped.split()
+    if nesting and nesting[-1] == "script":
+      if stripped == "end":
+        nesting.pop()
+    elif nesting and stripped == "end":
+      nesting.pop()
+    elif words and words[0] in CLI_BLOCK_COMMANDS:
+      nesting.append("cli")
+    elif len(words) == 1 and words[0] in SCRIPT_BLOCK_COMMANDS:
+      nesting.append("script")
+    if not nesting:
+      commands.append("\n".join(lines))
+      lines = []
+  if lines:
+    commands.append("\n".join(lines)) # A body without its 'end'; GDB reports it
+  return commands
+
+def read_output_excerpt(f, size, max_bytes):
+  """
+  Reads the output in binary file f of size bytes, keeping its first and last max_bytes / 2
+  cut at line boundaries. Returns (text, bytes omitted from the middle).
+  """
+  if size <= max_bytes:
+    return f.read().decode("utf-8", "replace"), 0
+  half = max_bytes // 2
+  head = f.read(half)
+  f.seek(size - half)
+  tail = f.read(half)
+  head = head[:head.rfind(b"\n") + 1] or head
+  newline = tail.find(b"\n")
+  tail = tail[newline + 1:] if 0 <= newline < len(tail) - 1 else tail
+  omitted = size - len(head) - len(tail)
+  return head.decode("utf-8", "replace") + f"[... {omitted} bytes omitted ...]\n" + tail.decode("utf-8", "replace"), omitted
+
+def start_output_capture():
+  """
+  Starts copying GDB's output to a temporary file with 'set logging', so a command's output is
+  streamed to disk instead of being held in memory; it is still shown on the terminal.
+  Returns (path, saved logging settings), or None if GDB's logging is unavailable (before
+  GDB 12) or the user is logging already.
+  """
+  try:
+    if gdb.parameter("logging enabled"):
+      return None
+    saved = {name: gdb.parameter(name) for name in ("logging file", "logging overwrite", "logging redirect")}
+  except (AttributeError, RuntimeError, gdb.error):
+    return None
+  fd, path = tempfile.mkstemp(prefix="agentgdb-output-", suffix=".log")
+  os.close(fd)
+  try:
+    gdb.execute(f"set logging file {path}")
+    gdb.execute("set logging overwrite on")
+    gdb.execute("set logging redirect off")
+    gdb.execute("set logging enabled on")
+  except gdb.error:
+    restore_logging_settings(saved)
+    os.unlink(path)
+    return None
+  return path, saved
+
+def restore_logging_settings(saved):
+  gdb.execute(f"set logging file {saved['logging file']}")
+  gdb.execute(f"set logging overwrite {'on' if saved['logging overwrite'] else 'off'}")
+  gdb.execute(f"set logging redirect {'on' if saved['logging redirect'] else 'off'}")
+
+def finish_output_capture(capture):
+  """Stops a capture started by start_output_capture(). Returns (excerpt, total bytes, bytes omitted)."""
+  path, saved = capture
+  try:
+    gdb.execute("set logging enabled off")
+    restore_logging_settings(saved)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+      text, omitted = read_output_excerpt(f, size, g_max_output_bytes)
+    return text, size, omitted
+  finally:
+    os.unlink(path)
+
+def run_command(command, capture):
+  """
+  Runs one GDB command, reporting rather than raising its error. With capture, keeps an excerpt
+  of its output (see [Execution] max_output_bytes). Returns
+  {"command", "ok", "error", "output", "bytes", "omitted"}.
+  """
+  result = {"command": command, "ok": True, "error": None, "output": "", "bytes": 0, "omitted": 0}
+  print("(gdb) " + command)
+  capture_file = start_output_capture() if capture else None
+  try:
+    if capture and capture_file is None:
+      # No logging to stream the output through, so GDB buffers all of it
+      output = gdb.execute(command, to_string=True) or ""
+      print(output, end="")
+      data = output.encode("utf-8")
+      result["output"], result["omitted"] = read_output_excerpt(io.BytesIO(data), len(data), g_max_output_bytes)
+      result["bytes"] = len(data)
+    else:
+      gdb.execute(command, to_string=False)
+  except gdb.error as e:
+    result.update(ok=False, error=str(e))
+    print_error(f"Error executing GDB command '{command}': {e}")
+  except Exception as e: # Catch other potential errors
+    result.update(ok=False, error=str(e))
+    print_error(f"An unexpected error occurred while executing GDB command '{command}': {e}")
+  finally:
+    if capture_file is not None:
+      result["output"], result["bytes"], result["omitted"] = finish_output_capture(capture_file)
+  return result
+
+def run_command_block(gdb_cmd_str, capture=False):
+  """
+  Runs a command block one command at a time, in order. A failing command is reported and the
+  rest still run, unless [Execution] stop_on_error is set. Returns the results of run_command().
+  """
+  start = time.perf_counter()
+  results = []
+  try:
+    for command in split_command_block(gdb_cmd_str):
+      result = run_command(command, capture)
+      results.append(result)
+      if not result["ok"]:
+        trace_failure("execute")
+        if g_stop_on_error:
+          break
+    if not results:
+      print_error(f"No command to execute in '{gdb_cmd_str}'.")
+      trace_failure("execute")
+  finally:
+    record_stage("execute", time.perf_counter() - start)
+  return results
+
+def block_succeeded(results):
+  return bool(results) and all(result["ok"] for result in results)
+
+def execute_gdb_command(gdb_cmd_str):
+  """Executes a command block (see run_command_block()). Returns whether every command succeeded."""
+  return block_succeeded(run_command_block(gdb_cmd_str))
+
+def compact_output(text):
+  """Drops trailing blanks and collapses runs of identical lines, as in the backtraces of many idle threads."""
+  lines = []
+  repeats = 0
+  for line in text.rstrip().splitlines():
+    line = line.rstrip()
+    if lines and line == lines[-1]:
+      repeats += 1
+      continue
+    if repeats:
+      lines.append(f"[previous line repeated {repeats} more times]")
+      repeats = 0
+    lines.append(line)
+  if repeats:
+    lines.append(f"[previous line repeated {repeats} more times]")
+  return "\n".join(lines)
+
+def excerpt_text(text, max_chars):
+  """Keeps the first and last lines of text within about max_chars, noting how many were dropped."""
+  if len(text) <= max_chars:
+    return text
+  lines = text.splitlines()
+  head_end, used = 0, 0
+  while head_end < len(lines) and used + len(lines[head_end]) + 1 <= max_chars // 2:
+    used += len(lines[head_end]) + 1
+    head_end += 1
+  tail_start, used = len(lines), 0
+  while tail_start > head_end and used + len(lines[tail_start - 1]) + 1 <= max_chars // 2:
+    tail_start -= 1
+    used += len(lines[tail_start]) + 1
+  if head_end == 0 and tail_start == len(lines):
+    return text[:max_chars] + " [...]" # One very long line
+  return "\n".join(lines[:head_end] + [f"[... {tail_start - head_end} lines omitted ...]"] + lines[tail_start:])
+
+def summarize_results(results, max_tokens):
+  """
+  Renders executed commands and their output for a follow-up query within about max_tokens.
+  Every command keeps its line; the outputs share the rest of the budget, short ones whole and
+  the longest cut to their head and tail. The oldest commands are left out if even their lines do not fit.
+  """
+  max_chars = max_tokens * CHARS_PER_TOKEN_ESTIMATE
+  headers = []
+  for result in results:
+    header = f"(gdb) {result['command']}"
+    if not result["ok"]:
+      header += f"\nError: {result['error']}"
+    elif result["omitted"]:
+      header += f"\n[output was {result['bytes']} bytes; {result['omitted']} bytes from its middle were not kept]"
+    headers.append(header)
+  first = 0
+  while first < len(results) - 1 and sum(len(header) + 2 for header in headers[first:]) > max_chars // 2:
+    first += 1
+  outputs = [compact_output(result["output"]) for result in results[first:]]
+  remaining = max_chars - sum(len(header) + 2 for header in headers[first:])
+  shares = [None] * len(outputs)
+  # Shortest first, so what short outputs leave unused goes to the long ones
+  for count, index in enumerate(sorted(range(len(outputs)), key=lambda i: len(outputs[i]))):
+    shares[index] = excerpt_text(outputs[index], max(0, remaining // (len(outputs) - count)))
+    remaining -= len(shares[index]) + 1
+  parts = [f"[{first} earlier commands omitted]"] if first else []
+  for header, output in zip(headers[first:], shares):
+    parts.append(header + ("\n" + output if output else ""))
+  return "\n\n".join(parts)
+
+def run_iterations(x_prompt, results, x_ask):
+  """
+  Iterative mode ([Execution] iterative): shows the model what the commands printed and runs the
+  follow-up commands it answers with, until it answers ITERATION_DONE_MARKER, [Execution]
+  max_steps command blocks have run or the query's deadline leaves no time for another query.
+  Each follow-up query carries a summary of all output so far within [Execution] summary_tokens.
+  """
+  system_message_iterate = g_system_prompts.get("iterate")
+  if not system_message_iterate:
+    return
+  history = list(results)
+  for step in range(1, g_iteration_steps):
+    remaining = remaining_budget()
+    if (remaining is not None and remaining <= 0) or budget_too_short(["stage5"]):
+      print_verbose("[AgentGDB] Iterate: no time left for another step.")
+      return
+    summary = summarize_results(history, g_summary_tokens)
+    raw = query_llm(system_message_iterate, f"User Query: {x_prompt}\n\nExecuted so far:\n{summary}", x_stage="stage5")
+    if raw.strip() and re.split(r'\n\s*\n', raw.strip())[-1].strip() == ITERATION_DONE_MARKER:
+      return
+    gdb_cmd_str = extract_command_block(raw, "Iterate")
+    if gdb_cmd_str is None:
+      return
+    gdb_cmd_str = validate_command(x_prompt, gdb_cmd_str)
+    if x_ask:
+      print("[AgentGDB] Suggested follow-up: " + gdb_cmd_str)
+      if input("[AgentGDB] Execute this command? (y/N): ").lower() != 'y':
+        return
+    else:
+      print(f"[AgentGDB] Step {step + 1}:")
+    history.extend(run_command_block(gdb_cmd_str, capture=True))
+
+class StructuredOutputUnsupported(Exception):
+  """Raised by query_llm when the server rejects a response_format."""
+
+def json_choice_format(name, key, choices):
+  """A response_format that only admits {key: <one of choices>}."""
+  return {
+    "type": "json_schema",
+    "json_schema": {
+      "name": name,
+      "strict": True,
+      "schema": {
+        "type": "object",
+        "properties": {key: {"type": "string", "enum": list(choices)}},
+        "required": [key],
+        "additionalProperties": False,
+      },
+    },
+  }
+
+def parse_json_choice(raw, key):
+  """Returns raw's last JSON object's key, or None if there is no such object."""
+  for match in reversed(re.findall(r'\{[^{}]*\}', raw)):
+    try:
+      value = json.loads(match).get(key)
+    except ValueError:
+      continue
+    if isinstance(value, str):
+      return value.strip()
+  return None
+
+def clean_answer_line(line):
+  """Strips the markup models like to wrap one-word answers in."""
+  return line.strip().strip("*`'\"").rstrip(".").strip()
+
+def query_llm_choice(x_system_message, x_prompt, x_stage, key, choices, parse_plain, x_stop_fn=None, x_also_valid=None):
+  """
+  Asks a question whose answer must be one of choices (stages 1 and 3). With [Pipeline]
+  structured_output the server is held to a JSON schema enum; otherwise the answer is parsed
+  with parse_plain(raw). Either way it is validated locally, and an invalid answer gets a single
+  retry that tells the model what was wrong. x_also_valid(answer) may accept answers outside
+  choices. Returns (answer or None, last raw response).
+  """
+  global g_structured_output_supported
+  valid = set(choices)
+  prompt = x_prompt
+  raw = ""
+  for attempt in range(2):
+    raw = None
+    if g_structured_output and g_structured_output_supported:
+      try:
+        raw = query_llm(x_system_message + STRUCTURED_OUTPUT_INSTRUCTION.format(key=key), prompt, x_stage=x_stage,
+                        x_response_format=json_choice_format(x_stage, key, choices))
+      except StructuredOutputUnsupported as e:
+        g_structured_output_supported = False
+        print_verbose(f"[AgentGDB] The server rejected structured output ({e}); validating plain answers instead.\n")
+    if raw is None:
+      raw = query_llm(x_system_message, prompt, x_stage=x_stage, x_stop_fn=x_stop_fn)
+    if not raw:
+      return None, raw # No answer at all (connection error, cancel): a retry would not help
+    answer = parse_json_choice(raw, key) # Also catches servers that ignore response_format
+    if answer is None:
+      answer = parse_plain(raw)
+    if answer in valid or (answer and x_also_valid is not None and x_also_valid(answer)):
+      return answer, raw
+    if attempt == 0:
+      print_verbose(f"[AgentGDB] {x_stage}: '{answer}' is not a valid answer, asking once more.\n")
+      trace = current_trace()
+      if trace is not None:
+        trace["retries"] = trace.get("retries", 0) + 1
+      prompt = x_prompt + CHOICE_RETRY_TEMPLATE.format(answer=answer, choices=", ".join(choices))
+  return None, raw
+
+def parse_stage1_response(raw):
+  """The command class is the last non-empty line (after any summary or <think> block)."""
+  response_lines = [line for line in raw.split("\n") if line.strip()]
+  return clean_answer_line(response_lines[-1]) if response_lines else None
+
+def classify_query(x_prompt):
+  """Stage 1: asks the LLM for the GDB command class of a query. Returns the class, or None."""
+  # STAGE 1: Classify the user's intent
+  system_message_stage1 = g_system_prompts.get("stage1")
+  if not system_message_stage1:
+    print_error("Error: Stage 1 system prompt not loaded. Aborting.\n")
+    return
+
+  print_verbose("[AgentGDB] Stage 1: Classifying command...\n")
+  cmd_class, collected_response_stage1 = query_llm_choice(system_message_stage1, x_prompt, "stage1", "class",
+                                                          SUPPORTED_COMMAND_CLASSES, parse_stage1_response, stage1_stop_fn)
+  if not collected_response_stage1:
+    print_error("Stage 1: Failed to get command class from LLM. Please try again.\n")
+    return
+
+  # Sanity check: Validate the command class is one of the 12 supported classes
+  if cmd_class is None:
+    print_error(f"Stage 1: LLM provided an invalid command class: '{collected_response_stage1}'. Expected one of: {', '.join(SUPPORTED_COMMAND_CLASSES)}.\n")
+    return
+
+  return cmd_class
+
+def build_stage3_prompt(cmd_class, x_prompt):
+  """Stage 2: builds the stage 3 system message from the class help, pruned for the query. Returns it, or None."""
+  # STAGE 2: Look up the (pre-filtered) help for the command class
+  print_verbose(f"Stage 2: Getting help for command class '{cmd_class}'...\n")
+  start = time.perf_counter()
+  gdb_cmd_class_help_filtered = get_class_help(cmd_class)
+  if gdb_cmd_class_help_filtered is None: # Error reported while harvesting
+    record_stage("stage2", time.perf_counter() - start)
+    return
+  full_tokens = estimate_tokens(gdb_cmd_class_help_filtered)
+  gdb_cmd_class_help_filtered = prune_class_help(cmd_class, gdb_cmd_class_help_filtered, x_prompt)
+  pruned_tokens = estimate_tokens(gdb_cmd_class_help_filtered)
+  record_stage("stage2", time.perf_counter() - start, help_tokens=full_tokens, pruned_help_tokens=pruned_tokens)
+  if pruned_tokens < full_tokens:
+    print_verbose(f"Stage 2: Pruned the '{cmd_class}' listing from ~{full_tokens} to ~{pruned_tokens} tokens.\n")
+
+  if not gdb_cmd_class_help_filtered:
+      print_error(f"Stage 2.1: No commands found for class '{cmd_class}' after filtering. Or all commands started with 'set '.\n")
+      return
+
+  # STAGE 3: Select the most relevant command
+  system_message_stage3 = g_system_prompts.get("stage3")
+  if not system_message_stage3:
+    print_error("Error: Stage 3 system prompt not loaded. Aborting.\n")
+    return
+  
+  prompt_stage3 = system_message_stage3 + "\n" + gdb_cmd_class_help_filtered
+  prompt_stage3 = prompt_stage3 + "\nUser Query: "
+  return prompt_stage3
+
+def select_command(x_prompt, cmd_class):
+  """Stages 2 and 3: asks the LLM to pick one command of a class. Returns the command, or None."""
+  prompt_stage3 = build_stage3_prompt(cmd_class, x_prompt)
+  if prompt_stage3 is None:
+    trace_failure("stage2")
+    return None
+  print_verbose("Stage 3: Selecting specific command...\n")
+  selected_command, selected_command_raw = query_llm_choice(prompt_stage3, x_prompt, "stage3", "command", class_command_names(cmd_class),
+                                                            parse_stage3_answer, make_stage3_stop_fn(cmd_class), is_hidden_set_command)
+  if selected_command is None:
+    if parse_stage3_response(selected_command_raw) is not None: # Otherwise it reported what went wrong
+      print_error(f"Stage 3: '{selected_command_raw}' is not a command of class '{cmd_class}'.\n")
+    trace_failure("stage3")
+  return selected_command
+
+def class_command_names(cmd_class):
+  """Every name and alias listed under a class, in GDB's order: the valid stage 3 answers."""
+  names = []
+  for command in get_class_commands(cmd_class):
+    names.append(command["name"])
+    names.extend(command["aliases"])
+  return names
+
+def is_hidden_set_command(command):
+  """Stage 2 drops the 'set ...' lines from class listings, but they are still real commands."""
+  return command.startswith("set ")
+
+def parse_stage3_answer(selected_command_raw):
+  """Quiet form of parse_stage3_response, for validation."""
+  lines = [line for line in selected_command_raw.split("\n") if line.strip()]
+  return clean_answer_line(lines[-1]) if lines else None
+
+def parse_stage3_response(selected_command_raw):
+  """Extracts the selected command from a stage 3 response. Returns it, or None."""
+  if not selected_command_raw:
+    print_error("Stage 3: LLM failed to select a command. Please try again.\n")
+    return
+
+  # Handle potential <think> blocks or other multi-line preamble from the LLM.
+  # The actual selected command is expected to be the last non-empty line.
+  selected_command_lines = [line for line in selected_command_raw.split("\n") if line.strip()]
+  if not selected_command_lines:
+      print_error("Stage 3: LLM returned an empty response after filtering. Please try again.\n")
+      return
+  selected_command = selected_command_lines[-1].strip()
+
+  if selected_command == NO_VALID_COMMAND_MARKER: # Assuming LLM might return this for clarity
+      print_error("Stage 3: LLM indicated no specific command found for your query.\n")
+      return
+  if not selected_command: # Added check in case the last line was empty after strip or if NO_VALID_COMMAND_MARKER was the only content
+    print_error("Stage 3: LLM failed to select a command after processing the response. Please try again.\n")
+    return
+
+  return selected_command
+
+def speculative_stage3(prompt_stage3, x_prompt, cancel_event, stop_fn, trace, job):
+  """
+  Worker for one speculative stage 3 branch. Runs under the query's trace, so its stream gets
+  the query's deadline (see stage_time_limit()), and under its async job, if any, so agent-cancel
+  closes its stream. Returns (raw response, seconds taken).
+  """
+  g_trace_local.trace = trace
+  g_worker_local.job = job
+  try:
+    start = time.perf_counter()
+    raw = query_llm(prompt_stage3, x_prompt, x_echo=False, x_cancel_event=cancel_event, x_stage="stage3", x_stop_fn=stop_fn)
+    return raw, time.perf_counter() - start
+  finally:
+    g_trace_local.trace = None
+    g_worker_local.job = None
+
+def retrieval_command(x_prompt, cmd_class):
+  """The command of cmd_class that ranks best against the query in the help index, or None."""
+  ranked = rank_commands(x_prompt, top_k=1, cmd_class=cmd_class)
+  return ranked[0][2] if ranked else None
+
+def speculative_classify_and_select(x_prompt):
+  """
+  Stages 1-3 with speculation: while stage 1 streams on this thread, stage 3 already runs in
+  the background for the classes local retrieval considers most likely. If stage 1 confirms one
+  of them, its result is used and the other branches are cancelled. Returns the command, or None.
+  """
+  global g_speculative_executor
+  candidate_classes = []
+  for score, cmd_class, command in rank_commands(x_prompt, top_k=4 * g_speculative_top_k):
+    if cmd_class not in candidate_classes:
+      candidate_classes.append(cmd_class)
+  candidate_classes = candidate_classes[:g_speculative_top_k]
+
+  # Prompts are built here because help lookups may need GDB, which only this thread may call.
+  trace = current_trace()
+  job = current_async_job()
+  branches = {}
+  if g_speculative_executor is None:
+    g_speculative_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, g_speculative_top_k), thread_name_prefix="agentgdb-speculative")
+  for cmd_class in candidate_classes:
+    prompt_stage3 = build_stage3_prompt(cmd_class, x_prompt)
+    if prompt_stage3 is None:
+      continue
+    cancel_event = threading.Event()
+    if job is not None:
+      job.link_cancel_event(cancel_event)
+    future = g_speculative_executor.submit(speculative_stage3, prompt_stage3, x_prompt, cancel_event, make_stage3_stop_fn(cmd_class), trace, job)
+    branches[cmd_class] = (future, cancel_event)
+  print_verbose(f"[AgentGDB] Speculating on stage 3 for classes: {', '.join(branches) or 'none'}.\n")
+
+  start = time.perf_counter()
+  try:
+    cmd_class = classify_query(x_prompt)
+  except QueryCancelled:
+    for future, cancel_event in branches.values():
+      cancel_event.set()
+    raise
+  stage1_seconds = time.perf_counter() - start
+  if cmd_class is None and stage_timed_out("stage1"):
+    cmd_class = retrieval_class(x_prompt)
+    if cmd_class is not None:
+      note_degraded(f"Classification timed out: using class '{cmd_class}' from the help index.")
+
+  winner = branches.get(cmd_class)
+  for other_class, (future, cancel_event) in branches.items():
+    if other_class != cmd_class:
+      cancel_event.set()
+  if cmd_class is None:
+    trace_failure("stage1")
+    return None
+  if winner is None:
+    g_speculation_stats["misses"] += 1
+    print_verbose(f"[AgentGDB] Speculation missed: stage 1 chose '{cmd_class}'.\n")
+    return select_command(x_prompt, cmd_class)
+
+  if job is not None:
+    job.set_stage("stage3")
+  remaining = remaining_budget()
+  timed_out = False
+  try:
+    selected_command_raw, stage3_seconds = winner[0].result(timeout=max(0.0, remaining) if remaining is not None else None)
+  except QueryCancelled: # Raised by the branch once agent-cancel closed its stream
+    winner[1].set()
+    raise
+  except concurrent.futures.TimeoutError:
+    winner[1].set()
+    selected_command_raw, stage3_seconds, timed_out = "", 0.0, True
+  if not selected_command_raw and (timed_out or stage_timed_out("stage3")):
+    # Out of time, like select_command() would be: let the help index stand in for stage 3
+    selected_command = retrieval_command(x_prompt, cmd_class)
+    if selected_command is None:
+      trace_failure("stage3")
+      return None
+    note_degraded(f"Command selection timed out: using '{selected_command}' from the help index.")
+    return selected_command
+  # Without speculation stage 3 would only have started after stage 1 finished.
+  saved_seconds = max(0.0, stage1_seconds + stage3_seconds - (time.perf_counter() - start))
+  g_speculation_stats["hits"] += 1
+  g_speculation_stats["saved_seconds"] += saved_seconds
+  print_verbose(f"[AgentGDB] Speculation hit for '{cmd_class}': saved {saved_seconds:.2f}s (stage 3 response: {selected_command_raw}).\n")
+  selected_command = parse_stage3_answer(selected_command_raw) if selected_command_raw else None
+  if selected_command is None or (selected_command not in class_command_names(cmd_class) and not is_hidden_set_command(selected_command)):
+    print_verbose(f"[AgentGDB] Speculative stage 3 answer '{selected_command_raw}' is not valid, asking again.\n")
+    return select_command(x_prompt, cmd_class)
+  return selected_command
+
+def generate_final_command(x_prompt, selected_command):
+  """Stages 4 and 5: asks the LLM for the exact command line(s). Returns the block, or None."""
+  # STAGE 4: Get the detailed help for the selected command
+  print_verbose(f"Stage 4: Getting detailed help for command '{selected_command}'...\n")
+  start = time.perf_counter()
+  gdb_detailed_help = get_command_help(selected_command)
+  if gdb_detailed_help is None:
+    record_stage("stage4", time.perf_counter() - start)
+    trace_failure("stage4")
+    return
+  full_tokens = estimate_tokens(gdb_detailed_help)
+  gdb_detailed_help = prune_command_help(gdb_detailed_help, x_prompt)
+  pruned_tokens = estimate_tokens(gdb_detailed_help)
+  record_stage("stage4", time.perf_counter() - start, help_tokens=full_tokens, pruned_help_tokens=pruned_tokens)
+  if pruned_tokens < full_tokens:
+    print_verbose(f"Stage 4: Cut the help of '{selected_command}' from ~{full_tokens} to ~{pruned_tokens} tokens.\n")
+
+  # STAGE 5: Generate the final command
+  system_message_stage5 = g_system_prompts.get("stage5")
+  if not system_message_stage5:
+    print_error("Error: Stage 5 system prompt not loaded. Aborting.\n")
+    return
+
+  prompt_stage5 = system_message_stage5 + "\n" + gdb_detailed_help
+  prompt_stage5 = prompt_stage5 + "\nUser Query: "
+  print_verbose("Stage 5: Generating final GDB command...\n")
+  final_gdb_cmd_raw = query_llm(prompt_stage5, with_program_state(x_prompt), x_stage="stage5")
+
+  final_gdb_cmd = extract_command_block(final_gdb_cmd_raw, "Stage 5")
+  if final_gdb_cmd is None:
+    trace_failure("stage5")
+  return final_gdb_cmd
+
+def extract_command_block(final_gdb_cmd_raw, stage_label):
+  """Extracts the command block from a generation response. Returns it, or None after reporting why not."""
+  if not final_gdb_cmd_raw.strip():
+    print_error(f"{stage_label}: LLM returned an empty or whitespace-only response. Please try again.\n")
+    return
+
+  # Assume the actual command block is the last "paragraph" (separated by blank lines).
+  # This handles potential <think> blocks if they are followed by a blank line before the command(s).
+  paragraphs = re.split(r'\n\s*\n', final_gdb_cmd_raw.strip())
+  final_gdb_cmd = paragraphs[-1].strip() # Get the last paragraph and strip it.
+
+  if not final_gdb_cmd:
+    print_error(f"{stage_label}: LLM failed to generate the final command (extracted block is empty). Please try again.\n")
+    return
+  
+  if final_gdb_cmd == NO_VALID_COMMAND_MARKER:
+    print_error(f"{stage_label}: LLM indicated no valid command could be generated based on the help provided. Please try again or rephrase your query.\n")
+    return
+
+  return final_gdb_cmd
+
+def help_excerpt(help_text, max_chars):
+  """Cuts help text to max_chars at a line boundary."""
+  if len(help_text) <= max_chars:
+    return help_text.strip()
+  cut = help_text.rfind("\n", 0, max_chars)
+  return help_text[:cut if cut > 0 else max_chars].strip() + "\n[...]"
+
+def generate_fast_command(x_prompt):
+  """
+  Fast mode: one LLM call over the help of the locally top-ranked candidate commands.
+  Returns the final GDB command block, or None on failure.
+  """
+  system_message_fast = g_system_prompts.get("fast")
+  if not system_message_fast:
+    print_error("Error: Fast mode system prompt not loaded. Aborting.\n")
+    return
+
+  ranked = rank_commands(x_prompt, top_k=g_fast_candidates)
+  if not ranked:
+    print_verbose("[AgentGDB] Fast mode: no candidate commands matched, using the accurate pipeline.\n")
+    return generate_gdb_command(x_prompt)
+
+  sections = []
+  for score, cmd_class, command in ranked:
+    command_help = get_command_help(command)
+    if command_help is None:
+      continue
+    sections.append(f"### {command}\n{help_excerpt(command_help, g_fast_help_chars)}")
+  if not sections:
+    print_error("Fast mode: could not get help for any candidate command.\n")
+    trace_failure("fast")
+    return
+
+  print_verbose(f"[AgentGDB] Fast mode: generating from candidates {', '.join(c for _, _, c in ranked)}...\n")
+  prompt_fast = system_message_fast + "\n" + "\n\n".join(sections) + "\nUser Query: "
+  final_gdb_cmd_raw = query_llm(prompt_fast, with_program_state(x_prompt), x_stage="fast")
+  if not final_gdb_cmd_raw and stage_timed_out("fast") and degraded_suggestions_allowed():
+    note_degraded(f"Out of time: suggesting '{ranked[0][2]}' without arguments.")
+    return ranked[0][2]
+  final_gdb_cmd = extract_command_block(final_gdb_cmd_raw, "Fast mode")
+  if final_gdb_cmd is None:
+    trace_failure("fast")
+  return final_gdb_cmd
+
+def generate_gdb_command_in_mode(x_prompt, x_mode=None):
+  """Generates the final GDB command with the given pipeline mode (default: the configured one)."""
+  if (x_mode or g_pipeline_mode) == PIPELINE_MODE_FAST:
+    return generate_fast_command(x_prompt)
+  return generate_gdb_command(x_prompt)
+
+def generate_gdb_command(x_prompt):
+  """Runs the five-stage pipeline and returns the final GDB command block, or None on failure."""
+  selected_command = None
+  if g_retrieval_enabled:
+    start = time.perf_counter()
+    selected_command = retrieval_select_command(x_prompt)
+    record_stage("retrieval", time.perf_counter() - start, hit=selected_command is not None)
+
+  if selected_command is None and budget_too_short(["stage1", "stage3", "stage5"]):
+    # Not enough time for all three LLM stages: let the help index stand in for stage 1
+    cmd_class = retrieval_class(x_prompt)
+    if cmd_class is not None:
+      note_degraded(f"Short on time: skipping classification, using class '{cmd_class}' from the help index.")
+      selected_command = select_command(x_prompt, cmd_class)
+      if selected_command is None:
+        return None
+
+  if selected_command is None and g_speculative_enabled:
+    selected_command = speculative_classify_and_select(x_prompt)
+    if selected_command is None:
+      return None
+  elif selected_command is None:
+    cmd_class = classify_query(x_prompt)
+    if cmd_class is None and stage_timed_out("stage1"):
+      cmd_class = retrieval_class(x_prompt)
+      if cmd_class is not None:
+        note_degraded(f"Classification timed out: using class '{cmd_class}' from the help index.")
+    if cmd_class is None:
+      trace_failure("stage1")
+      return None
+    selected_command = select_command(x_prompt, cmd_class)
+    if selected_command is None:
+      return None
+
+  if budget_too_short(["stage5"]) and degraded_suggestions_allowed():
+    note_degraded(f"Short on time: suggesting '{selected_command}' without arguments.")
+    return selected_command
+  final_gdb_cmd = generate_final_command(x_prompt, selected_command)
+  if final_gdb_cmd is None and stage_timed_out("stage5") and degraded_suggestions_allowed():
+    note_degraded(f"Out of time: suggesting '{selected_command}' without arguments.")
+    return selected_command
+  return final_gdb_cmd
+
+def budget_too_short(stages):
+  """Whether the time left is below what the given stages typically take."""
+  remaining = remaining_budget()
+  if remaining is None:
+    return False
+  expected = expected_seconds(stages)
+  return expected is not None and remaining < expected
+
+def degraded_suggestions_allowed():
+  """A bare command is only offered when the user confirms it, i.e. in ask mode."""
+  trace = current_trace()
+  return trace is not None and trace.get("ask", False)
+
+def retrieval_class(x_prompt):
+  """The class of the command that ranks best against the query in the help index, or None."""
+  ranked = rank_commands(x_prompt, top_k=1)
+  return ranked[0][1] if ranked else None
+
+def first_command_name(command_block):
+  """Returns the first word of the first command line, e.g. 'break' for 'break main.c:5'."""
+  words = command_block.strip().split()
+  return words[0] if words else ""
+
+def compare_pipeline_modes(queries):
+  """
+  Runs every (query, expected command) pair through each pipeline mode without executing anything.
+  Returns {mode: {"latencies": [...], "exact": n, "command": n, "failed": n}}.
+  """
+  results = {}
+  for mode in PIPELINE_MODES:
+    result = {"latencies": [], "exact": 0, "command": 0, "failed": 0}
+    for x_prompt, expected in queries:
+      start = time.perf_counter()
+      generated = generate_gdb_command_in_mode(x_prompt, mode)
+      result["latencies"].append(time.perf_counter() - start)
+      if generated is None:
+        result["failed"] += 1
+        continue
+      if " ".join(generated.split()) == " ".join(expected.split()):
+        result["exact"] += 1
+      if first_command_name(generated) == first_command_name(expected):
+        result["command"] += 1
+    results[mode] = result
+  return results
+
+def read_query_corpus(path):
+  """
+  Reads (query, expected command) pairs. A .json file holds a list of objects with "query" and
+  "final" keys, like benchmarks/data/queries.json; any other file holds 'query<TAB>expected command'
+  lines, where blank lines and '#' comments are skipped.
+  """
+  queries = []
+  with open(os.path.expanduser(path), "r") as f:
+    if path.endswith(".json"):
+      try:
+        entries = json.load(f)
+      except ValueError as e:
+        raise IOError(f"not a JSON query list: {e}")
+      for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict) or "query" not in entry or "final" not in entry:
+          print_error(f"Skipping entry without 'query' and 'final': {entry}")
+          continue
+        queries.append((entry["query"].strip(), entry["final"].strip()))
+      return queries
+    for line in f:
+      line = line.rstrip("\n")
+      if not line.strip() or line.lstrip().startswith("#"):
+        continue
+      x_prompt, sep, expected = line.partition("\t")
+      if not sep:
+        print_error(f"Skipping line without a tab-separated expected command: '{line}'")
+        continue
+      queries.append((x_prompt.strip(), expected.strip()))
+  return queries
+
+def read_batch_queries(path):
+  """Reads one query per line; blank lines and '#' comments are skipped."""
+  with open(os.path.expanduser(path), "r") as f:
+    return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+def run_quietly(fn, *args):
+  """Runs fn on a worker thread without streaming LLM tokens to the terminal."""
+  g_worker_local.echo = False
+  try:
+    return fn(*args)
+  finally:
+    g_worker_local.echo = True
+
+def batch_select_command(x_prompt):
+  """Batch phase 1 (worker thread): picks the command for one query, as in stages 1-3."""
+  if g_retrieval_enabled:
+    selected_command = retrieval_select_command(x_prompt)
+    if selected_command is not None:
+      return selected_command
+  cmd_class = classify_query(x_prompt)
+  if cmd_class is None:
+    return None
+  return select_command(x_prompt, cmd_class)
+
+def run_batch(queries, x_mode=None, max_workers=None):
+  """
+  Generates GDB commands for many queries concurrently. Must be called on the GDB thread.
+  LLM stages run on a bounded worker pool; every GDB help lookup happens here, between the
+  phases, and is shared by all queries. Returns (commands, summary), where commands[i] is
+  the command block for queries[i] or None, and summary holds counts and timings.
+  """
+  mode = x_mode or g_pipeline_mode
+  start = time.perf_counter()
+  load_help_index() # Harvest class help up front so workers only read the index
+  commands = [None] * len(queries)
+  cache_keys = [query_cache_key(x_prompt) for x_prompt in queries]
+  pending = []
+  for i, key in enumerate(cache_keys):
+    commands[i] = query_cache_get(key)
+    if commands[i] is None:
+      commands[i] = match_template(queries[i])
+    if commands[i] is None:
+      pending.append(i)
+  num_cached = len(queries) - len(pending)
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or g_batch_max_workers, thread_name_prefix="agentgdb-batch") as executor:
+    if mode == PIPELINE_MODE_FAST:
+      candidates = {i: [c for _, _, c in rank_commands(queries[i], top_k=g_fast_candidates)] for i in pending}
+      for command in sorted({c for names in candidates.values() for c in names}):
+        get_command_help(command)
+      futures = {i: executor.submit(run_quietly, generate_fast_command, queries[i]) for i in pending if candidates[i]}
+    else:
+      selection = {i: executor.submit(run_quietly, batch_select_command, queries[i]) for i in pending}
+      selected = {i: future.result() for i, future in selection.items()}
+      for command in sorted({c for c in selected.values() if c is not None}):
+        get_command_help(command)
+      futures = {i: executor.submit(run_quietly, generate_final_command, queries[i], selected[i]) for i in pending if selected[i] is not None}
+    for i, future in futures.items():
+      commands[i] = future.result()
+
+  seconds = time.perf_counter() - start
+  record_stage("batch", seconds)
+  summary = {
+    "queries": len(queries),
+    "cached": num_cached,
+    "failed": sum(1 for command in commands if command is None),
+    "seconds": seconds,
+    "cache_keys": cache_keys,
+  }
+  return commands, summary
+
+def format_batch_script(queries, commands):
+  """Renders batch results as a GDB script with each query as a comment above its commands."""
+  lines = []
+  for x_prompt, command in zip(queries, commands):
+    lines.append(f"# {x_prompt}")
+    lines.append(command if command is not None else f"# FAILED: no command generated")
+  return "\n".join(lines) + "\n"
+
+def execute_batch(queries, commands, cache_keys):
+  """Executes batch results in their original order on the GDB thread. Returns the number that failed."""
+  failed = 0
+  for x_prompt, command, key in zip(queries, commands, cache_keys):
+    if command is None:
+      continue
+    if not execute_gdb_command(command):
+      failed += 1
+    else:
+      query_cache_put(key, x_prompt, command)
+  return failed
+
+def gdb_llm_prompt(x_prompt, x_ask=False, x_mode=None):
+  if not ensure_openai_client_ready():
+    return # Client or prompts failed to initialize
+
+  trace = trace_begin(x_prompt, x_mode or g_pipeline_mode)
+  begin_query_budget(trace, x_ask)
+  begin_program_state(trace)
+  try:
+    run_llm_prompt(x_prompt, x_ask, x_mode, trace)
+  finally:
+    trace_end()
+
+def resolve_llm_prompt(x_prompt, x_mode, trace):
+  """Looks the query up in the cache or runs the pipeline. Returns (cache key, command or None)."""
+  cache_key = query_cache_key(x_prompt)
+  final_gdb_cmd = query_cache_get(cache_key)
+  if final_gdb_cmd is not None:
+    trace["cache_hit"] = True
+    print_verbose(f"[AgentGDB] Query cache hit: {final_gdb_cmd}\n")
+  else:
+    final_gdb_cmd = match_template(x_prompt)
+    if final_gdb_cmd is not None:
+      trace["template_hit"] = True
+      print_verbose(f"[AgentGDB] Answered from a learned template: {final_gdb_cmd}\n")
+    else:
+      final_gdb_cmd = generate_gdb_command_in_mode(x_prompt, x_mode)
+    if final_gdb_cmd is None:
+      trace_failure("generate")
+      return cache_key, None
+  # Cached commands are checked too: the program loaded now may not have the names they use
+  final_gdb_cmd = validate_command(x_prompt, final_gdb_cmd)
+  if trace.get("degraded"):
+    cache_key = None # A fallback answer should not stand in for the full pipeline's next time
+  if uses_program_state(x_prompt, final_gdb_cmd):
+    trace["state_dependent"] = True
+    cache_key = None
+  trace["command"] = final_gdb_cmd
+  return cache_key, final_gdb_cmd
+
+def run_llm_prompt(x_prompt, x_ask, x_mode, trace):
+  cache_key, final_gdb_cmd = resolve_llm_prompt(x_prompt, x_mode, trace)
+  if final_gdb_cmd is None:
+    return
+
+  if x_ask:
+    print("[AgentGDB] Suggested command: " + final_gdb_cmd)
+    # Optionally, ask for confirmation here before executing
+    confirmation = input("[AgentGDB] Execute this command? (y/N): ")
+    if confirmation.lower() != 'y':
+      trace["status"] = "declined"
+      return
+  results = run_command_block(final_gdb_cmd, capture=g_iterative_enabled)
+
+  # Only remember commands that GDB accepted
+  if block_succeeded(results):
+    if x_ask and not trace.get("state_dependent"):
+      learn_template(x_prompt, final_gdb_cmd) # Confirmed and accepted by GDB
+    query_cache_put(cache_key, x_prompt, final_gdb_cmd)
+  if g_iterative_enabled and results:
+    run_iterations(x_prompt, results, x_ask)
+
+class QueryCancelled(Exception):
+  """Raised on an async query's worker thread once agent-cancel has stopped it."""
+
+class AsyncJob(object):
+  """A query whose LLM stages run on a worker thread while GDB stays responsive."""
+  def __init__(self, x_prompt, x_ask, x_mode):
+    self.prompt = x_prompt
+    self.ask = x_ask
+    self.mode = x_mode
+    self.cancel_event = threading.Event()
+    self.stage = "starting"
+    self.tokens = 0 # Streamed chunks so far, over all stages
+    self.start = time.perf_counter()
+    self.trace = None
+    self.state = {} # Program-state digest fields for the trace, see begin_program_state()
+    self.streams = set() # Open LLM streams: the current stage's and those of speculative stage 3 branches
+    self.branch_events = [] # Cancel events of speculative stage 3 branches
+    self.lock = threading.Lock()
+
+  def set_stage(self, stage):
+    self.stage = stage
+
+  def attach_stream(self, stream):
+    with self.lock:
+      self.streams.add(stream)
+      cancelled = self.cancel_event.is_set()
+    if cancelled:
+      close_llm_stream(stream)
+
+  def detach_stream(self, stream):
+    with self.lock:
+      self.streams.discard(stream)
+
+  def link_cancel_event(self, event):
+    """Makes cancelling the job also cancel a speculative branch."""
+    with self.lock:
+      self.branch_events.append(event)
+      cancelled = self.cancel_event.is_set()
+    if cancelled:
+      event.set()
+
+  def cancel(self):
+    """Stops the query; closing the open streams makes the server stop generating right away."""
+    with self.lock:
+      self.cancel_event.set()
+      events = list(self.branch_events)
+      streams = list(self.streams)
+    for event in events:
+      event.set() # Before closing, so branches take the closed stream for a cancellation
+    for stream in streams:
+      try:
+        close_llm_stream(stream)
+      except Exception as e:
+        print_verbose(f"[AgentGDB] Closing the LLM stream failed: {e}")
+
+  def elapsed(self):
+    return time.perf_counter() - self.start
+
+def start_async_query(x_prompt, x_ask=False, x_mode=None):
+  """
+  Starts a query on a worker thread and returns at once. The command comes back to the GDB
+  thread through gdb.post_event (finish_async_query), so GDB stays usable in the meantime.
+  """
+  global g_async_job
+  if g_async_job is not None:
+    print_error(f"A query is already running ('{g_async_job.prompt}'). See agent-status, or stop it with agent-cancel.")
+    return
+  if not ensure_openai_client_ready():
+    return
+  load_help_index() # Harvest class help here; the worker would have to ask GDB for every class
+  job = AsyncJob(x_prompt, x_ask, x_mode)
+  begin_program_state(job.state) # The worker cannot read frames itself
+  g_async_job = job
+  threading.Thread(target=async_query_worker, args=(job,), name="agentgdb-async", daemon=True).start()
+  print(f"[AgentGDB] Working on '{x_prompt}' in the background (agent-status, agent-cancel).")
+
+def async_query_worker(job):
+  g_worker_local.job = job
+  g_worker_local.echo = False # Tokens would interleave with whatever the user is doing in GDB
+  job.trace = trace_begin(job.prompt, job.mode or g_pipeline_mode)
+  begin_query_budget(job.trace, job.ask)
+  job.trace.update(job.state)
+  cache_key, final_gdb_cmd, error = None, None, None
+  try:
+    cache_key, final_gdb_cmd = resolve_llm_prompt(job.prompt, job.mode, job.trace)
+  except QueryCancelled:
+    pass
+  except Exception as e:
+    error = e
+  finally:
+    g_trace_local.trace = None # The trace is finished on the GDB thread
+    g_worker_local.job = None
+    g_worker_local.echo = True
+  gdb.post_event(lambda: finish_async_query(job, cache_key, final_gdb_cmd, error))
+
+def finish_async_query(job, cache_key, final_gdb_cmd, error):
+  """Runs on the GDB thread: executes (or, for ask, offers) the command of a finished async query."""
+  global g_async_job, g_async_suggestion
+  g_async_job = None
+  g_trace_local.trace = job.trace
+  try:
+    if job.cancel_event.is_set():
+      job.trace["status"] = "cancelled"
+      print(f"[AgentGDB] Cancelled '{job.prompt}' after {job.elapsed():.1f}s.")
+    elif error is not None:
+      trace_failure("generate")
+      print_error(f"Query '{job.prompt}' failed: {error}")
+    elif final_gdb_cmd is None:
+      print_error(f"No command generated for '{job.prompt}'.")
+    elif job.ask:
+      g_async_suggestion = (job.prompt, final_gdb_cmd, cache_key, not job.trace.get("state_dependent"))
+      job.trace["status"] = "suggested"
+      print(f"[AgentGDB] Suggested command for '{job.prompt}' ({job.elapsed():.1f}s):")
+      print(final_gdb_cmd)
+      print("[AgentGDB] Run it with agent-accept.")
+    else:
+      print(f"[AgentGDB] '{job.prompt}' ({job.elapsed():.1f}s):")
+      if execute_gdb_command(final_gdb_cmd):
+        query_cache_put(cache_key, job.prompt, final_gdb_cmd)
+  finally:
+    trace_end()
+
+def dispatch_llm_prompt(x_prompt, x_ask=False, x_mode=None):
+  """Runs a query in the background when [Pipeline] async is set, otherwise in the foreground."""
+  if g_async_enabled:
+    start_async_query(x_prompt, x_ask, x_mode)
+  else:
+    gdb_llm_prompt(x_prompt, x_ask, x_mode)
+
+class AgentGdbCommand(gdb.Command):
+  def __init__(self):
+    super(AgentGdbCommand, self).__init__("agent", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not x_arg:
+        print("[AgentGDB] Usage: agent <natural language query>")
+        return
+    dispatch_llm_prompt(x_arg)
+
+class AskGdbCommand(gdb.Command):
+  def __init__(self):
+    super(AskGdbCommand, self).__init__("ask", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not x_arg:
+        print("[AgentGDB] Usage: ask <natural language query>")
+        return
+    dispatch_llm_prompt(x_arg, True)
+
+class AgentFastGdbCommand(gdb.Command):
+  def __init__(self):
+    super(AgentFastGdbCommand, self).__init__("agent-fast", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not x_arg:
+        print("[AgentGDB] Usage: agent-fast <natural language query>")
+        return
+    dispatch_llm_prompt(x_arg, x_mode=PIPELINE_MODE_FAST)
+
+class AskFastGdbCommand(gdb.Command):
+  def __init__(self):
+    super(AskFastGdbCommand, self).__init__("ask-fast", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not x_arg:
+        print("[AgentGDB] Usage: ask-fast <natural language query>")
+        return
+    dispatch_llm_prompt(x_arg, True, x_mode=PIPELINE_MODE_FAST)
+
+class AgentCompareCommand(gdb.Command):
+  """Compare latency and accuracy of the accurate and fast pipeline modes over a query file.
+
+Usage: agent-compare <file>
+Each line of the file is a query and the expected GDB command, separated by a tab. A .json file
+is read as a list of {"query": ..., "final": ...} objects, like benchmarks/data/queries.json.
+Generated commands are not executed."""
+  def __init__(self):
+    super(AgentCompareCommand, self).__init__("agent-compare", gdb.COMMAND_USER, gdb.COMPLETE_FILENAME)
+  def invoke(self, x_arg, from_tty):
+    if not x_arg:
+      print("[AgentGDB] Usage: agent-compare <file>")
+      return
+    if not ensure_openai_client_ready():
+      return
+    try:
+      queries = read_query_corpus(x_arg.strip())
+    except IOError as e:
+      print_error(f"Error reading query file {x_arg.strip()}: {e}")
+      return
+    if not queries:
+      print_error(f"No queries found in {x_arg.strip()}.")
+      return
+
+    results = compare_pipeline_modes(queries)
+    print(f"[AgentGDB] Compared {len(queries)} queries:")
+    print(f"{'mode':<10} {'mean s':>8} {'p50 s':>8} {'max s':>8} {'exact':>7} {'command':>8} {'failed':>7}")
+    for mode, result in results.items():
+      latencies = sorted(result["latencies"])
+      print(f"{mode:<10} {sum(latencies) / len(latencies):>8.2f} {latencies[len(latencies) // 2]:>8.2f} {latencies[-1]:>8.2f} "
+            f"{100.0 * result['exact'] / len(queries):>6.1f}% {100.0 * result['command'] / len(queries):>7.1f}% {result['failed']:>7}")
+
+class AgentWarmupCommand(gdb.Command):
+  """Open the connection to the LLM server and prime its prompt cache with the static stage prompts.
+
+Usage: agent-warmup"""
+  def __init__(self):
+    super(AgentWarmupCommand, self).__init__("agent-warmup", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not ensure_openai_client_ready():
+      return
+    for stage, seconds in warmup_llm_server():
+      if seconds is not None:
+        print(f"[AgentGDB] Warm-up {stage:<8} {seconds * 1000.0:>9.1f} ms")
+
+class AgentStatsCommand(gdb.Command):
+  """Show latency, token and failure statistics for each pipeline stage, or reset them.
+
+Usage: agent-stats [reset]"""
+  def __init__(self):
+    super(AgentStatsCommand, self).__init__("agent-stats", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if x_arg.strip() == "reset":
+      reset_stats()
+      print("[AgentGDB] Statistics reset.")
+      return
+    if x_arg.strip():
+      print("[AgentGDB] Usage: agent-stats [reset]")
+      return
+
+    with g_stats_lock:
+      seconds = {metric: sorted(samples) for metric, samples in g_stats["seconds"].items()}
+      ttft = {stage: sorted(samples) for stage, samples in g_stats["ttft"].items()}
+      rates = {stage: list(samples) for stage, samples in g_stats["tokens_per_second"].items()}
+      prompt_tokens = dict(g_stats["prompt_tokens"])
+      completion_tokens = dict(g_stats["completion_tokens"])
+      queries, cache_hits, failures = g_stats["queries"], g_stats["cache_hits"], dict(g_stats["failures"])
+      template_hits = g_stats["template_hits"]
+      help_tokens, pruned_help_tokens = dict(g_stats["help_tokens"]), dict(g_stats["pruned_help_tokens"])
+
+    print(f"[AgentGDB] Queries: {queries}, cache hits: {cache_hits}, template hits: {template_hits}, failures: {sum(failures.values())}")
+    header = f"{'stage':<12} {'count':>6}" + "".join(f" {'p' + str(p) + ' ms':>10}" for p in STATS_PERCENTILES)
+    header += f" {'ttft p50':>9} {'tok/s':>7} {'prompt tok':>11} {'compl tok':>10}"
+    print(header)
+    for metric, values in seconds.items():
+      line = f"{metric:<12} {len(values):>6}"
+      line += "".join(f" {percentile(values, p) * 1000.0:>10.1f}" for p in STATS_PERCENTILES)
+      if metric in ttft:
+        line += f" {percentile(ttft[metric], 50) * 1000.0:>9.1f}"
+        line += f" {sum(rates[metric]) / len(rates[metric]):>7.1f}" if rates.get(metric) else f" {'-':>7}"
+        line += f" {prompt_tokens.get(metric, 0):>11} {completion_tokens.get(metric, 0):>10}"
+      print(line)
+    for stage, count in sorted(failures.items()):
+      print(f"[AgentGDB] Failed at {stage}: {count}")
+    for stage, full_tokens in sorted(help_tokens.items()):
+      if full_tokens:
+        sent = pruned_help_tokens.get(stage, 0)
+        print(f"[AgentGDB] Help looked up in {stage}: ~{full_tokens} tokens, ~{sent} sent to the LLM ({100.0 * (full_tokens - sent) / full_tokens:.0f}% pruned)")
+    with g_endpoint_health_lock:
+      endpoints = {url: dict(health) for url, health in g_endpoint_health.items()}
+    now = time.monotonic()
+    for url, health in endpoints.items():
+      state = f"skipped for {health['open_until'] - now:.0f}s more" if health["open_until"] > now else "in rotation"
+      ttft_text = f"{health['ttft'] * 1000.0:.0f} ms" if health["ttft"] is not None else "-"
+      print(f"[AgentGDB] Endpoint {url}: {health['requests']} requests, {health['errors']} errors, avg ttft {ttft_text}, {health['hedges_won']} hedges won, {state}")
+    if g_daemon_enabled:
+      report = daemon_report()
+      relayed = f"{g_daemon_stats['requests']} requests relayed, {g_daemon_stats['fallbacks']} sent directly"
+      if report is None:
+        print(f"[AgentGDB] Daemon {g_daemon_socket}: not running; {relayed}")
+      else:
+        print(f"[AgentGDB] Daemon {g_daemon_socket} (pid {report['pid']}): {relayed}; across all sessions "
+              f"{report.get('requests', 0)} requests, {report.get('llm_calls', 0)} LLM calls, "
+              f"{report.get('merged', 0)} merged in flight, {report.get('cache_hits', 0)} cache hits")
+    if g_speculation_stats["hits"] or g_speculation_stats["misses"]:
+      print(f"[AgentGDB] Speculation: {g_speculation_stats['hits']} hits, {g_speculation_stats['misses']} misses, {g_speculation_stats['saved_seconds']:.2f}s saved")
+    if g_stats_trace_file:
+      print(f"[AgentGDB] Per-query traces: {g_stats_trace_file}")
+
+class AgentStartupCommand(gdb.Command):
+  """Show how long each AgentGDB startup step took.
+
+Usage: agent-startup"""
+  def __init__(self):
+    super(AgentStartupCommand, self).__init__("agent-startup", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    print(f"[AgentGDB] Client setup mode: {g_client_setup_mode}")
+    if not g_startup_timings:
+      print("[AgentGDB] No startup steps recorded yet.")
+    for step, seconds in g_startup_timings.items():
+      print(f"[AgentGDB]   {step:<18} {seconds * 1000.0:>9.1f} ms")
+    if g_client_setup_mode != CLIENT_SETUP_EAGER and "openai_import" not in g_startup_timings:
+      print("[AgentGDB] The OpenAI client has not been set up yet.")
+
+class AgentBatchCommand(gdb.Command):
+  """Turn a file of natural language queries (one per line) into a GDB script.
+
+Usage: agent-batch [--fast] [--execute] [-o OUTPUT] FILE
+The LLM pipelines for all queries run concurrently ([Batch] max_workers in the config).
+Without -o the script is printed; with --execute its commands run in the original order."""
+  def __init__(self):
+    super(AgentBatchCommand, self).__init__("agent-batch", gdb.COMMAND_USER, gdb.COMPLETE_FILENAME)
+  def invoke(self, x_arg, from_tty):
+    usage = "[AgentGDB] Usage: agent-batch [--fast] [--execute] [-o OUTPUT] FILE"
+    argv = gdb.string_to_argv(x_arg)
+    output_path = None
+    execute = False
+    x_mode = None
+    input_path = None
+    while argv:
+      arg = argv.pop(0)
+      if arg == "--execute":
+        execute = True
+      elif arg == "--fast":
+        x_mode = PIPELINE_MODE_FAST
+      elif arg == "-o" and argv:
+        output_path = argv.pop(0)
+      elif input_path is None and not arg.startswith("-"):
+        input_path = arg
+      else:
+        print(usage)
+        return
+    if input_path is None:
+      print(usage)
+      return
+
+    if not ensure_openai_client_ready():
+      return
+    try:
+      queries = read_batch_queries(input_path)
+    except IOError as e:
+      print_error(f"Error reading batch file {input_path}: {e}")
+      return
+    if not queries:
+      print_error(f"No queries found in {input_path}.")
+      return
+
+    commands, summary = run_batch(queries, x_mode)
+    script = format_batch_script(queries, commands)
+    if output_path:
+      try:
+        with open(os.path.expanduser(output_path), "w") as f:
+          f.write(script)
+        print(f"[AgentGDB] Wrote GDB script to {output_path}")
+      except IOError as e:
+        print_error(f"Error writing {output_path}: {e}")
+    elif not execute:
+      sys.stdout.write(script)
+
+    rate = summary["queries"] / summary["seconds"] if summary["seconds"] > 0 else 0.0
+    print(f"[AgentGDB] Batch: {summary['queries']} queries ({summary['cached']} cached, {summary['failed']} failed) in {summary['seconds']:.2f}s, {rate:.2f} queries/s")
+    if execute:
+      failed = execute_batch(queries, commands, summary["cache_keys"])
+      if failed:
+        print_error(f"{failed} batch command(s) failed in GDB.")
+
+class AgentStatusCommand(gdb.Command):
+  """Show the progress of the query running in the background.
+
+Usage: agent-status"""
+  def __init__(self):
+    super(AgentStatusCommand, self).__init__("agent-status", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    job = g_async_job
+    if job is None:
+      print("[AgentGDB] No query is running.")
+    else:
+      print(f"[AgentGDB] '{job.prompt}': {job.stage}, {job.elapsed():.1f}s, {job.tokens} tokens received{' (cancelling)' if job.cancel_event.is_set() else ''}")
+    if g_async_suggestion is not None:
+      print(f"[AgentGDB] Waiting for agent-accept: {g_async_suggestion[1]}")
+
+class AgentStateCommand(gdb.Command):
+  """Show the program-state digest that is added to generation prompts.
+
+Usage: agent-state"""
+  def __init__(self):
+    super(AgentStateCommand, self).__init__("agent-state", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    if not g_state_enabled:
+      print("[AgentGDB] The program-state digest is disabled ([Context] enabled = false).")
+      return
+    digest, _ = program_state_digest()
+    if digest is None:
+      print("[AgentGDB] No stopped thread to describe.")
+      return
+    print(f"[AgentGDB] Program state (~{estimate_tokens(digest)} of {g_state_max_tokens} tokens):")
+    print(digest)
+
+class AgentCancelCommand(gdb.Command):
+  """Cancel the query running in the background and close its LLM stream.
+
+Usage: agent-cancel"""
+  def __init__(self):
+    super(AgentCancelCommand, self).__init__("agent-cancel", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    global g_async_suggestion
+    if g_async_job is None:
+      if g_async_suggestion is not None:
+        g_async_suggestion = None
+        print("[AgentGDB] Suggested command discarded.")
+      else:
+        print("[AgentGDB] No query is running.")
+      return
+    g_async_job.cancel()
+    print(f"[AgentGDB] Cancelling '{g_async_job.prompt}'...")
+
+class AgentAcceptCommand(gdb.Command):
+  """Execute the command suggested by the last background 'ask' query.
+
+Usage: agent-accept"""
+  def __init__(self):
+    super(AgentAcceptCommand, self).__init__("agent-accept", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    global g_async_suggestion
+    if g_async_suggestion is None:
+      print("[AgentGDB] No suggested command to run.")
+      return
+    x_prompt, final_gdb_cmd, cache_key, learnable = g_async_suggestion
+    g_async_suggestion = None
+    if execute_gdb_command(final_gdb_cmd):
+      query_cache_put(cache_key, x_prompt, final_gdb_cmd)
+      if learnable:
+        learn_template(x_prompt, final_gdb_cmd)
+
+class AgentCacheCommand(gdb.Command):
+  """Show cache statistics, or drop cached commands and help text.
+
+Usage: agent-cache [stats|clear [query|help]]"""
+  def __init__(self):
+    super(AgentCacheCommand, self).__init__("agent-cache", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    args = x_arg.split() or ["stats"]
+    if args[0] == "clear" and len(args) <= 2:
+      target = args[1] if len(args) == 2 else "all"
+      if target in ("query", "all"):
+        query_cache_clear()
+        print("[AgentGDB] Query cache cleared.")
+      if target in ("help", "all"):
+        help_index_clear()
+        print("[AgentGDB] Help index cleared.")
+    elif args == ["stats"]:
+      cache = load_query_cache()
+      lookups = g_query_cache_stats["hits"] + g_query_cache_stats["misses"]
+      hit_rate = 100.0 * g_query_cache_stats["hits"] / lookups if lookups else 0.0
+      print(f"[AgentGDB] Query cache: {'enabled' if g_query_cache_enabled else 'disabled'}, {len(cache)}/{g_query_cache_max_entries} entries ({query_cache_path()})")
+      print(f"[AgentGDB] Hits: {g_query_cache_stats['hits']}, misses: {g_query_cache_stats['misses']} ({hit_rate:.1f}% hit rate), evictions: {g_query_cache_stats['evictions']}")
+      if g_help_index is None:
+        print("[AgentGDB] Help index: not loaded")
+      else:
+        num_commands = sum(len(entry["commands"]) for entry in g_help_index["classes"].values())
+        print(f"[AgentGDB] Help index: {len(g_help_index['classes'])} classes, {num_commands} commands, {len(g_help_index['commands'])} detailed help entries ({help_index_path()})")
+    else:
+      print("[AgentGDB] Usage: agent-cache [stats|clear [query|help]]")
+
+class AgentTemplatesCommand(gdb.Command):
+  """List or delete the command templates learned from confirmed 'ask' suggestions.
+
+Usage: agent-templates [list|delete N|clear]"""
+  def __init__(self):
+    super(AgentTemplatesCommand, self).__init__("agent-templates", gdb.COMMAND_USER)
+  def invoke(self, x_arg, from_tty):
+    args = x_arg.split() or ["list"]
+    if args == ["list"]:
+      templates = sorted_templates()
+      if not templates:
+        print("[AgentGDB] No templates learned yet; confirm 'ask' suggestions to add some.")
+        return
+      print(f"[AgentGDB] {len(templates)}/{g_template_max_entries} templates ({template_store_path()}):")
+      for number, (key, entry) in enumerate(templates, 1):
+        print(f"  {number:>3}. [{entry['uses']} uses] {key} -> {entry['command']}")
+    elif args[0] == "delete" and len(args) == 2 and args[1].isdigit():
+      templates = sorted_templates()
+      number = int(args[1])
+      if not 1 <= number <= len(templates):
+        print(f"[AgentGDB] No template {number}; see agent-templates list.")
+        return
+      key, entry = templates[number - 1]
+      delete_template(key)
+      print(f"[AgentGDB] Deleted template '{key}' -> {entry['command']}")
+    elif args == ["clear"]:
+      template_store_clear()
+      print("[AgentGDB] Templates cleared.")
+    else:
+      print("[AgentGDB] Usage: agent-templates [list|delete N|clear]")
+
+if __name__ == "__main__": 
+  startup_start = time.perf_counter()
+  # Load configuration first to ensure VERBOSE flag is set correctly
+  start = time.perf_counter()
+  if not load_plugin_configuration():
+    print_error("Failed to load configuration during startup. Some features might not work.")
+    print_error("Please check your configuration file at ~/.agentgdb_config.ini")
+  record_startup_timing("configuration", start)
+  
+  # Now initialize the OpenAI client. Only eager mode makes GDB wait for it.
+  if g_client_setup_mode == CLIENT_SETUP_EAGER:
+    if not ensure_openai_client_ready():
+      print_error("Failed to initialize AI GDB agent during startup. Some features might not work.")
+      print_error("Please check your OpenAI client configuration (e.g., API key, base URL, model ID in ~/.agentgdb_config.ini) and system prompt files.")
+    else:
+      print("[AgentGDB] GDB AI Agent installed. Type 'agent' or 'ask' followed by your query to use.")
   else:
+    if g_client_setup_mode == CLIENT_SETUP_BACKGROUND:
+      start_background_client_setup()
     print("[AgentGDB] GDB AI Agent installed. Type 'agent' or 'ask' followed by your query to use.")
   AgentGdbCommand()
-  AskGdbCommand() 
+  AskGdbCommand()
+  AgentFastGdbCommand()
+  AskFastGdbCommand()
+  AgentCompareCommand()
+  AgentBatchCommand()
+  AgentStatusCommand()
+  AgentStateCommand()
+  AgentCancelCommand()
+  AgentAcceptCommand()
+  AgentCacheCommand()
+  AgentTemplatesCommand()
+  AgentStartupCommand()
+  AgentStatsCommand()
+  AgentWarmupCommand()
+  gdb.events.new_objfile.connect(on_new_objfile)
+  gdb.events.clear_objfiles.connect(on_clear_objfiles)
+  gdb.events.stop.connect(on_stop)
+  gdb.events.cont.connect(on_cont)
+  gdb.events.new_thread.connect(on_new_thread)
+  gdb.events.exited.connect(on_exited)
+  gdb.events.memory_changed.connect(on_state_changed)
+  gdb.events.register_changed.connect(on_state_changed)
+  atexit.register(flush_query_cache)
+  record_startup_timing("startup_total", startup_start)
+  print_verbose(f"[AgentGDB] Startup took {g_startup_timings['startup_total'] * 1000.0:.1f} ms (see 'agent-startup').")
@@ -0,0 +1,300 @@
+"""
+AgentGDB daemon: one long-lived process that makes the LLM requests of many GDB sessions.
+
+GDB sessions with 'enabled = true' under [Daemon] send their LLM requests here over a Unix
+domain socket instead of connecting to the inference server themselves. The daemon keeps one
+pooled OpenAI client per server, merges identical requests that are in flight at the same time
+into a single LLM call, and remembers recent deterministic (temperature 0) answers, so many
+concurrent 'gdb -batch' sessions share connections, prompt processing and answers. Sessions
+call the server themselves while the daemon is not running.
+
+Protocol: a session connects, sends one JSON line
+  {"op": "chat", "base_urls": [...], "api_key": "...", "request": {<chat.completions.create arguments>}}
+and reads JSON lines back: {"content": "..."} per streamed token, {"usage": {...}} if the server
+reported usage, then {"done": true} or {"error": "...", "status_code": N}. Closing the socket
+early stops reading; the LLM call is closed once no session reads it any more.
+{"op": "stats"} and {"op": "ping"} are answered with a single line.
+
+Usage: python -m agentgdb.daemon [--socket PATH] [--cache-entries N] [--max-connections N]
+"""
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+DEFAULT_SOCKET_PATH = os.path.expanduser("~/.cache/agentgdb/daemon.sock")
+DEFAULT_CACHE_ENTRIES = 1024
+DEFAULT_MAX_CONNECTIONS = 64
+
+
+def request_key(base_urls, api_key, request):
+  """Identifies requests whose answers are interchangeable, or returns None if sampling makes them differ."""
+  if request.get("temperature", 1.0) != 0:
+    return None
+  identity = {"base_urls": base_urls, "api_key": api_key,
+              "request": {name: value for name, value in request.items() if name != "timeout"}}
+  return hashlib.sha256(json.dumps(identity, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def is_server_failure(error):
+  """Connection errors, timeouts and server errors are worth trying on the next server; request errors are not."""
+  status = getattr(error, "status_code", None)
+  return status is None or status >= 500 or status in (408, 429)
+
+
+class Flight(object):
+  """One LLM call and the sessions reading it. Its messages are kept so late joiners can replay them."""
+
+  def __init__(self, key):
+    self.key = key
+    self.messages = []
+    self.done = False
+    self.readers = 0
+    self.abandoned = False # Every reader left before the answer was complete
+    self.stream = None
+    self.cond = threading.Condition()
+
+  def add(self, message, done=False):
+    with self.cond:
+      self.messages.append(message)
+      self.done = self.done or done
+      self.cond.notify_all()
+
+  def read(self, start):
+    """Waits for messages after index start. Returns (messages, done)."""
+    with self.cond:
+      while len(self.messages) <= start and not self.done:
+        self.cond.wait()
+      return self.messages[start:], self.done
+
+  def leave(self):
+    """Drops a reader; the LLM call is closed if it was the last one and the answer is still streaming."""
+    with self.cond:
+      self.readers -= 1
+      abandon = self.readers == 0 and not self.done
+      if abandon:
+        self.abandoned = True
+      stream = self.stream
+    if abandon and stream is not None:
+      try:
+        stream.close()
+      except Exception:
+        pass
+
+
+class AgentDaemon(object):
+  """The shared state: clients, flights in progress, the answer cache and counters."""
+
+  def __init__(self, cache_entries=DEFAULT_CACHE_ENTRIES, max_connections=DEFAULT_MAX_CONNECTIONS):
+    self.cache_entries = cache_entries
+    self.max_connections = max_connections
+    self.lock = threading.Lock()
+    self.clients = {}
+    self.flights = {}
+    self.cache = OrderedDict()
+    self.stats = Counter()
+    self.started = time.time()
+
+  def client(self, base_url, api_key):
+    """The pooled client for a server, created on first use."""
+    with self.lock:
+      client = self.clients.get((base_url, api_key))
+      if client is None:
+        from openai import OpenAI as OpenAIClient
+        http_client = None
+        try:
+          import httpx
+          from openai import DefaultHttpxClient
+          http_client = DefaultHttpxClient(limits=httpx.Limits(max_connections=self.max_connections,
+                                                               max_keepalive_connections=self.max_connections))
+        except ImportError:
+          pass
+        # Sessions retry within their own deadlines; retrying here too would outlast them
+        client = OpenAIClient(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+        self.clients[(base_url, api_key)] = client
+      return client
+
+  def join(self, base_urls, api_key, request):
+    """Returns the flight answering a request, starting an LLM call unless one can be shared."""
+    key = request_key(base_urls, api_key, request)
+    with self.lock:
+      self.stats["requests"] += 1
+      if key is not None:
+        cached = self.cache.get(key)
+        if cached is not None:
+          self.cache.move_to_end(key)
+          self.stats["cache_hits"] += 1
+          flight = Flight(key)
+          flight.messages = cached
+          flight.done = True
+          flight.readers = 1
+          return flight
+        flight = self.flights.get(key)
+        if flight is not None:
+          with flight.cond:
+            if not flight.abandoned:
+              flight.readers += 1
+              self.stats["merged"] += 1
+              return flight
+      flight = Flight(key)
+      flight.readers = 1
+      if key is not None:
+        self.flights[key] = flight
+      self.stats["llm_calls"] += 1
+    threading.Thread(target=self.run_flight, args=(flight, base_urls, api_key, request),
+                     name="agentgdb-daemon-llm", daemon=True).start()
+    return flight
+
+  def run_flight(self, flight, base_urls, api_key, request):
+    """Streams the LLM call into the flight, failing over to the next server before the first token."""
+    error = None
+    for base_url in base_urls:
+      streamed = False
+      try:
+        stream = self.client(base_url, api_key).chat.completions.create(**request)
+        with flight.cond:
+          flight.stream = stream
+          abandoned = flight.abandoned
+        if abandoned:
+          stream.close()
+          break
+        for chunk in stream:
+          if getattr(chunk, "usage", None):
+            flight.add({"usage": {"prompt_tokens": chunk.usage.prompt_tokens, "completion_tokens": chunk.usage.completion_tokens}})
+          if chunk.choices and getattr(chunk.choices[0].delta, "content", None):
+            streamed = True
+            flight.add({"content": chunk.choices[0].delta.content})
+        error = None
+        break
+      except Exception as e:
+        error = e
+        if streamed or flight.abandoned or not is_server_failure(e):
+          break
+    if error is not None:
+      flight.add({"error": str(error) or type(error).__name__, "status_code": getattr(error, "status_code", None)}, done=True)
+    else:
+      flight.add({"done": True}, done=True)
+    with self.lock:
+      if self.flights.get(flight.key) is flight:
+        del self.flights[flight.key]
+      if error is None and not flight.abandoned and flight.key is not None and self.cache_entries > 0:
+        self.cache[flight.key] = list(flight.messages)
+        while len(self.cache) > self.cache_entries:
+          self.cache.popitem(last=False)
+      if error is not None and not flight.abandoned:
+        self.stats["errors"] += 1
+
+  def report(self):
+    with self.lock:
+      return dict(self.stats, in_flight=len(self.flights), cached=len(self.cache), pid=os.getpid(),
+                  uptime=round(time.time() - self.started, 1))
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+  def handle(self):
+    daemon = self.server.agent
+    try:
+      message = json.loads(self.rfile.readline())
+    except ValueError:
+      return
+    op = message.get("op")
+    if op == "ping":
+      self.send({"ok": True, "pid": os.getpid()})
+    elif op == "stats":
+      self.send(daemon.report())
+    elif op == "chat":
+      self.relay(daemon.join(message.get("base_urls") or [], message.get("api_key"), message.get("request") or {}))
+    else:
+      self.send({"error": f"unknown op {op!r}", "status_code": 400})
+
+  def send(self, message):
+    self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+    self.wfile.flush()
+
+  def relay(self, flight):
+    sent = 0
+    try:
+      while True:
+        messages, done = flight.read(sent)
+        for message in messages:
+          self.send(message)
+        sent += len(messages)
+        if done:
+          return
+    except OSError:
+      pass # The session closed its end: it stopped early, was cancelled or timed out
+    finally:
+      flight.leave()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+  request_queue_size = 256 # Many sessions may connect at once; a full backlog refuses them
+
+
+def start_daemon(socket_path=DEFAULT_SOCKET_PATH, cache_entries=DEFAULT_CACHE_ENTRIES, max_connections=DEFAULT_MAX_CONNECTIONS):
+  """Starts serving on a background thread. Returns the server; stop it with stop_daemon()."""
+  directory = os.path.dirname(socket_path)
+  if directory:
+    os.makedirs(directory, exist_ok=True)
+  if os.path.exists(socket_path):
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      probe.connect(socket_path)
+      raise RuntimeError(f"an AgentGDB daemon is already listening on {socket_path}")
+    except (ConnectionRefusedError, FileNotFoundError):
+      os.unlink(socket_path) # Left behind by a daemon that did not exit cleanly
+    finally:
+      probe.close()
+  old_umask = os.umask(0o177) # Only this user may connect
+  try:
+    server = DaemonServer(socket_path, DaemonRequestHandler)
+  finally:
+    os.umask(old_umask)
+  server.agent = AgentDaemon(cache_entries, max_connections)
+  server.socket_path = socket_path
+  threading.Thread(target=server.serve_forever, name="agentgdb-daemon", daemon=True).start()
+  return server
+
+
+def stop_daemon(server):
+  server.shutdown()
+  server.server_close()
+  try:
+    os.unlink(server.socket_path)
+  except OSError:
+    pass
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Shared LLM daemon for AgentGDB sessions.")
+  parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket to listen on (the sessions' [Daemon] socket).")
+  parser.add_argument("--cache-entries", type=int, default=DEFAULT_CACHE_ENTRIES, help="Deterministic answers to keep in memory (0 disables).")
+  parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS, help="Connections to each LLM server.")
+  args = parser.parse_args()
+
+  try:
+    server = start_daemon(os.path.expanduser(args.socket), args.cache_entries, args.max_connections)
+  except RuntimeError as e:
+    print(f"[AgentGDB] {e}", file=sys.stderr)
+    sys.exit(1)
+  stopping = threading.Event()
+  signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+  print(f"[AgentGDB] Daemon listening on {server.socket_path} (pid {os.getpid()}).")
+  try:
+    while not stopping.wait(3600):
+      pass
+  except KeyboardInterrupt:
+    pass
+  stop_daemon(server)
+
+
+if __name__ == "__main__":
+  main()
@@ -5,6 +5,22 @@ import os
 CONFIG_FILE_PATH = os.path.expanduser("~/.agentgdb_config.ini")
 CREDENTIALS_SECTION = "Credentials"
 DEBUG_SECTION = "Debug"
+# Pipeline stage -> config section holding its model and generation settings
+STAGE_SECTIONS = {
+    "stage1": "Stage1",
+    "stage3": "Stage3",
+    "stage5": "Stage5",
+    "fast": "Fast",
+}
+# Per-stage option -> config key
+STAGE_OPTIONS = {
+    "stage_model": "model",
+    "stage_base_url": "base_url",
+    "stage_api_key": "api_key",
+    "stage_temperature": "temperature",
+    "stage_max_tokens": "max_tokens",
+    "stage_timeout": "timeout",
+}
 
 def main():
     parser = argparse.ArgumentParser(description="Configure AgentGDB settings.")
@@ -26,6 +42,47 @@ def main():
         type=str,
         help="The model identifier for the LLM."
     )
+    parser.add_argument(
+        "--stage",
+        choices=sorted(STAGE_SECTIONS),
+        help="Pipeline stage the --stage-* options apply to (stage1 and stage3 classify, stage5 and fast generate)."
+    )
+    parser.add_argument(
+        "--stage-model",
+        metavar="ID",
+        type=str,
+        help="Model identifier for the stage (empty string: use --model-id)."
+    )
+    parser.add_argument(
+        "--stage-base-url",
+        metavar="URL",
+        type=str,
+        help="Base URL for the stage's OpenAI-compatible server (empty string: use --base-url)."
+    )
+    parser.add_argument(
+        "--stage-api-key",
+        metavar="KEY",
+        type=str,
+        help="API key for the stage's server (empty string: use --api-key)."
+    )
+    parser.add_argument(
+        "--stage-temperature",
+        metavar="T",
+        type=float,
+        help="Sampling temperature for the stage (default 0.0)."
+    )
+    parser.add_argument(
+        "--stage-max-tokens",
+        metavar="N",
+        type=int,
+        help="Maximum tokens the stage may generate (0: no limit)."
+    )
+    parser.add_argument(
+        "--stage-timeout",
+        metavar="SECONDS",
+        type=float,
+        help="Request timeout for the stage (0: no timeout)."
+    )
     parser.add_argument(
         "--verbose",
         action="store_true",
@@ -39,6 +96,10 @@ def main():
 
     args = parser.parse_args()
 
+    stage_values = {key: getattr(args, option) for option, key in STAGE_OPTIONS.items() if getattr(args, option) is not None}
+    if stage_values and args.stage is None:
+        parser.error("--stage is required with the --stage-* options.")
+
     config = configparser.ConfigParser()
 
     # Read existing config file if it exists
@@ -121,6 +182,22 @@ def main():
     else:
         print("Verbose mode: Not set (defaults to disabled).")
 
+    if args.stage is not None:
+        section = STAGE_SECTIONS[args.stage]
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in stage_values.items():
+            if value == "":
+                config.remove_option(section, key)
+                print(f"{section} {key} removed (uses the default).")
+            else:
+                config.set(section, key, str(value))
+                print(f"{section} {key} set to: {value}")
+            updated_any = True
+        for key in STAGE_OPTIONS.values():
+            if key not in stage_values and config.has_option(section, key):
+                print(f"{section} {key} retained: {config.get(section, key)}")
+
     if not updated_any and not all(current_settings.values()):
         print("\nNo new settings provided and no existing complete configuration found.")
         print(f"Please provide at least one setting or ensure {CONFIG_FILE_PATH} is configured.")
@@ -0,0 +1,105 @@
+"""
+Benchmark for the shared AgentGDB daemon (agentgdb/daemon.py) with many concurrent sessions.
+
+Starts the mock LLM server and runs the query corpus in several session processes at once,
+like a CI host running many 'gdb -batch' jobs over the same script: first with every session
+calling the server itself, then with all of them going through one daemon, which merges
+identical in-flight requests and answers repeats from memory. Reports wall time, per-query
+latency and how many requests reached the LLM server.
+
+Usage: python benchmarks/bench_daemon.py [--sessions 8] [--limit 16] [--ttft-ms 50]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import run_benchmark # Also puts the stand-in 'gdb' module on sys.path
+import mock_llm_server
+
+sys.path.insert(0, os.path.dirname(run_benchmark._BENCH_DIR))
+from agentgdb import daemon
+
+
+def run_session(base_url, socket_path, limit):
+  """One session process: runs the corpus and prints its latencies as JSON."""
+  extra_config = f"\n[Daemon]\nenabled = true\nsocket = {socket_path}\n" if socket_path else ""
+  with open(mock_llm_server.DEFAULT_QUERIES_FILE, "r") as f:
+    queries = json.load(f)[:limit]
+  with tempfile.TemporaryDirectory() as home_dir:
+    plugin = run_benchmark.load_plugin(home_dir, base_url, extra_config)
+    results = run_benchmark.run_queries(plugin, queries)
+  print(json.dumps({"seconds": [r["seconds"] for r in results], "exact": sum(r["exact"] for r in results),
+                    "fallbacks": plugin.g_daemon_stats["fallbacks"]}))
+
+
+def run_scenario(server, sessions, limit, socket_path=None):
+  """Runs the sessions concurrently. Returns the scenario's report."""
+  first_request = server.stats.requests
+  command = [sys.executable, os.path.abspath(__file__), "--session", "--base-url", server.base_url, "--limit", str(limit)]
+  if socket_path:
+    command += ["--socket", socket_path]
+  start = time.perf_counter()
+  processes = [subprocess.Popen(command, stdout=subprocess.PIPE) for _ in range(sessions)]
+  outputs = [json.loads(process.communicate()[0].decode("utf-8").strip().splitlines()[-1]) for process in processes]
+  wall = time.perf_counter() - start
+  latencies = [seconds for output in outputs for seconds in output["seconds"]]
+  return {
+    "wall": wall,
+    "mean": sum(latencies) / len(latencies),
+    "p95": run_benchmark.percentile(latencies, 95),
+    "exact_accuracy": sum(output["exact"] for output in outputs) / len(latencies),
+    "llm_requests": server.stats.requests - first_request,
+    "fallbacks": sum(output["fallbacks"] for output in outputs),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark concurrent sessions with and without the AgentGDB daemon.")
+  parser.add_argument("--sessions", type=int, default=8, help="Concurrent session processes.")
+  parser.add_argument("--limit", type=int, default=16, help="Only use the first N queries.")
+  parser.add_argument("--ttft-ms", type=float, default=50.0)
+  parser.add_argument("--token-latency-ms", type=float, default=5.0)
+  parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+  parser.add_argument("--session", action="store_true", help=argparse.SUPPRESS)
+  parser.add_argument("--base-url", help=argparse.SUPPRESS)
+  parser.add_argument("--socket", help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.session:
+    run_session(args.base_url, args.socket, args.limit)
+    return
+
+  server = mock_llm_server.start_server(mock_llm_server.MockSettings(ttft_ms=args.ttft_ms, token_latency_ms=args.token_latency_ms))
+  with tempfile.TemporaryDirectory() as socket_dir:
+    socket_path = os.path.join(socket_dir, "daemon.sock")
+    agent_daemon = daemon.start_daemon(socket_path)
+    try:
+      report = {
+        "in-process": run_scenario(server, args.sessions, args.limit),
+        "daemon": run_scenario(server, args.sessions, args.limit, socket_path),
+      }
+      report["daemon"]["stats"] = agent_daemon.agent.report()
+    finally:
+      daemon.stop_daemon(agent_daemon)
+      server.shutdown()
+
+  if args.json:
+    print(json.dumps(report, indent=1))
+    return
+  print(f"{args.sessions} concurrent sessions x {args.limit} queries")
+  print(f"{'scenario':<12} {'wall s':>8} {'mean ms':>9} {'p95 ms':>9} {'exact':>7} {'LLM requests':>13}")
+  for scenario, result in report.items():
+    print(f"{scenario:<12} {result['wall']:>8.2f} {result['mean'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} "
+          f"{result['exact_accuracy'] * 100:>6.1f}% {result['llm_requests']:>13}")
+  stats = report["daemon"]["stats"]
+  print(f"\nDaemon: {stats.get('requests', 0)} requests, {stats.get('llm_calls', 0)} LLM calls, "
+        f"{stats.get('merged', 0)} merged in flight, {stats.get('cache_hits', 0)} cache hits; "
+        f"{report['daemon']['fallbacks']} requests fell back to in-process")
+
+
+if __name__ == "__main__":
+  main()
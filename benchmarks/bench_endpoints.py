@@ -0,0 +1,84 @@
+"""
+Benchmark for AgentGDB's multi-endpoint support: hedged requests and the circuit breaker.
+
+Starts local mock servers with different latencies (benchmarks/mock_llm_server.py) and runs
+the query corpus through gdb_llm_prompt with a comma-separated base_url:
+
+- slow-primary: the preferred server is slow to first token, a second one is fast. Compared
+  with hedging off and on.
+- dead-primary: the preferred server refuses connections. Reports how many requests still go
+  to it once its circuit is open.
+
+Usage: python benchmarks/bench_endpoints.py [--slow-ttft-ms 800] [--hedge-delay 0.1] [--limit 16]
+"""
+import argparse
+import json
+import socket
+import tempfile
+
+import run_benchmark # Also puts the stand-in 'gdb' module on sys.path
+import mock_llm_server
+
+
+def unused_port_url():
+  """A base URL on a local port nothing listens on."""
+  sock = socket.socket()
+  sock.bind(("127.0.0.1", 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return f"http://127.0.0.1:{port}/v1"
+
+
+def run_scenario(base_urls, queries, hedge_delay):
+  with tempfile.TemporaryDirectory() as home_dir:
+    plugin = run_benchmark.load_plugin(home_dir, ",".join(base_urls))
+    plugin.g_hedge_delay = hedge_delay
+    results = run_benchmark.run_queries(plugin, queries)
+    latencies = [r["seconds"] for r in results]
+    return {
+      "mean": sum(latencies) / len(latencies),
+      "p50": run_benchmark.percentile(latencies, 50),
+      "p95": run_benchmark.percentile(latencies, 95),
+      "exact_accuracy": sum(r["exact"] for r in results) / len(results),
+      "endpoints": {url: dict(health) for url, health in plugin.g_endpoint_health.items()},
+    }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark hedged requests and failover across mock LLM endpoints.")
+  parser.add_argument("--slow-ttft-ms", type=float, default=800.0, help="Time to first token of the slow server.")
+  parser.add_argument("--fast-ttft-ms", type=float, default=20.0, help="Time to first token of the fast server.")
+  parser.add_argument("--token-latency-ms", type=float, default=2.0)
+  parser.add_argument("--hedge-delay", type=float, default=0.1, help="Hedge delay in seconds for the hedged runs.")
+  parser.add_argument("--limit", type=int, default=16, help="Only use the first N queries.")
+  parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+  args = parser.parse_args()
+
+  with open(mock_llm_server.DEFAULT_QUERIES_FILE, "r") as f:
+    queries = json.load(f)[:args.limit]
+  slow = mock_llm_server.start_server(mock_llm_server.MockSettings(ttft_ms=args.slow_ttft_ms, token_latency_ms=args.token_latency_ms))
+  fast = mock_llm_server.start_server(mock_llm_server.MockSettings(ttft_ms=args.fast_ttft_ms, token_latency_ms=args.token_latency_ms))
+  dead_url = unused_port_url()
+  try:
+    report = {
+      "slow-primary, no hedging": run_scenario([slow.base_url, fast.base_url], queries, 0.0),
+      "slow-primary, hedged": run_scenario([slow.base_url, fast.base_url], queries, args.hedge_delay),
+      "dead-primary": run_scenario([dead_url, fast.base_url], queries, args.hedge_delay),
+    }
+  finally:
+    slow.shutdown()
+    fast.shutdown()
+
+  if args.json:
+    print(json.dumps(report, indent=1))
+    return
+  names = {slow.base_url: "slow", fast.base_url: "fast", dead_url: "dead"}
+  print(f"{'scenario':<26} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'exact':>7}")
+  for scenario, result in report.items():
+    print(f"{scenario:<26} {result['mean'] * 1000:>9.1f} {result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} {result['exact_accuracy'] * 100:>6.1f}%")
+    for url, health in result["endpoints"].items():
+      print(f"  {names[url]}: {health['requests']} requests, {health['errors']} errors, {health['hedges_won']} hedges won")
+
+
+if __name__ == "__main__":
+  main()
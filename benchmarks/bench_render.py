@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for rendering streamed LLM tokens (agentgdb.py's TokenRenderer).
+
+Feeds synthetic tokens through the way query_llm used to show and collect them (one write and
+flush per token, response built by string concatenation) and through the buffered renderer
+with list accumulation, with stdout going to a pipe that another thread drains, as under
+'gdb -batch' in CI. Reports tokens per second for each.
+
+Usage: python benchmarks/bench_render.py [--tokens 200000] [--render-interval 0.05] [--render-bytes 256]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import run_benchmark # Also puts the stand-in 'gdb' module on sys.path
+
+TOKEN_TEXT = "The command to set a breakpoint at line 42 in main.c is break main.c:42 and then run\n"
+
+
+def make_tokens(count):
+  words = TOKEN_TEXT.replace("\n", " \n").split(" ")
+  return [(words[i % len(words)] + " ") if words[i % len(words)] != "\n" else "\n" for i in range(count)]
+
+
+def render_per_token(plugin, tokens):
+  """What query_llm did before TokenRenderer: print_llm per token, += per token."""
+  collected = ""
+  for token in tokens:
+    plugin.print_llm(token)
+    collected += token
+  print("")
+  return collected
+
+
+def render_buffered(plugin, tokens):
+  renderer = plugin.TokenRenderer()
+  parts = []
+  for token in tokens:
+    renderer.write(token)
+    parts.append(token)
+  renderer.finish()
+  return "".join(parts)
+
+
+def render_quiet(plugin, tokens):
+  parts = []
+  for token in tokens:
+    parts.append(token)
+  return "".join(parts)
+
+
+def measure(fn, plugin, tokens):
+  """Runs fn with stdout on a pipe drained by a background thread. Returns tokens per second."""
+  read_fd, write_fd = os.pipe()
+  drained = []
+  def drain():
+    total = 0
+    while True:
+      chunk = os.read(read_fd, 1 << 16)
+      if not chunk:
+        break
+      total += len(chunk)
+    drained.append(total)
+  thread = threading.Thread(target=drain, daemon=True)
+  thread.start()
+  saved = sys.stdout
+  sys.stdout = os.fdopen(write_fd, "w", buffering=1 << 16)
+  try:
+    start = time.perf_counter()
+    fn(plugin, tokens)
+    sys.stdout.flush()
+    seconds = time.perf_counter() - start
+  finally:
+    sys.stdout.close()
+    sys.stdout = saved
+  thread.join()
+  os.close(read_fd)
+  return len(tokens) / seconds, drained[0]
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark rendering of streamed LLM tokens.")
+  parser.add_argument("--tokens", type=int, default=200000)
+  parser.add_argument("--render-interval", type=float, default=None, help="Override [Display] render_interval (seconds).")
+  parser.add_argument("--render-bytes", type=int, default=None, help="Override [Display] render_bytes.")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as home_dir:
+    plugin = run_benchmark.load_plugin(home_dir, "http://127.0.0.1:9/v1")
+  if args.render_interval is not None:
+    plugin.g_render_interval = args.render_interval
+  if args.render_bytes is not None:
+    plugin.g_render_bytes = args.render_bytes
+  tokens = make_tokens(args.tokens)
+  print(f"{len(tokens)} tokens, render_interval {plugin.g_render_interval}s, render_bytes {plugin.g_render_bytes}")
+  print(f"{'renderer':<28} {'tokens/s':>12} {'bytes out':>10}")
+  for name, fn in [("per-token write + concat", render_per_token), ("buffered + list", render_buffered), ("quiet", render_quiet)]:
+    rate, written = measure(fn, plugin, tokens)
+    print(f"{name:<28} {rate:>12,.0f} {written:>10}")
+
+
+if __name__ == "__main__":
+  main()
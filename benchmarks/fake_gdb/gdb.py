@@ -0,0 +1,152 @@
+"""
+Stand-in for GDB's built-in 'gdb' Python module, so agentgdb.py can run outside GDB.
+
+'help' commands are answered from recorded output (benchmarks/data/gdb_help.json). Other
+commands are accepted if their first word names a known command and are logged in
+'executed'; anything else raises gdb.error the way GDB does for undefined commands.
+"""
+import json
+import os
+import queue
+import shlex
+
+_DATA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "gdb_help.json")
+
+with open(_DATA_FILE, "r") as _f:
+  _recorded = json.load(_f)
+
+VERSION = _recorded["version"]
+HOST_CONFIG = "x86_64-pc-linux-gnu"
+PYTHONDIR = ""
+
+COMMAND_NONE = -1
+COMMAND_RUNNING = 0
+COMMAND_DATA = 1
+COMMAND_STACK = 2
+COMMAND_FILES = 3
+COMMAND_SUPPORT = 4
+COMMAND_STATUS = 5
+COMMAND_BREAKPOINTS = 6
+COMMAND_TRACEPOINTS = 7
+COMMAND_OBSCURE = 8
+COMMAND_MAINTENANCE = 9
+COMMAND_TUI = 10
+COMMAND_USER = 13
+
+COMPLETE_NONE = 0
+COMPLETE_FILENAME = 1
+COMPLETE_LOCATION = 2
+COMPLETE_COMMAND = 3
+COMPLETE_SYMBOL = 4
+COMPLETE_EXPRESSION = 5
+
+help_text = dict(_recorded["help"])
+executed = [] # Every non-help command passed to execute(), in order
+_known_commands = set()
+for _text in help_text.values():
+  for _line in _text.split("\n"):
+    _names, _sep, _summary = _line.partition(" -- ")
+    if _sep:
+      for _name in _names.split(","):
+        _known_commands.add(_name.strip().split(" ")[0])
+
+
+class error(RuntimeError):
+  pass
+
+
+class GdbError(Exception):
+  pass
+
+
+class Command(object):
+  def __init__(self, name, command_class, completer_class=COMPLETE_NONE, prefix=False):
+    self.name = name
+
+  def dont_repeat(self):
+    pass
+
+
+class _EventRegistry(object):
+  def __init__(self):
+    self.handlers = []
+
+  def connect(self, handler):
+    self.handlers.append(handler)
+
+  def disconnect(self, handler):
+    if handler in self.handlers:
+      self.handlers.remove(handler)
+
+  def fire(self, event=None):
+    for handler in list(self.handlers):
+      handler(event)
+
+
+class events(object):
+  new_objfile = _EventRegistry()
+  clear_objfiles = _EventRegistry()
+  stop = _EventRegistry()
+  cont = _EventRegistry()
+  exited = _EventRegistry()
+  new_thread = _EventRegistry()
+  new_inferior = _EventRegistry()
+  before_prompt = _EventRegistry()
+  memory_changed = _EventRegistry()
+  register_changed = _EventRegistry()
+
+
+def execute(command, from_tty=False, to_string=False):
+  command = command.strip()
+  if command.startswith("help "):
+    topic = command[len("help "):].strip()
+    if topic not in help_text:
+      raise error(f'Undefined command: "{topic}".  Try "help".')
+    return help_text[topic] if to_string else None
+  name = command.split(" ")[0].split("/")[0] # 'print/x' and 'x/16xw' take a /FMT suffix
+  if name not in _known_commands:
+    raise error(f'Undefined command: "{name}".  Try "help".')
+  executed.append(command)
+  return "" if to_string else None
+
+
+def string_to_argv(arg):
+  return shlex.split(arg)
+
+
+_posted_events = queue.Queue()
+
+
+def post_event(fn):
+  # GDB runs posted callables on its own thread from its event loop; see process_events().
+  _posted_events.put(fn)
+
+
+def process_events(timeout=0.0):
+  """Stands in for GDB's event loop: runs posted callables on the calling thread, waiting up to
+  timeout seconds for the first one. Returns how many ran."""
+  count = 0
+  try:
+    fn = _posted_events.get(timeout=timeout) if timeout > 0 else _posted_events.get_nowait()
+    while True:
+      fn()
+      count += 1
+      fn = _posted_events.get_nowait()
+  except queue.Empty:
+    return count
+
+
+def selected_inferior():
+  return None
+
+
+def objfiles():
+  return []
+
+
+def lookup_global_symbol(name, domain=None):
+  return None
+
+
+def lookup_static_symbol(name, domain=None):
+  return None
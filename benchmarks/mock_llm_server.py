@@ -0,0 +1,330 @@
+"""
+Local OpenAI-compatible mock server for benchmarking AgentGDB without a real model.
+
+It serves /v1/chat/completions (streaming and non-streaming) and /v1/models. Answers are
+scripted from the query corpus: the server recognizes the pipeline stage from the system
+prompt and answers the way a perfect model would, but only if the prompt actually contains
+what that model would need (the right class listing, the right command help). So retrieval
+or pruning mistakes still show up as wrong or failed commands.
+
+Latency is simulated with a per-request time to first token (plus an optional prefill cost
+per 1000 prompt characters) and a per-token decode delay. A share of streams can be made to
+stall after the response headers, like an overloaded or wedged server.
+
+Usage: python benchmarks/mock_llm_server.py [--port 8080] [--token-latency-ms 20] ...
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_QUERIES_FILE = os.path.join(_BENCH_DIR, "data", "queries.json")
+DEFAULT_HELP_FILE = os.path.join(_BENCH_DIR, "data", "gdb_help.json")
+
+NO_VALID_COMMAND = "# No valid command"
+WARMUP_USER_MESSAGE = "warmup"
+
+
+def normalize_query(query):
+  return " ".join(query.lower().split()).rstrip(".?! ")
+
+
+def split_tokens(text):
+  """Splits text into word-sized pieces, roughly one streamed token each."""
+  return re.findall(r"\s*\S+|\s+", text)
+
+
+class MockSettings(object):
+  def __init__(self, ttft_ms=50.0, token_latency_ms=10.0, prefill_ms_per_1k_chars=0.0,
+               think_tokens=0, trailing_tokens=0, cold_start_ms=0.0, format_error_rate=0.0,
+               reject_response_format=False, stall_rate=0.0, stall_ms=0.0, stall_stage=None):
+    self.ttft_ms = ttft_ms
+    self.token_latency_ms = token_latency_ms
+    self.prefill_ms_per_1k_chars = prefill_ms_per_1k_chars
+    self.think_tokens = think_tokens           # <think> tokens emitted before every answer
+    self.trailing_tokens = trailing_tokens     # Chatter emitted after stage 1 and 3 answers
+    self.cold_start_ms = cold_start_ms         # Extra delay for the first request (model load)
+    self.format_error_rate = format_error_rate # Share of queries whose first stage 1/3 answer is malformed
+    self.reject_response_format = reject_response_format # Answer 400 to response_format, like servers without it
+    self.stall_rate = stall_rate               # Share of streamed requests that stall before their first token
+    self.stall_ms = stall_ms                   # How long a stalled stream hangs
+    self.stall_stage = stall_stage             # Only stall requests of this stage (e.g. "stage5"); None is any
+
+
+class MockScript(object):
+  """Decides what a well-behaved model would answer for each stage prompt."""
+
+  def __init__(self, queries_file=DEFAULT_QUERIES_FILE, help_file=DEFAULT_HELP_FILE):
+    with open(queries_file, "r") as f:
+      self.queries = {normalize_query(entry["query"]): entry for entry in json.load(f)}
+    with open(help_file, "r") as f:
+      self.help_text = json.load(f)["help"]
+
+  def answer(self, system_message, user_message, format_error_rate=0.0):
+    """Returns (answer, stage) for a chat request."""
+    query, _, retry_note = user_message.partition("\n\n") # AgentGDB appends a note when it retries
+    entry = self.queries.get(normalize_query(query))
+    # A deterministic share of queries gets a chatty first answer that fails validation
+    sloppy = not retry_note and zlib.crc32(normalize_query(query).encode("utf-8")) % 1000 < format_error_rate * 1000
+    user_message = query
+    if system_message.startswith("**Stage 1"):
+      if entry is None:
+        return "Do something\nsupport", "stage1"
+      if sloppy:
+        return f"{user_message.strip().capitalize()}\nThe command class is {entry['class']}", "stage1"
+      return f"{user_message.strip().capitalize()}\n{entry['class']}", "stage1"
+    if system_message.startswith("**Stage 3"):
+      if entry is None or not self._lists_command(system_message, entry["command"]):
+        return "", "stage3"
+      if sloppy:
+        return f"I would use {entry['command']}", "stage3"
+      return entry["command"], "stage3"
+    if system_message.startswith("**Fast Mode"):
+      if entry is None or f"### {entry['command']}\n" not in system_message:
+        return NO_VALID_COMMAND, "fast"
+      return entry["final"], "fast"
+    if system_message.startswith("**Iterate"):
+      return "# Done", "iterate" # The first command block always answers the query
+    if entry is None:
+      return NO_VALID_COMMAND, "other"
+    # Stage 5 and any other generation prompt: needs the expected command's help
+    help_text = self.help_text.get(entry["command"], "")
+    first_help_line = help_text.strip().split("\n")[0] if help_text else None
+    if first_help_line and first_help_line in system_message:
+      return entry["final"], "stage5"
+    return NO_VALID_COMMAND, "stage5"
+
+  @staticmethod
+  def _lists_command(class_listing, command):
+    for line in class_listing.split("\n"):
+      names, sep, _ = line.partition(" -- ")
+      if sep and command in [name.strip() for name in names.split(",")]:
+        return True
+    return False
+
+
+class MockStats(object):
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.tokens_sent = 0
+    self.disconnects = 0 # Streams the client closed before the answer was complete
+    self.stall_candidates = 0
+    self.stalls = 0
+
+  def add(self, requests=0, tokens=0, disconnects=0):
+    with self.lock:
+      self.requests += requests
+      self.tokens_sent += tokens
+      self.disconnects += disconnects
+
+  def next_stall(self, rate):
+    """Whether the next candidate request stalls; spreads stalls evenly at the given rate."""
+    with self.lock:
+      self.stall_candidates += 1
+      stall = int(self.stall_candidates * rate) != int((self.stall_candidates - 1) * rate)
+      self.stalls += stall
+      return stall
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args):
+    pass
+
+  def handle(self):
+    try:
+      super().handle()
+    except (BrokenPipeError, ConnectionResetError):
+      pass # The client closed a kept-alive connection, e.g. after cancelling a stream
+
+  def _send_json(self, status, body):
+    data = json.dumps(body).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def _send_chunk(self, payload):
+    data = ("data: " + payload + "\n\n").encode("utf-8")
+    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    self.wfile.flush()
+
+  @staticmethod
+  def _apply_response_format(response_format, answer):
+    """Wraps an answer the way a server enforcing a json_schema enum would."""
+    if not response_format or response_format.get("type") != "json_schema":
+      return answer
+    properties = response_format["json_schema"]["schema"]["properties"]
+    key = next(iter(properties))
+    choices = properties[key].get("enum", [])
+    for line in reversed(answer.split("\n")):
+      # Constrained decoding can only produce a listed value; a sloppy line is cut to the one it names
+      for choice in sorted(choices, key=len, reverse=True):
+        if line.strip() == choice or line.strip().endswith(" " + choice):
+          return json.dumps({key: choice})
+    return json.dumps({key: choices[0] if choices else ""})
+
+  def do_GET(self):
+    if self.path.rstrip("/").endswith("/models"):
+      self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "agentgdb"}]})
+    else:
+      self._send_json(404, {"error": {"message": "not found"}})
+
+  def do_POST(self):
+    if not self.path.rstrip("/").endswith("/chat/completions"):
+      self._send_json(404, {"error": {"message": "not found"}})
+      return
+    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+    server = self.server
+    messages = request.get("messages", [])
+    system_message = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    user_message = "".join(m.get("content", "") for m in messages if m.get("role") == "user")
+    settings = server.settings
+    if request.get("response_format") and settings.reject_response_format:
+      self._send_json(400, {"error": {"message": "response_format is not supported", "type": "invalid_request_error"}})
+      return
+
+    delay_ms = settings.ttft_ms + settings.prefill_ms_per_1k_chars * len(system_message + user_message) / 1000.0
+    with server.cold_lock:
+      if not server.warm:
+        delay_ms += settings.cold_start_ms
+        server.warm = True
+    time.sleep(delay_ms / 1000.0)
+
+    if user_message.strip() == WARMUP_USER_MESSAGE:
+      answer, stage = "ok", "warmup"
+    else:
+      answer, stage = server.script.answer(system_message, user_message, settings.format_error_rate)
+      answer = self._apply_response_format(request.get("response_format"), answer)
+    text = answer
+    if settings.think_tokens:
+      text = "<think>\n" + "hmm " * settings.think_tokens + "\n</think>\n\n" + text
+    if settings.trailing_tokens and stage in ("stage1", "stage3"):
+      text += "\n" + "Note: this is the best match. " * max(1, settings.trailing_tokens // 7)
+
+    tokens = split_tokens(text)
+    finish_reason = "stop"
+    if request.get("max_tokens") and len(tokens) > request["max_tokens"]:
+      tokens = tokens[:request["max_tokens"]]
+      finish_reason = "length"
+    for stop in request.get("stop") or []:
+      joined = "".join(tokens)
+      if stop in joined:
+        tokens = split_tokens(joined[:joined.index(stop)])
+        finish_reason = "stop"
+    server.stats.add(requests=1)
+    prompt_tokens = (len(system_message) + len(user_message)) // 4
+    stall = (settings.stall_rate > 0 and request.get("stream") and settings.stall_stage in (None, stage)
+             and server.stats.next_stall(settings.stall_rate))
+
+    if not request.get("stream"):
+      server.stats.add(tokens=len(tokens))
+      self._send_json(200, {
+        "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": request.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)},
+      })
+      return
+
+    self.send_response(200)
+    self.send_header("Content-Type", "text/event-stream")
+    self.send_header("Transfer-Encoding", "chunked")
+    self.end_headers()
+    base = {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()), "model": request.get("model", "mock")}
+    sent = 0
+    try:
+      if stall:
+        self.wfile.flush()
+        time.sleep(settings.stall_ms / 1000.0)
+      for i, token in enumerate(tokens):
+        if i:
+          time.sleep(settings.token_latency_ms / 1000.0)
+        self._send_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])))
+        sent += 1
+      self._send_chunk(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": finish_reason}])))
+      if (request.get("stream_options") or {}).get("include_usage"):
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": sent, "total_tokens": prompt_tokens + sent}
+        self._send_chunk(json.dumps(dict(base, choices=[], usage=usage)))
+      self._send_chunk("[DONE]")
+      self.wfile.write(b"0\r\n\r\n")
+      self.wfile.flush()
+    except (BrokenPipeError, ConnectionResetError):
+      server.stats.add(disconnects=1)
+      self.close_connection = True
+    finally:
+      server.stats.add(tokens=sent)
+
+
+def start_server(settings=None, script=None, host="127.0.0.1", port=0):
+  """Starts the mock server on a background thread. Returns the server; see server.base_url."""
+  server = ThreadingHTTPServer((host, port), MockLLMHandler)
+  server.daemon_threads = True
+  server.settings = settings or MockSettings()
+  server.script = script or MockScript()
+  server.stats = MockStats()
+  server.cold_lock = threading.Lock()
+  server.warm = False
+  server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+  thread = threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True)
+  thread.start()
+  return server
+
+
+def add_settings_arguments(parser):
+  parser.add_argument("--ttft-ms", type=float, default=50.0, help="Time to first token per request.")
+  parser.add_argument("--token-latency-ms", type=float, default=10.0, help="Delay between streamed tokens.")
+  parser.add_argument("--prefill-ms-per-1k-chars", type=float, default=0.0, help="Extra time to first token per 1000 prompt characters.")
+  parser.add_argument("--think-tokens", type=int, default=0, help="Emit a <think> block of this many tokens before each answer.")
+  parser.add_argument("--trailing-tokens", type=int, default=0, help="Emit about this many tokens of chatter after stage 1 and 3 answers.")
+  parser.add_argument("--cold-start-ms", type=float, default=0.0, help="Extra delay on the first request, like a model load.")
+  parser.add_argument("--reject-response-format", action="store_true", help="Reject requests that set response_format with HTTP 400.")
+  parser.add_argument("--format-error-rate", type=float, default=0.0, help="Share of queries (0-1) whose first stage 1/3 answer is malformed.")
+  parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of streamed requests (0-1) that hang before their first token.")
+  parser.add_argument("--stall-ms", type=float, default=5000.0, help="How long a stalled stream hangs.")
+  parser.add_argument("--stall-stage", default=None, help="Only stall requests of this stage (stage1, stage3, stage5, fast).")
+
+
+def settings_from_args(args):
+  return MockSettings(
+    ttft_ms=args.ttft_ms,
+    token_latency_ms=args.token_latency_ms,
+    prefill_ms_per_1k_chars=args.prefill_ms_per_1k_chars,
+    think_tokens=args.think_tokens,
+    trailing_tokens=args.trailing_tokens,
+    cold_start_ms=args.cold_start_ms,
+    format_error_rate=args.format_error_rate,
+    reject_response_format=args.reject_response_format,
+    stall_rate=args.stall_rate,
+    stall_ms=args.stall_ms,
+    stall_stage=args.stall_stage,
+  )
+
+
+def main():
+  parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server for AgentGDB benchmarks.")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8080)
+  parser.add_argument("--queries", default=DEFAULT_QUERIES_FILE, help="Query corpus with scripted answers.")
+  parser.add_argument("--help-data", default=DEFAULT_HELP_FILE, help="Recorded GDB help output.")
+  add_settings_arguments(parser)
+  args = parser.parse_args()
+
+  server = start_server(settings_from_args(args), MockScript(args.queries, args.help_data), args.host, args.port)
+  print(f"Mock LLM server listening on {server.base_url}")
+  try:
+    while True:
+      time.sleep(3600)
+  except KeyboardInterrupt:
+    server.shutdown()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,224 @@
+"""
+Offline latency and accuracy benchmark for AgentGDB's gdb_llm_prompt.
+
+Runs agentgdb.py outside GDB against the stand-in 'gdb' module (benchmarks/fake_gdb) and the
+mock OpenAI-compatible server (benchmarks/mock_llm_server.py), so it needs no GDB, network or
+model. For each pipeline configuration it reports end-to-end and per-stage latency,
+throughput, and how often the executed command matched the expected one.
+
+Usage: python benchmarks/run_benchmark.py [--modes accurate,fast] [--token-latency-ms 20] [--json]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+_BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_BENCH_DIR, "fake_gdb"))
+sys.path.insert(0, _BENCH_DIR)
+
+import gdb # The stand-in from benchmarks/fake_gdb
+import mock_llm_server
+
+PLUGIN_PATH = os.path.join(os.path.dirname(_BENCH_DIR), "agentgdb", "agentgdb.py")
+
+# Benchmark configurations: name -> plugin globals to set before the run
+MODES = {
+  "accurate": {},
+  "fast": {"g_pipeline_mode": "fast"},
+  "retrieval": {"g_retrieval_enabled": True},
+  "speculative": {"g_speculative_enabled": True},
+  "cached": {"g_query_cache_enabled": True}, # Second pass over the corpus with a warm query cache
+  "pruned": {}, # Tight help budgets, see STAGE_SETTINGS
+  "structured": {"g_structured_output": True},
+  "timeouts": {}, # Tight per-stage timeouts, see STAGE_SETTINGS; pair with --stall-rate
+}
+# Per-stage settings (g_stage_settings) to override for a mode. The recorded help is much
+# smaller than a real GDB's, so "pruned" uses budgets small enough to actually cut it.
+STAGE_SETTINGS = {
+  "pruned": {"stage3": {"help_max_commands": 6, "help_max_tokens": 120}, "stage5": {"help_max_tokens": 40}},
+  "timeouts": {"stage1": {"timeout": 0.5}, "stage3": {"timeout": 0.5}, "stage5": {"timeout": 0.5}},
+}
+# Values the mode settings are restored to after each run
+MODE_DEFAULTS = {
+  "g_pipeline_mode": "accurate",
+  "g_retrieval_enabled": False,
+  "g_speculative_enabled": False,
+  "g_query_cache_enabled": False,
+  "g_structured_output": False,
+}
+DEFAULT_MODES = ["accurate", "fast", "retrieval", "speculative", "cached", "pruned", "structured"]
+REPORTED_STAGES = ["stage1", "stage2", "stage3", "stage4", "stage5", "fast", "retrieval", "execute"]
+
+_plugin_counter = 0
+
+
+def load_plugin(home_dir, base_url, extra_config=""):
+  """Loads a fresh copy of agentgdb.py configured to talk to base_url, with its caches in home_dir."""
+  global _plugin_counter
+  os.environ["HOME"] = home_dir
+  with open(os.path.join(home_dir, ".agentgdb_config.ini"), "w") as f:
+    f.write(f"[Credentials]\nbase_url = {base_url}\nmodel_identifier = mock-model\n\n[Debug]\nverbose = false\n\n[Cache]\nquery_cache = false\n")
+    f.write(extra_config)
+  _plugin_counter += 1
+  spec = importlib.util.spec_from_file_location(f"agentgdb_plugin_{_plugin_counter}", PLUGIN_PATH)
+  plugin = importlib.util.module_from_spec(spec)
+  with contextlib.redirect_stdout(io.StringIO()):
+    spec.loader.exec_module(plugin)
+    if not plugin.ensure_openai_client_ready():
+      raise RuntimeError("AgentGDB could not set up its OpenAI client; is the openai package installed?")
+  return plugin
+
+
+def percentile(values, pct):
+  values = sorted(values)
+  if not values:
+    return 0.0
+  return values[max(0, int(round(pct / 100.0 * len(values) + 0.5)) - 1)]
+
+
+def run_queries(plugin, queries):
+  """Runs every query through gdb_llm_prompt. Returns per-query results."""
+  results = []
+  for entry in queries:
+    first = len(gdb.executed)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+      plugin.gdb_llm_prompt(entry["query"])
+    seconds = time.perf_counter() - start
+    executed = gdb.executed[first:]
+    results.append({
+      "query": entry["query"],
+      "expected": entry["final"],
+      "executed": executed,
+      "seconds": seconds,
+      "exact": executed == [entry["final"]],
+      "command": bool(executed) and executed[0].split()[0] == entry["final"].split()[0],
+    })
+  return results
+
+
+def run_mode(plugin, mode, queries):
+  """Configures the plugin for a mode and benchmarks the corpus. Returns the report for the mode."""
+  for name, value in MODES[mode].items():
+    setattr(plugin, name, value)
+  saved_settings = {stage: dict(plugin.g_stage_settings[stage]) for stage in STAGE_SETTINGS.get(mode, {})}
+  for stage, settings in STAGE_SETTINGS.get(mode, {}).items():
+    plugin.g_stage_settings[stage].update(settings)
+  plugin.query_cache_clear()
+  if mode == "cached":
+    run_queries(plugin, queries) # Fill the cache; the measured pass below should hit it
+  plugin.reset_stats()
+
+  start = time.perf_counter()
+  results = run_queries(plugin, queries)
+  wall = time.perf_counter() - start
+
+  for name in MODES[mode]:
+    setattr(plugin, name, MODE_DEFAULTS[name])
+  for stage, settings in saved_settings.items():
+    plugin.g_stage_settings[stage] = settings
+
+  latencies = [r["seconds"] for r in results]
+  stages = {}
+  for stage in REPORTED_STAGES:
+    samples = list(plugin.g_stats["seconds"].get(stage, []))
+    if samples:
+      stages[stage] = {"count": len(samples), "p50": percentile(samples, 50), "p95": percentile(samples, 95)}
+  return {
+    "mode": mode,
+    "queries": len(results),
+    "mean": sum(latencies) / len(latencies),
+    "p50": percentile(latencies, 50),
+    "p95": percentile(latencies, 95),
+    "throughput": len(results) / wall if wall > 0 else 0.0,
+    "exact_accuracy": sum(r["exact"] for r in results) / len(results),
+    "command_accuracy": sum(r["command"] for r in results) / len(results),
+    "stages": stages,
+    "prompt_tokens": sum(plugin.g_stats["prompt_tokens"].values()) / len(results),
+    "mismatches": [r for r in results if not r["exact"]],
+  }
+
+
+def measure_first_query(settings, queries, warmup):
+  """Latency of the first query on a fresh plugin and server, optionally after agent-warmup."""
+  server = mock_llm_server.start_server(settings)
+  try:
+    with tempfile.TemporaryDirectory() as home_dir:
+      plugin = load_plugin(home_dir, server.base_url)
+      if warmup:
+        with contextlib.redirect_stdout(io.StringIO()):
+          plugin.warmup_llm_server()
+      return run_queries(plugin, queries[:1])[0]["seconds"]
+  finally:
+    server.shutdown()
+
+
+def print_report(reports, first_query):
+  print(f"{'mode':<12} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'q/s':>7} {'exact':>7} {'command':>8} {'prompt tok/q':>13}")
+  for report in reports:
+    print(f"{report['mode']:<12} {report['mean'] * 1000:>9.1f} {report['p50'] * 1000:>9.1f} {report['p95'] * 1000:>9.1f} "
+          f"{report['throughput']:>7.2f} {report['exact_accuracy'] * 100:>6.1f}% {report['command_accuracy'] * 100:>7.1f}% {report['prompt_tokens']:>13.0f}")
+  print()
+  print("Per-stage latency (p50 / p95 ms):")
+  for report in reports:
+    cells = [f"{stage} {s['p50'] * 1000:.1f}/{s['p95'] * 1000:.1f}" for stage, s in report["stages"].items()]
+    print(f"  {report['mode']:<12} " + ", ".join(cells))
+  if first_query:
+    print()
+    print(f"First query: cold {first_query['cold'] * 1000:.1f} ms, after agent-warmup {first_query['warm'] * 1000:.1f} ms")
+  for report in reports:
+    for mismatch in report["mismatches"]:
+      print(f"  [{report['mode']}] '{mismatch['query']}': expected '{mismatch['expected']}', executed {mismatch['executed']}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark AgentGDB's pipeline offline against a mock GDB and LLM server.")
+  parser.add_argument("--modes", default=",".join(DEFAULT_MODES), help=f"Comma-separated subset of: {', '.join(MODES)}.")
+  parser.add_argument("--queries", default=mock_llm_server.DEFAULT_QUERIES_FILE, help="Query corpus (JSON list of query/class/command/final).")
+  parser.add_argument("--limit", type=int, default=0, help="Only use the first N queries.")
+  parser.add_argument("--first-query", action="store_true", help="Also compare first-query latency with and without agent-warmup.")
+  parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+  mock_llm_server.add_settings_arguments(parser)
+  args = parser.parse_args()
+
+  modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+  unknown = [mode for mode in modes if mode not in MODES]
+  if unknown:
+    parser.error(f"unknown mode(s): {', '.join(unknown)}")
+  with open(args.queries, "r") as f:
+    queries = json.load(f)
+  if args.limit:
+    queries = queries[:args.limit]
+
+  settings = mock_llm_server.settings_from_args(args)
+  server = mock_llm_server.start_server(settings, mock_llm_server.MockScript(args.queries))
+  try:
+    with tempfile.TemporaryDirectory() as home_dir:
+      plugin = load_plugin(home_dir, server.base_url)
+      reports = [run_mode(plugin, mode, queries) for mode in modes]
+  finally:
+    server.shutdown()
+
+  first_query = None
+  if args.first_query:
+    first_query = {
+      "cold": measure_first_query(settings, queries, warmup=False),
+      "warm": measure_first_query(settings, queries, warmup=True),
+    }
+
+  if args.json:
+    print(json.dumps({"reports": reports, "first_query": first_query, "llm_requests": server.stats.requests,
+                      "llm_tokens": server.stats.tokens_sent}, indent=1))
+  else:
+    print_report(reports, first_query)
+    print(f"\nMock server: {server.stats.requests} requests, {server.stats.tokens_sent} tokens streamed, {server.stats.disconnects} streams closed early")
+
+
+if __name__ == "__main__":
+  main()